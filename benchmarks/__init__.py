@@ -0,0 +1 @@
+"""Benchmarks of the server, run with `python -m benchmarks.<name>`."""
@@ -0,0 +1,133 @@
+"""Load test of the room broadcast with simulated slow sockets.
+
+Every room holds fast clients and a few slow ones, whose sockets take a while
+to send each message. Events are broadcast at a steady rate, and the delay
+between a broadcast and the moment each socket sends the message is recorded
+to report latency percentiles per room, for the queued fan-out and for the
+previous sequential fan-out.
+"""
+import asyncio
+import json
+import statistics
+import time
+
+from server.client import Client
+from server.codes import StatusCode
+from server.connection_manager import ConnectionManager
+from server.events import EventResponse, EventType, MoveData
+
+ROOMS = 5
+FAST_CLIENTS = 8
+SLOW_CLIENTS = 2
+SLOW_DELAY = 0.02
+MESSAGES = 50
+INTERVAL = 0.002
+
+
+class SimulatedWebSocket:
+    """A socket recording when each message is sent."""
+
+    def __init__(self, delay: float, sent_at: dict[int, float]) -> None:
+        self.delay = delay
+        self.latencies: list[float] = []
+        self.resyncs = 0
+        self._sent_at = sent_at
+
+    async def accept(self) -> None:
+        """Accepts the connection."""
+
+    async def send_text(self, text: str) -> None:
+        """Sends a message, taking `delay` seconds."""
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        event = json.loads(text)
+        if event["type"] == EventType.SYNC:
+            self.resyncs += 1
+            return
+        self.latencies.append(time.perf_counter() - self._sent_at[event["data"]["position"]["x"]])
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """Returns a percentile of the values, in milliseconds."""
+    if len(values) < 2:
+        return values[0] * 1000 if values else 0.0
+    return statistics.quantiles(values, n=100)[percent - 1] * 1000
+
+
+async def sequential_broadcast(manager: ConnectionManager, data: EventResponse, room_code: str) -> None:
+    """The previous broadcast, awaiting each client one after the other."""
+    for connection in manager.rooms[room_code].clients:
+        await connection._websocket.send_text(json.dumps(data.dict()))
+
+
+async def run(queued: bool) -> list[tuple[str, list[float], list[float], int]]:
+    """Broadcasts the messages in every room and returns the latencies."""
+    manager = ConnectionManager()
+    sent_at: dict[int, float] = {}
+    sockets: dict[str, list[SimulatedWebSocket]] = {}
+
+    for room_num in range(ROOMS):
+        room_code = f"R{room_num:03}"
+        sockets[room_code] = []
+        for num in range(FAST_CLIENTS + SLOW_CLIENTS):
+            websocket = SimulatedWebSocket(SLOW_DELAY if num >= FAST_CLIENTS else 0, sent_at)
+            client = Client(websocket)  # type: ignore[arg-type]
+            client.username = f"user{num}"
+            if queued:
+                await client.accept()
+            if num == 0:
+                manager.create_room(client, room_code, 1)
+            else:
+                manager.join_room(client, room_code)
+            sockets[room_code].append(websocket)
+
+    for seq in range(MESSAGES):
+        response = EventResponse(
+            type=EventType.MOVE, data=MoveData(position={"x": seq, "y": 0}), status_code=StatusCode.SUCCESS
+        )
+        sent_at[seq] = time.perf_counter()
+        for room_code in sockets:
+            if queued:
+                await manager.broadcast(response, room_code)
+            else:
+                await sequential_broadcast(manager, response, room_code)
+        await asyncio.sleep(INTERVAL)
+
+    # Wait for the slow clients to receive the queued messages
+    while any(client.lag for _, room in manager.rooms for client in room.clients):
+        await asyncio.sleep(SLOW_DELAY)
+    await asyncio.sleep(SLOW_DELAY * 2)
+    for _, room in manager.rooms:
+        for client in room.clients:
+            client.stop()
+
+    return [
+        (
+            room_code,
+            [latency for websocket in room_sockets[:FAST_CLIENTS] for latency in websocket.latencies],
+            [latency for websocket in room_sockets[FAST_CLIENTS:] for latency in websocket.latencies],
+            sum(websocket.resyncs for websocket in room_sockets),
+        )
+        for room_code, room_sockets in sockets.items()
+    ]
+
+
+def main() -> None:
+    """Runs the load test for both fan-outs and prints the percentiles."""
+    for name, queued in (("sequential", False), ("queued", True)):
+        start_time = time.perf_counter()
+        results = asyncio.run(run(queued))
+        elapsed = time.perf_counter() - start_time
+
+        print(f"{name} fan-out ({elapsed:.2f}s)")
+        print(f"  {'room':<6} {'fast p50':>9} {'fast p99':>9} {'slow p50':>9} {'slow p99':>9}", end=" ")
+        print(f"{'slow recv':>9} {'resyncs':>7}")
+        for room_code, fast, slow, resyncs in results:
+            print(
+                f"  {room_code:<6} {percentile(fast, 50):>7.2f}ms {percentile(fast, 99):>7.2f}ms "
+                f"{percentile(slow, 50):>7.2f}ms {percentile(slow, 99):>7.2f}ms {len(slow):>9} {resyncs:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
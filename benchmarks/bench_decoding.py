@@ -0,0 +1,40 @@
+"""Throughput benchmark of the decoding of client requests.
+
+It compares building an EventRequest, which validates the data twice, against
+decode_request for the events sent by the clients.
+"""
+import json
+import timeit
+
+from server.encoding import loads
+from server.events import EventRequest, decode_request
+
+NUMBER = 20_000
+PAYLOADS = {
+    "move": {"type": "move", "data": {"position": {"x": 12, "y": 4}}},
+    "replace": {"type": "replace", "data": {"code": [{"from": 120, "to": 121, "value": "a"}]}},
+    "connect": {"type": "connect", "data": {"connection_type": "join", "room_code": "ABCD", "username": "kappa"}},
+    "sync": {
+        "type": "sync",
+        "data": {
+            "code": "print('Hello!')\n" * 50,
+            "collaborators": [{"id": "abc", "username": "kappa"}],
+            "owner_id": "abc",
+            "difficulty": 2,
+        },
+    },
+}
+
+
+def main() -> None:
+    """Runs the benchmark and prints the decoded requests per second."""
+    print(f"{'event':<8} {'EventRequest (req/s)':>21} {'decode_request (req/s)':>23} {'speedup':>8}")
+    for name, payload in PAYLOADS.items():
+        text = json.dumps(payload)
+        before = timeit.timeit(lambda: EventRequest(**json.loads(text)), number=NUMBER)
+        after = timeit.timeit(lambda: decode_request(loads(text)), number=NUMBER)
+        print(f"{name:<8} {NUMBER / before:>21,.0f} {NUMBER / after:>23,.0f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
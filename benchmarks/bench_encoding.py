@@ -0,0 +1,68 @@
+"""Micro-benchmark of the encoding of broadcast events.
+
+It compares, for MOVE, REPLACE and SYNC events and rooms of 2, 10 and 50
+clients, the cost of encoding an event once per recipient (as `send_json` did)
+against encoding it once per broadcast, with the standard library and orjson.
+"""
+import json
+import timeit
+
+from server import encoding
+from server.codes import StatusCode
+from server.events import EventResponse, EventType, MoveData, ReplaceData, SyncData
+
+ROOM_SIZES = (2, 10, 50)
+NUMBER = 200
+
+
+def make_events(room_size: int) -> dict[str, EventResponse]:
+    """Creates a typical event of each type for a room of the given size."""
+    code = "def say_hello() -> str:\n    return 'Hello!'\n" * 100
+    return {
+        "move": EventResponse(
+            type=EventType.MOVE, data=MoveData(position={"x": 12, "y": 4}), status_code=StatusCode.SUCCESS
+        ),
+        "replace": EventResponse(
+            type=EventType.REPLACE,
+            data=ReplaceData(code=[{"from": 120, "to": 121, "value": "a"}]),
+            status_code=StatusCode.SUCCESS,
+        ),
+        "sync": EventResponse(
+            type=EventType.SYNC,
+            data=SyncData(
+                code=code,
+                collaborators=[{"id": f"{num:032x}", "username": f"user{num}"} for num in range(room_size)],
+                time={"min": 3.0, "sec": 12.0, "mil": 0.25},
+                owner_id=f"{0:032x}",
+                difficulty=2,
+            ),
+            status_code=StatusCode.SUCCESS,
+        ),
+    }
+
+
+def main() -> None:
+    """Runs the benchmark and prints the cost of a broadcast per recipient."""
+    # Each strategy is made of the encoding function and whether it's called
+    # once per recipient
+    strategies = {
+        "per recipient": (json.dumps, True),
+        "once (json)": (encoding.dumps_json, False),
+    }
+    if encoding.orjson is not None:
+        strategies["once (orjson)"] = (encoding.dumps_orjson, False)
+
+    print(f"{'event':<8} {'clients':>7} " + " ".join(f"{name:>15}" for name in strategies) + "   (us/recipient)")
+    for event_name in ("move", "replace", "sync"):
+        for size in ROOM_SIZES:
+            event = make_events(size)[event_name]
+            timings = []
+            for dumps, per_recipient in strategies.values():
+                calls = size if per_recipient else 1
+                elapsed = timeit.timeit(lambda: [dumps(event.dict()) for _ in range(calls)], number=NUMBER)
+                timings.append(elapsed / NUMBER / size * 1e6)
+            print(f"{event_name:<8} {size:>7} " + " ".join(f"{timing:>15.2f}" for timing in timings))
+
+
+if __name__ == "__main__":
+    main()
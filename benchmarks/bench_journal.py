@@ -0,0 +1,108 @@
+"""Benchmark of the room journal: write throughput and recovery time.
+
+Rooms are created with some code, then edited with single-character changes,
+as sent while typing, spread over every room. The changes are recorded while
+the journal writes them in the background, and the time until they're all
+synced to disk gives the write throughput.
+
+The rooms are then recovered twice: by replaying the whole journal, and from
+a snapshot of the rooms followed by a short journal.
+"""
+import asyncio
+import random
+import tempfile
+import time
+from uuid import UUID
+
+from benchmarks.sources import generate_source
+from server.events import ReplaceData
+from server.journal import RoomJournal
+from server.registry import RoomRegistry
+from server.room import Room
+
+ROOMS = 10_000
+LINES = 40
+CHANGES = 200_000
+
+
+def create_rooms(journal: RoomJournal, rng: random.Random) -> RoomRegistry:
+    """Creates the rooms with some code, recording them in the journal."""
+    sources = [generate_source(LINES, seed) for seed in range(10)]
+    rooms = RoomRegistry()
+    for num in range(ROOMS):
+        room_code = f"ROOM{num:05}"
+        room, _ = rooms.create(room_code, lambda: Room(UUID(int=rng.getrandbits(128)), set(), 1))
+        journal.created(room_code, room)
+        journal.changed(room_code, room.version, room.set_code(rng.choice(sources)))
+    return rooms
+
+
+async def write(directory: str) -> tuple[RoomRegistry, float, float, int]:
+    """Records the rooms and their changes.
+
+    Returns:
+        The rooms, the time spent recording the changes, the time until they
+        were synced and the number of records.
+    """
+    rng = random.Random(0)
+    journal = RoomJournal(directory)
+    rooms = create_rooms(journal, rng)
+    journal.start(rooms)
+    room_codes = [room_code for room_code, _ in rooms]
+
+    start_time = time.perf_counter()
+    for num in range(CHANGES):
+        room_code = rng.choice(room_codes)
+        room = rooms[room_code]
+        position = rng.randrange(room.code_length + 1)
+        replace_data = ReplaceData(code=[{"from": position, "to": position, "value": rng.choice("abcdefgh \n")}])
+        replacements = room.update_code(replace_data)
+        journal.changed(room_code, room.version, replacements)
+        if num % 1000 == 0:
+            # Let the journal write in the background, as between events
+            await asyncio.sleep(0)
+    record_time = time.perf_counter() - start_time
+
+    await journal.stop()
+    return rooms, record_time, time.perf_counter() - start_time, 2 * ROOMS + CHANGES
+
+
+async def compact(directory: str, rooms: RoomRegistry) -> float:
+    """Snapshots the rooms, and returns the elapsed time."""
+    journal = RoomJournal(directory)
+    journal.recover()
+    journal.start(rooms)
+    start_time = time.perf_counter()
+    await journal.flush(compact=True)
+    elapsed = time.perf_counter() - start_time
+    await journal.stop()
+    return elapsed
+
+
+def recover(directory: str, rooms: RoomRegistry) -> float:
+    """Recovers the rooms, checks them and returns the elapsed time."""
+    start_time = time.perf_counter()
+    recovered = RoomJournal(directory).recover()
+    elapsed = time.perf_counter() - start_time
+
+    assert len(recovered) == ROOMS
+    assert all(recovered[room_code].code == room.code for room_code, room in rooms)
+    return elapsed
+
+
+def main() -> None:
+    """Runs the benchmark and prints the results."""
+    with tempfile.TemporaryDirectory() as directory:
+        rooms, record_time, sync_time, records = asyncio.run(write(directory))
+        print(f"{records} records for {ROOMS} rooms")
+        print(f"recording: {records / record_time:>10.0f} records/s")
+        print(f"synced:    {records / sync_time:>10.0f} records/s")
+
+        print(f"recovery from the journal:  {recover(directory, rooms) * 1000:>8.1f} ms")
+        compact_time = asyncio.run(compact(directory, rooms))
+        print(f"snapshot of the rooms:      {compact_time * 1000:>8.1f} ms")
+        print(f"recovery from the snapshot: {recover(directory, rooms) * 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Benchmark of each code modifier, and of the steps around them.
+
+`Modifiers.__init__`, which scans the tokens of the code, every registered
+mutator and `_get_replacements` are timed on generated sources of 10 to 50k
+lines, at every difficulty. Each mutator runs on new modifiers, as when a
+room introduces bugs in code that changed, so the candidates it builds from
+the token index are part of its time. The best of a few runs is kept.
+
+The timings are printed as scaling curves, with the growth exponent of each
+step between the smallest and the largest sources, and the share of each
+mutator at the largest one. With `--baseline`, every timing is compared to
+the results saved by a previous run on the same machine, with `--output`, and
+the command fails if any step got slower than the threshold.
+"""
+import argparse
+import gc
+import json
+import math
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from benchmarks.sources import generate_source
+from server.modifiers import MUTATORS, Modifiers
+from server.token_index import TokenIndex, split_lines
+
+SIZES = (10, 100, 1_000, 10_000, 50_000)
+DIFFICULTIES = (1, 2, 3)
+
+# The runs of each step on the smallest sources, fewer on larger ones
+REPEATS = 20
+MIN_REPEATS = 3
+
+# A step regresses once slower than its baseline by this ratio, and by more
+# than the noise floor in seconds
+THRESHOLD = 0.25
+NOISE_FLOOR = 0.0005
+
+T = TypeVar("T")
+
+INIT = "__init__"
+REPLACEMENTS = "_get_replacements"
+
+# The timings in seconds, by step, difficulty and size, as saved in JSON
+Results = dict[str, dict[str, dict[str, float]]]
+
+
+def best_time(setup: Callable[[], T], step: Callable[[T], object], repeats: int) -> float:
+    """Runs a step on new inputs, and returns its fastest time.
+
+    Args:
+        setup: Creates the input of the step, untimed.
+        step: The step.
+        repeats: The number of runs.
+
+    Returns:
+        The fastest run, in seconds.
+    """
+    best = math.inf
+    for _ in range(repeats):
+        value = setup()
+        # Collections would be timed in whichever step they happen to run
+        gc.collect()
+        gc.disable()
+        try:
+            start_time = time.perf_counter()
+            step(value)
+            best = min(best, time.perf_counter() - start_time)
+        finally:
+            gc.enable()
+    return best
+
+
+def measure(sizes: tuple[int, ...], difficulties: tuple[int, ...]) -> Results:
+    """Times every step for every size and difficulty."""
+    steps = [INIT, *MUTATORS, REPLACEMENTS]
+    results: Results = {step: {str(difficulty): {} for difficulty in difficulties} for step in steps}
+    for size in sizes:
+        code = generate_source(size)
+        lines = split_lines(code)
+        repeats = max(MIN_REPEATS, REPEATS * min(sizes) // size)
+        for difficulty in difficulties:
+            curves = {step: results[step][str(difficulty)] for step in steps}
+
+            def fresh() -> Modifiers:
+                # A new index, whose candidates are built when first needed
+                return Modifiers(code, difficulty, TokenIndex(lines), random.Random(size))
+
+            def modified() -> Modifiers:
+                modifier = fresh()
+                for mutator in MUTATORS.values():
+                    mutator.apply(modifier)
+                return modifier
+
+            curves[INIT][str(size)] = best_time(lambda: code, lambda code: Modifiers(code, difficulty), repeats)
+            for name, mutator in MUTATORS.items():
+                curves[name][str(size)] = best_time(fresh, mutator.apply, repeats)
+            curves[REPLACEMENTS][str(size)] = best_time(modified, Modifiers._get_replacements, repeats)
+    return results
+
+
+def growth(curve: dict[str, float]) -> float:
+    """The exponent of the growth of a step with the size of the sources.
+
+    Returns:
+        The slope of the curve on a log-log scale, between its smallest and
+        largest sizes: 1 for a linear step, 2 for a quadratic one.
+    """
+    sizes = sorted(curve, key=int)
+    first, last = sizes[0], sizes[-1]
+    if first == last or curve[first] <= 0:
+        return math.nan
+    return math.log(curve[last] / curve[first]) / math.log(int(last) / int(first))
+
+
+def regressions(results: Results, baseline: Results, threshold: float) -> list[str]:
+    """Compares the timings to a baseline.
+
+    Args:
+        results: The timings.
+        baseline: The timings of a previous run, on the same machine.
+        threshold: The ratio by which a step may be slower than its baseline.
+
+    Returns:
+        A description of every timing that regressed.
+    """
+    found = []
+    for step, difficulties in results.items():
+        for difficulty, curve in difficulties.items():
+            for size, elapsed in curve.items():
+                previous = baseline.get(step, {}).get(difficulty, {}).get(size)
+                if previous is None:
+                    continue
+                if elapsed > previous * (1 + threshold) and elapsed - previous > NOISE_FLOOR:
+                    found.append(
+                        f"{step} at difficulty {difficulty} on {size} lines: "
+                        f"{previous * 1000:.2f}ms -> {elapsed * 1000:.2f}ms (+{elapsed / previous - 1:.0%})"
+                    )
+    return found
+
+
+def report(results: Results, sizes: tuple[int, ...], difficulty: int) -> None:
+    """Prints the curves of every step at a difficulty."""
+    print(f"difficulty {difficulty} (ms)")
+    print(f"  {'step':<26}" + "".join(f"{size:>10}" for size in sizes) + f"{'growth':>8}{'share':>7}")
+    largest = str(max(sizes))
+    mutators_time = sum(results[name][str(difficulty)][largest] for name in MUTATORS)
+    for step, difficulties in results.items():
+        curve = difficulties[str(difficulty)]
+        share = f"{curve[largest] / mutators_time:>7.0%}" if step in MUTATORS and mutators_time else ""
+        timings = "".join(f"{curve[str(size)] * 1000:>10.3f}" for size in sizes)
+        print(f"  {step:<26}{timings}{growth(curve):>8.2f}{share}")
+
+
+def main() -> None:
+    """Runs the benchmark, prints the curves and checks the regressions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="the lines of the sources")
+    parser.add_argument("--difficulties", type=int, nargs="+", default=DIFFICULTIES)
+    parser.add_argument("--output", type=Path, help="where to save the timings, as JSON")
+    parser.add_argument("--baseline", type=Path, help="the timings to compare against, as saved by --output")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="the slowdown ratio allowed")
+    args = parser.parse_args()
+    sizes, difficulties = tuple(sorted(args.sizes)), tuple(args.difficulties)
+
+    results = measure(sizes, difficulties)
+    for difficulty in difficulties:
+        report(results, sizes, difficulty)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        found = regressions(results, json.loads(args.baseline.read_text()), args.threshold)
+        for regression in found:
+            print(f"regression: {regression}")
+        if found:
+            sys.exit(1)
+        print(f"no regression past {args.threshold:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
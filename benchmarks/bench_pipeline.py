@@ -0,0 +1,359 @@
+"""Load test of the whole WebSocket pipeline of the server.
+
+The app of `server.main` is driven in-process through ASGI, from its startup
+to its shutdown, with a snekbox faked by an HTTP transport. Rooms of clients
+connect, then every client sends moves, replacements, bug requests and
+evaluations at a steady rate.
+
+Moves and replacements are tagged with a sequence number, found back in the
+cursors and replace events each client receives, to measure the latency of
+their broadcast. Evaluations are measured by the client requesting them, until
+it receives their result. The results are printed and written as JSON, to be
+compared between releases.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable
+
+import httpx
+
+from benchmarks.bench_broadcast import percentile
+from benchmarks.sources import generate_source
+from server.events import EventType
+from server.snekbox import SnekboxPool
+
+ROOMS = 20
+CLIENTS = 5
+MESSAGES = 200
+INTERVAL = 0.01
+SNEKBOX_DELAY = 0.05
+LINES = 200
+
+# The share of each event sent by the clients, once connected
+EVENTS = {EventType.MOVE: 0.6, EventType.REPLACE: 0.3, EventType.SEND_BUGS: 0.05, EventType.EVALUATE: 0.05}
+
+# The time in seconds given to the last events to be broadcast
+DRAIN_TIMEOUT = 2.0
+
+TAG = re.compile(r"@(\d+)@")
+
+
+def fake_snekbox(delay: float) -> httpx.MockTransport:
+    """A snekbox answering every evaluation after `delay` seconds."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:  # noqa: U100
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"stdout": "", "returncode": 0})
+
+    return httpx.MockTransport(handler)
+
+
+def load_app(directory: str, evaluator: SnekboxPool) -> ModuleType:
+    """Imports the server, keeping its journal and snapshots in `directory`.
+
+    Returns:
+        The `server.main` module, evaluating the code with `evaluator`.
+    """
+    os.environ["JOURNAL_PATH"] = str(Path(directory) / "journal")
+    os.environ["SNAPSHOT_PATH"] = str(Path(directory) / "snapshots")
+    main = importlib.import_module("server.main")
+    main.evaluator = evaluator
+    return main
+
+
+class Lifespan:
+    """The startup and shutdown of an ASGI app."""
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+        self._incoming: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._outgoing: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def startup(self) -> None:
+        """Starts the app, and waits for it to be ready."""
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._task = asyncio.create_task(self.app(scope, self._incoming.get, self._outgoing.put))
+        await self._incoming.put({"type": "lifespan.startup"})
+        message = await self._outgoing.get()
+        assert message["type"] == "lifespan.startup.complete", message
+
+    async def shutdown(self) -> None:
+        """Stops the app, and waits for it to be stopped."""
+        await self._incoming.put({"type": "lifespan.shutdown"})
+        message = await self._outgoing.get()
+        assert message["type"] == "lifespan.shutdown.complete", message
+        if self._task is not None:
+            await self._task
+
+
+class ASGIWebSocket:
+    """A WebSocket connected in-process to an ASGI app.
+
+    The messages sent by the app are passed to `on_message` as soon as they're
+    sent, with the time they were.
+    """
+
+    def __init__(self, app: Callable, path: str, on_message: Callable[[str, float], None]) -> None:
+        self.app = app
+        self.path = path
+        self.on_message = on_message
+        self.closed = False
+        self._incoming: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._accepted = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        """Opens the connection, and waits for the app to accept it."""
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 80),
+            "subprotocols": [],
+        }
+        await self._incoming.put({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(scope, self._incoming.get, self._send))
+        await self._accepted.wait()
+
+    def send(self, event_type: EventType, data: dict[str, Any]) -> None:
+        """Sends an event to the app."""
+        self._incoming.put_nowait(
+            {"type": "websocket.receive", "text": json.dumps({"type": event_type, "data": data})}
+        )
+
+    async def close(self) -> None:
+        """Closes the connection, and waits for the app to handle it."""
+        await self._incoming.put({"type": "websocket.disconnect", "code": 1000})
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _send(self, message: dict[str, Any]) -> None:
+        """Receives a message of the app."""
+        match message["type"]:
+            case "websocket.accept":
+                self._accepted.set()
+            case "websocket.send":
+                self.on_message(message["text"], time.perf_counter())
+            case "websocket.close":
+                self.closed = True
+
+
+class Recorder:
+    """The events sent and received by every client, and their latency."""
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.received = 0
+        self.sent_at: dict[int, float] = {}
+        self.latencies: dict[str, list[float]] = {"move": [], "replace": [], "evaluate": []}
+        self._seq = 0
+
+    def tag(self) -> int:
+        """Returns a new sequence number, recording when it was sent."""
+        self._seq += 1
+        self.sent_at[self._seq] = time.perf_counter()
+        return self._seq
+
+    def record(self, kind: str, seq: int, received_at: float) -> None:
+        """Records the latency of a tagged event received by a client."""
+        if seq in self.sent_at:
+            self.latencies[kind].append(received_at - self.sent_at[seq])
+
+
+class SimulatedClient:
+    """A user of a room, sending events at random."""
+
+    def __init__(self, app: Callable, recorder: Recorder, rng: random.Random) -> None:
+        self.recorder = recorder
+        self.rng = rng
+        self.version: int | None = None
+        self.code_length = 0
+        self.evaluating: float | None = None
+        self.websocket = ASGIWebSocket(app, "/room", self._on_message)
+        self._synced = asyncio.Event()
+        self._acknowledged = asyncio.Event()
+
+    async def connect(self, room_code: str, create: bool) -> None:
+        """Connects to a room, and waits for its code."""
+        await self.websocket.connect()
+        connect_data: dict[str, Any] = {"room_code": room_code, "username": "user"}
+        if create:
+            connect_data |= {"connection_type": "create", "difficulty": 1}
+        else:
+            connect_data |= {"connection_type": "join"}
+        self.websocket.send(EventType.CONNECT, connect_data)
+        await self._synced.wait()
+
+    async def write(self, code: str) -> None:
+        """Inserts code at the start, and waits for its acknowledgement."""
+        self._acknowledged.clear()
+        self.websocket.send(
+            EventType.REPLACE, {"code": [{"from": 0, "to": 0, "value": code}], "version": self.version}
+        )
+        self.code_length += len(code)
+        await self._acknowledged.wait()
+
+    def send_random_event(self) -> None:
+        """Sends an event, drawn from the share of each event."""
+        (event_type,) = self.rng.choices(list(EVENTS), list(EVENTS.values()))
+        match event_type:
+            case EventType.MOVE:
+                data: dict[str, Any] = {"position": {"x": self.recorder.tag(), "y": 0}}
+            case EventType.REPLACE:
+                position = self.rng.randint(0, self.code_length)
+                replacement = {"from": position, "to": position, "value": f"@{self.recorder.tag()}@"}
+                data = {"code": [replacement], "version": self.version}
+            case EventType.EVALUATE:
+                if self.evaluating is None:
+                    self.evaluating = time.perf_counter()
+                data = {}
+            case _:
+                data = {}
+        self.websocket.send(event_type, data)
+        self.recorder.sent += 1
+
+    def _on_message(self, text: str, received_at: float) -> None:
+        """Handles an event of the server, recording the latency of tags."""
+        self.recorder.received += 1
+        event = json.loads(text)
+        data = event["data"]
+        match event["type"]:
+            case EventType.SYNC:
+                if data["code"] is not None:
+                    self.code_length = len(data["code"])
+                self.version = data["version"]
+                self._synced.set()
+            case EventType.CURSORS:
+                for position in data["cursors"].values():
+                    self.recorder.record("move", position["x"], received_at)
+            case EventType.REPLACE:
+                for replacement in data["code"]:
+                    self.code_length += len(replacement["value"]) - (replacement["to"] - replacement["from"])
+                    for seq in TAG.findall(replacement["value"]):
+                        self.recorder.record("replace", int(seq), received_at)
+                if not data["code"]:
+                    self._acknowledged.set()
+                self.version = data["version"]
+            case EventType.EVALUATE | EventType.ERROR:
+                if self.evaluating is not None:
+                    self.recorder.latencies["evaluate"].append(received_at - self.evaluating)
+                    self.evaluating = None
+
+
+async def run(rooms: int, clients: int, messages: int, interval: float) -> dict[str, Any]:
+    """Runs the load test against the app, and returns the results."""
+    evaluator = SnekboxPool(transport=fake_snekbox(SNEKBOX_DELAY))
+    rng = random.Random(0)
+    recorder = Recorder()
+    source = generate_source(LINES)
+
+    with tempfile.TemporaryDirectory() as directory:
+        main = load_app(directory, evaluator)
+        lifespan = Lifespan(main.app)
+        await lifespan.startup()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        room_clients: list[list[SimulatedClient]] = []
+        for num in range(rooms):
+            room_code = f"R{num:04}"
+            owner = SimulatedClient(main.app, recorder, random.Random(rng.getrandbits(64)))
+            await owner.connect(room_code, create=True)
+            await owner.write(source)
+            room_clients.append([owner])
+            for _ in range(clients - 1):
+                client = SimulatedClient(main.app, recorder, random.Random(rng.getrandbits(64)))
+                await client.connect(room_code, create=False)
+                room_clients[-1].append(client)
+
+        everyone = [client for room in room_clients for client in room]
+        recorder.sent = recorder.received = 0
+
+        async def send_events(client: SimulatedClient) -> None:
+            # The clients start at different times, as they would
+            await asyncio.sleep(client.rng.uniform(0, interval))
+            for _ in range(messages):
+                client.send_random_event()
+                await asyncio.sleep(interval)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(send_events(client) for client in everyone))
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while any(client.evaluating is not None for client in everyone) and time.perf_counter() < deadline:
+            await asyncio.sleep(interval)
+        # The last batches of cursors and replacements
+        manager = main.app.state.worker.manager
+        await asyncio.sleep(max(manager.cursor_interval, manager.replace_batch_window) * 2)
+        elapsed = time.perf_counter() - start_time
+
+        stats = manager.rooms.stats()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        for client in everyone:
+            client.websocket.send(EventType.DISCONNECT, {})
+            await client.websocket.close()
+        await lifespan.shutdown()
+
+    return {
+        "parameters": {"rooms": rooms, "clients": clients, "messages": messages, "interval": interval},
+        "elapsed": elapsed,
+        "messages": {
+            "sent": recorder.sent,
+            "received": recorder.received,
+            "sent_per_second": recorder.sent / elapsed,
+            "received_per_second": recorder.received / elapsed,
+        },
+        "latency_ms": {
+            kind: {"count": len(values), "p50": percentile(values, 50), "p99": percentile(values, 99)}
+            for kind, values in recorder.latencies.items()
+        },
+        "memory_per_room": {
+            # The estimate of the rooms, and the growth of the process, which
+            # ru_maxrss gives in kilobytes
+            "estimated": sum(shard.memory for shard in stats) / rooms,
+            "rss": (rss_after - rss_before) * 1024 / rooms,
+        },
+    }
+
+
+def main() -> None:
+    """Runs the load test, prints the results and writes them as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=ROOMS)
+    parser.add_argument("--clients", type=int, default=CLIENTS, help="the clients of each room")
+    parser.add_argument("--messages", type=int, default=MESSAGES, help="the events sent by each client")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="the time between two events of a client")
+    parser.add_argument("--output", type=Path, default=Path("bench_pipeline.json"))
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.rooms, args.clients, args.messages, args.interval))
+    args.output.write_text(json.dumps(results, indent=2))
+
+    sent, received = results["messages"]["sent_per_second"], results["messages"]["received_per_second"]
+    print(f"{args.rooms} rooms of {args.clients} clients, {results['elapsed']:.2f}s")
+    print(f"messages: {sent:>10.0f} sent/s {received:>10.0f} received/s")
+    for kind, latency in results["latency_ms"].items():
+        print(f"{kind:<9} {latency['p50']:>7.2f}ms p50 {latency['p99']:>7.2f}ms p99 ({latency['count']} received)")
+    memory = results["memory_per_room"]
+    print(f"memory per room: {memory['estimated'] / 1024:.1f} KiB estimated, {memory['rss'] / 1024:.1f} KiB rss")
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark of the conversion of the modifications into replacements.
+
+The first conversion ran difflib.ndiff character by character on every pair
+of lines, and the next one diffed the changed lines against the original
+ones. Both are compared against Modifiers._get_replacements, which converts
+the edits recorded by the mutators, on generated sources of 1k to 20k lines,
+modified by every mutator.
+"""
+import difflib
+import random
+import time
+
+from benchmarks.sources import generate_source
+from server.events import ReplaceData
+from server.modifiers import Modifiers
+
+SIZES = (1_000, 5_000, 10_000, 20_000)
+MUTATORS = [
+    "remove_indentation",
+    "remove_end_colon",
+    "change_keyword",
+    "comment",
+    "change_function_call_name",
+    "insert_empty_statements",
+    "reverse_booleans",
+    "break_equals_statement",
+    "mix_type_keywords",
+    "add_or_remove_brackets",
+]
+
+
+def ndiff_replacements(modifier: Modifiers) -> list[dict]:
+    """The previous implementation of Modifiers._get_replacements."""
+    replacements = []
+
+    current_position = 0
+    deletes = 0
+    for input_line, output_line in zip(modifier.file_contents, modifier.modified_contents):
+        for diff in difflib.ndiff(input_line, output_line):
+            if diff[0] == "-":
+                replacements.append(
+                    {"from": current_position - deletes, "to": (current_position + 1) - deletes, "value": ""}
+                )
+                deletes += 1
+
+            if diff[0] == "+":
+                replacements.append(
+                    {"from": current_position - deletes, "to": current_position - deletes, "value": diff[-1]}
+                )
+
+            current_position += 1
+    return replacements
+
+
+def line_diff_replacements(modifier: Modifiers) -> ReplaceData:
+    """The previous implementation of Modifiers._get_replacements."""
+    replacements = []
+
+    current_position = 0
+    for input_line, output_line in zip(modifier.file_contents, modifier.modified_contents):
+        if input_line == output_line:
+            current_position += len(input_line)
+            continue
+
+        max_common = min(len(input_line), len(output_line))
+        prefix = 0
+        while prefix < max_common and input_line[prefix] == output_line[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < max_common - prefix and input_line[-suffix - 1] == output_line[-suffix - 1]:
+            suffix += 1
+
+        value_end = len(output_line) - suffix
+        replacements.append(
+            {
+                "from": current_position + prefix,
+                "to": current_position + len(input_line) - suffix,
+                "value": output_line[prefix:value_end],
+            }
+        )
+        current_position += len(output_line)
+    return ReplaceData(code=replacements)
+
+
+def main() -> None:
+    """Runs the benchmark for every source size and prints the results."""
+    print(f"{'lines':>6} {'ndiff':>8} {'ops':>5} {'line diff':>10} {'ops':>5} {'edits':>8} {'ops':>5}  (ms)")
+    for size in SIZES:
+        modifier = Modifiers(generate_source(size), difficulty=3, rng=random.Random(size))
+        for mutator in MUTATORS:
+            getattr(modifier, mutator)()
+
+        start_time = time.perf_counter()
+        old = ndiff_replacements(modifier)
+        ndiff_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        line_diff = line_diff_replacements(modifier).code
+        line_diff_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        new = modifier._get_replacements().code
+        edits_time = time.perf_counter() - start_time
+
+        print(
+            f"{size:>6} {ndiff_time * 1000:>8.1f} {len(old):>5} {line_diff_time * 1000:>10.1f} {len(line_diff):>5}"
+            f" {edits_time * 1000:>8.1f} {len(new):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
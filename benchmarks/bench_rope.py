@@ -0,0 +1,73 @@
+"""Benchmark of the room document against plain string slicing.
+
+Each run applies bursts of single-character edits, as sent while typing, to
+documents of 10k to 100k characters. The full code is built after each burst,
+as it would be for a sync or an evaluation.
+"""
+import random
+import time
+
+from server.rope import Rope
+
+SIZES = (10_000, 50_000, 100_000)
+BURSTS = 20
+EDITS_PER_BURST = 500
+
+
+def make_edits(size: int, seed: int = 0) -> list[tuple[int, int, str]]:
+    """Generates typing-like edits, mostly insertions around a moving cursor."""
+    rng = random.Random(seed)
+    edits = []
+    cursor = size // 2
+    length = size
+    for _ in range(BURSTS * EDITS_PER_BURST):
+        if rng.random() < 0.05:
+            cursor = rng.randrange(length)
+        if rng.random() < 0.8:
+            edits.append((cursor, cursor, rng.choice("abcdefgh \n")))
+            cursor += 1
+            length += 1
+        elif cursor > 0:
+            edits.append((cursor - 1, cursor, ""))
+            cursor -= 1
+            length -= 1
+    return edits
+
+
+def bench_string(text: str, edits: list[tuple[int, int, str]]) -> float:
+    """Applies the edits with string slicing and returns the elapsed time."""
+    start_time = time.perf_counter()
+    for num, (start, stop, value) in enumerate(edits, 1):
+        text = text[:start] + value + text[stop:]
+        if num % EDITS_PER_BURST == 0:
+            str(text)
+    return time.perf_counter() - start_time
+
+
+def bench_rope(text: str, edits: list[tuple[int, int, str]]) -> float:
+    """Applies the edits to a rope and returns the elapsed time."""
+    rope = Rope(text)
+    start_time = time.perf_counter()
+    for num, (start, stop, value) in enumerate(edits, 1):
+        rope.replace(start, stop, value)
+        if num % EDITS_PER_BURST == 0:
+            str(rope)
+    return time.perf_counter() - start_time
+
+
+def main() -> None:
+    """Runs the benchmark for every document size and prints the results."""
+    print(f"{'size':>8} {'edits':>7} {'string (us/edit)':>17} {'rope (us/edit)':>15}")
+    for size in SIZES:
+        text = "".join(random.Random(size).choice("abcdefgh \n") for _ in range(size))
+        edits = make_edits(size)
+
+        string_time = bench_string(text, edits)
+        rope_time = bench_rope(text, edits)
+        print(
+            f"{size:>8} {len(edits):>7} {string_time / len(edits) * 1e6:>17.2f} {rope_time / len(edits) * 1e6:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Benchmark of the token index built on every bug injection.
+
+A full scan of the document is compared against the token cache of a room,
+after a few lines were edited since the previous injection, on generated
+sources of 1k to 20k lines.
+"""
+import random
+import time
+
+from benchmarks.sources import generate_source
+from server.token_index import TokenCache, TokenIndex, split_lines
+
+SIZES = (1_000, 5_000, 10_000, 20_000)
+EDITED_LINES = 10
+
+
+def main() -> None:
+    """Runs the benchmark for every source size and prints the results."""
+    print(f"{'lines':>6} {'full scan (ms)':>15} {'cached (ms)':>12} {'rescanned':>10}")
+    for size in SIZES:
+        rng = random.Random(size)
+        lines = split_lines(generate_source(size))
+
+        start_time = time.perf_counter()
+        TokenIndex(lines).keywords
+        full_time = time.perf_counter() - start_time
+
+        cache = TokenCache()
+        cache.index(lines)
+        for num in rng.sample(range(len(lines)), EDITED_LINES):
+            lines[num] = f"    edited_{num} = {num} == {rng.randrange(100)}\n"
+
+        misses = cache.misses
+        start_time = time.perf_counter()
+        cache.index(lines).keywords
+        cached_time = time.perf_counter() - start_time
+
+        print(f"{size:>6} {full_time * 1000:>15.1f} {cached_time * 1000:>12.1f} {cache.misses - misses:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Generation of Python sources used by the benchmarks."""
+import random
+
+FUNCTION_TEMPLATE = '''def {name}(value: int, items: list[str]) -> bool:
+    """Checks the {name} condition."""
+    if value == {number} and items:
+        result = [str(item) for item in items if item != "{name}"]
+        return {boolean}
+    for index in range(len(items)):
+        print(index, float(value) * {number})
+    return helper_{callee}(value) == (value, [items])
+
+'''
+
+
+def generate_source(lines: int, seed: int = 0) -> str:
+    """Generates a Python source of about the given number of lines.
+
+    The source is made of functions calling each other, with the keywords,
+    types, booleans, brackets and operators the modifiers look for.
+    Args:
+        lines: The number of lines of the source.
+        seed: The seed of the random generator.
+
+    Returns:
+        The generated source.
+    """
+    rng = random.Random(seed)
+    template_lines = FUNCTION_TEMPLATE.count("\n")
+
+    functions = []
+    for num in range(max(1, lines // template_lines)):
+        functions.append(
+            FUNCTION_TEMPLATE.format(
+                name=f"helper_{num}",
+                number=rng.randrange(100),
+                boolean=rng.choice(["True", "False"]),
+                callee=rng.randrange(num + 1),
+            )
+        )
+
+    source = "".join(functions)
+    missing = lines - source.count("\n")
+    return source + "x = 1\n" * max(0, missing)
@@ -0,0 +1,539 @@
+"""Backplanes connecting the workers serving the rooms.
+
+Every room is owned by a single worker, the first one to claim it, which keeps
+its state and runs its events. The clients of the room connected to other
+workers are relayed to the owner through the backplane, which holds the owner
+of every room and carries the messages between the workers. When a worker is
+gone, the others are sent a "released" message with its id.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, TypeAlias
+from uuid import uuid4
+
+from server.encoding import dumps, loads
+
+MessageHandler: TypeAlias = Callable[[dict[str, Any]], Awaitable[None]]
+
+CONNECT_TIMEOUT = 5.0
+RECONNECT_DELAY = 0.1
+# The maximum length of a line, which holds the whole code of a room in sync
+# events
+LINE_LIMIT = 1 << 26
+
+log = logging.getLogger(__name__)
+
+
+class RoomDirectory:
+    """The worker owning every room."""
+
+    def __init__(self) -> None:
+        """Initializes an empty directory."""
+        self.owners: dict[str, str] = {}
+
+    def claim(self, room_code: str, worker_id: str) -> str:
+        """Makes a worker the owner of a room, unless it already has one.
+
+        Args:
+            room_code: The code of the room.
+            worker_id: The id of the worker claiming the room.
+
+        Returns:
+            The id of the owner of the room.
+        """
+        return self.owners.setdefault(room_code, worker_id)
+
+    def release(self, room_code: str, worker_id: str) -> None:
+        """Removes the owner of a room, if it's the given worker.
+
+        Args:
+            room_code: The code of the room.
+            worker_id: The id of the worker releasing the room.
+        """
+        if self.owners.get(room_code) == worker_id:
+            del self.owners[room_code]
+
+    def release_worker(self, worker_id: str) -> None:
+        """Removes every room owned by a worker.
+
+        Args:
+            worker_id: The id of the worker.
+        """
+        for room_code in [code for code, owner in self.owners.items() if owner == worker_id]:
+            del self.owners[room_code]
+
+
+class Backplane(ABC):
+    """The connection of a worker to the other workers.
+
+    The messages sent to a worker are handed to its handler one at a time, in
+    the order they were sent. The handler must not wait for the backplane to
+    answer a claim, which would never come.
+    """
+
+    def __init__(self, worker_id: str | None = None) -> None:
+        """Initializes the backplane of a worker.
+
+        Args:
+            worker_id (optional): The id of the worker, random by default.
+        """
+        self.worker_id = worker_id if worker_id is not None else uuid4().hex
+        self._handler: MessageHandler | None = None
+
+    async def start(self, handler: MessageHandler) -> None:
+        """Starts receiving the messages sent to the worker.
+
+        Args:
+            handler: The coroutine function called with every message.
+        """
+        self._handler = handler
+
+    async def stop(self) -> None:
+        """Stops receiving messages, and releases the rooms of the worker."""
+        self._handler = None
+
+    @abstractmethod
+    async def claim(self, room_code: str) -> str:  # noqa: U100
+        """Makes the worker the owner of a room, unless it already has one.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The id of the owner of the room.
+        """
+
+    @abstractmethod
+    async def release(self, room_code: str) -> None:  # noqa: U100
+        """Stops owning a room, once the room is deleted.
+
+        Args:
+            room_code: The code of the room.
+        """
+
+    @abstractmethod
+    async def send(self, worker_id: str, message: dict[str, Any]) -> None:  # noqa: U100
+        """Sends a message to a worker, dropped if the worker is gone.
+
+        Args:
+            worker_id: The id of the worker.
+            message: The JSON serializable message.
+        """
+
+    async def _dispatch(self, message: dict[str, Any]) -> None:
+        """Hands a message to the handler, logging its errors.
+
+        Args:
+            message: The message received.
+        """
+        if self._handler is None:
+            return
+        try:
+            await self._handler(message)
+        except Exception:
+            log.exception("Failed to handle a message of the backplane")
+
+
+class InMemoryHub(RoomDirectory):
+    """The rooms and the messages of the workers of a single process."""
+
+    def __init__(self) -> None:
+        """Initializes the directory and the inboxes of the workers."""
+        super().__init__()
+        self.inboxes: dict[str, asyncio.Queue[dict[str, Any]]] = {}
+
+
+class InMemoryBackplane(Backplane):
+    """A backplane between workers running in the same process.
+
+    A single worker gets its own hub, which is the default for a server
+    running in a single process.
+    """
+
+    def __init__(self, hub: InMemoryHub | None = None, worker_id: str | None = None) -> None:
+        """Initializes the backplane of a worker.
+
+        Args:
+            hub (optional): The hub shared by the workers, new by default.
+            worker_id (optional): The id of the worker, random by default.
+        """
+        super().__init__(worker_id)
+        self.hub = hub if hub is not None else InMemoryHub()
+        self._task: asyncio.Task | None = None
+
+    async def start(self, handler: MessageHandler) -> None:
+        """Starts receiving the messages sent to the worker.
+
+        Args:
+            handler: The coroutine function called with every message.
+        """
+        await super().start(handler)
+        inbox = self.hub.inboxes.setdefault(self.worker_id, asyncio.Queue())
+        self._task = asyncio.create_task(self._receive(inbox))
+
+    async def stop(self) -> None:
+        """Stops receiving messages, and releases the rooms of the worker."""
+        await super().stop()
+        self.hub.inboxes.pop(self.worker_id, None)
+        self.hub.release_worker(self.worker_id)
+        for inbox in self.hub.inboxes.values():
+            inbox.put_nowait({"type": "released", "worker": self.worker_id})
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def claim(self, room_code: str) -> str:
+        """Makes the worker the owner of a room, unless it already has one.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The id of the owner of the room.
+        """
+        return self.hub.claim(room_code, self.worker_id)
+
+    async def release(self, room_code: str) -> None:
+        """Stops owning a room, once the room is deleted.
+
+        Args:
+            room_code: The code of the room.
+        """
+        self.hub.release(room_code, self.worker_id)
+
+    async def send(self, worker_id: str, message: dict[str, Any]) -> None:
+        """Sends a message to a worker, dropped if the worker is gone.
+
+        Args:
+            worker_id: The id of the worker.
+            message: The JSON serializable message.
+        """
+        inbox = self.hub.inboxes.get(worker_id)
+        if inbox is not None:
+            inbox.put_nowait(message)
+
+    async def _receive(self, inbox: asyncio.Queue[dict[str, Any]]) -> None:
+        """Hands the messages of the inbox to the handler, in order.
+
+        Args:
+            inbox: The inbox of the worker.
+        """
+        while True:
+            await self._dispatch(await inbox.get())
+
+
+class WorkerConnection:
+    """The connection of a worker to the broker.
+
+    The lines sent to the worker are queued, and written by a writer task so
+    that a slow worker never blocks the workers sending messages to it.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        """Initializes the connection and starts the writer task.
+
+        Args:
+            writer: The stream of the lines sent to the worker.
+        """
+        self.writer = writer
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue()
+        self._task = asyncio.create_task(self._write())
+
+    def send(self, message: dict[str, Any]) -> None:
+        """Queues a message for the worker, without waiting.
+
+        Args:
+            message: The JSON serializable message.
+        """
+        self._queue.put_nowait(f"{dumps(message)}\n".encode())
+
+    @property
+    def lag(self) -> int:
+        """The number of lines waiting to be written."""
+        return self._queue.qsize()
+
+    async def _write(self) -> None:
+        """Writes the queued lines until the connection is closed."""
+        while True:
+            line = await self._queue.get()
+            try:
+                self.writer.write(line)
+                await self.writer.drain()
+            except ConnectionError:
+                # The worker disconnected, its read loop will notice it
+                return
+
+    def close(self) -> None:
+        """Stops the writer task and closes the connection."""
+        self._task.cancel()
+        self.writer.close()
+
+
+class BackplaneBroker:
+    """The process-local server relaying the messages of the workers.
+
+    The workers of a host connect to it through a Unix socket, and exchange
+    lines of JSON with it. It keeps the directory of the rooms, and releases
+    the rooms of a worker when it disconnects, letting the other workers know.
+    """
+
+    def __init__(self, path: str, worker_id: str) -> None:
+        """Initializes the broker.
+
+        Args:
+            path: The path of the Unix socket.
+            worker_id: The id of the worker running the broker, which stops
+                with it.
+        """
+        self.path = path
+        self.worker_id = worker_id
+        self.directory = RoomDirectory()
+        self._connections: dict[str, WorkerConnection] = {}
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        """Starts listening on the Unix socket, replacing a stale one."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=LINE_LIMIT)
+
+    async def stop(self) -> None:
+        """Stops listening, and closes the connections of the workers."""
+        if self._server is None:
+            return
+
+        self._server.close()
+        for connection in list(self._connections.values()):
+            connection.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handles the requests of a worker until it disconnects.
+
+        Args:
+            reader: The stream of the requests.
+            writer: The stream of the responses.
+        """
+        worker_id = None
+        connection = WorkerConnection(writer)
+        try:
+            async for line in reader:
+                request = loads(line)
+                match request["op"]:
+                    case "hello":
+                        worker_id = request["worker"]
+                        self._connections[worker_id] = connection
+                        connection.send({"op": "welcome", "broker": self.worker_id})
+                        # A worker reconnecting keeps the rooms it still owns
+                        for room_code in request.get("rooms", []):
+                            self.directory.claim(room_code, worker_id)
+                    case "claim":
+                        owner = self.directory.claim(request["room"], worker_id)
+                        connection.send({"op": "claimed", "id": request["id"], "owner": owner})
+                    case "release":
+                        self.directory.release(request["room"], worker_id)
+                    case "send":
+                        receiver = self._connections.get(request["to"])
+                        if receiver is not None:
+                            receiver.send({"op": "message", "message": request["message"]})
+        except (ConnectionError, ValueError, KeyError):
+            log.exception("Lost the connection of worker %s", worker_id)
+        finally:
+            if worker_id is not None and self._connections.get(worker_id) is connection:
+                del self._connections[worker_id]
+                self.directory.release_worker(worker_id)
+                for other in self._connections.values():
+                    other.send({"op": "message", "message": {"type": "released", "worker": worker_id}})
+            connection.close()
+
+
+class UnixBackplane(Backplane):
+    """A backplane between the workers of a host, through a Unix socket.
+
+    The broker runs in the first worker to start, which holds a lock on the
+    socket path for as long as it runs. When it stops, the other workers
+    reconnect, one of them taking over the broker, and claim their rooms
+    again.
+    """
+
+    def __init__(self, path: str, worker_id: str | None = None) -> None:
+        """Initializes the backplane of a worker.
+
+        Args:
+            path: The path of the Unix socket of the broker.
+            worker_id (optional): The id of the worker, random by default.
+        """
+        super().__init__(worker_id)
+        self.path = path
+        self.broker: BackplaneBroker | None = None
+
+        self._lock_file: int | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+        self._broker_id: str | None = None
+        # The requests made while reconnecting
+        self._backlog: list[bytes] = []
+        self._claims: dict[int, asyncio.Future[str]] = {}
+        self._next_claim = 0
+        self._rooms: set[str] = set()
+
+    async def start(self, handler: MessageHandler) -> None:
+        """Connects to the broker, starting it if needed.
+
+        Args:
+            handler: The coroutine function called with every message.
+        """
+        await super().start(handler)
+        reader = await self._connect()
+        self._task = asyncio.create_task(self._receive(reader))
+
+    async def stop(self) -> None:
+        """Disconnects from the broker, releasing the rooms of the worker."""
+        await super().stop()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._backlog.clear()
+        if self.broker is not None:
+            await self.broker.stop()
+            self.broker = None
+        if self._lock_file is not None:
+            os.close(self._lock_file)
+            self._lock_file = None
+
+    async def claim(self, room_code: str) -> str:
+        """Makes the worker the owner of a room, unless it already has one.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The id of the owner of the room.
+        """
+        claim_id = self._next_claim
+        self._next_claim += 1
+        future = self._claims[claim_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self._write({"op": "claim", "room": room_code, "id": claim_id})
+            owner = await asyncio.wait_for(future, CONNECT_TIMEOUT)
+        finally:
+            self._claims.pop(claim_id, None)
+
+        if owner == self.worker_id:
+            self._rooms.add(room_code)
+        return owner
+
+    async def release(self, room_code: str) -> None:
+        """Stops owning a room, once the room is deleted.
+
+        Args:
+            room_code: The code of the room.
+        """
+        self._rooms.discard(room_code)
+        await self._write({"op": "release", "room": room_code})
+
+    async def send(self, worker_id: str, message: dict[str, Any]) -> None:
+        """Sends a message to a worker, dropped if the worker is gone.
+
+        Args:
+            worker_id: The id of the worker.
+            message: The JSON serializable message.
+        """
+        await self._write({"op": "send", "to": worker_id, "message": message})
+
+    async def _write(self, request: dict[str, Any]) -> None:
+        """Sends a request to the broker, queued while reconnecting.
+
+        Args:
+            request: The request.
+        """
+        line = f"{dumps(request)}\n".encode()
+        if self._writer is None:
+            # Dropped once stopped
+            if self._task is not None:
+                self._backlog.append(line)
+            return
+        try:
+            self._writer.write(line)
+            await self._writer.drain()
+        except ConnectionError:
+            # The receiving task is about to notice, and reconnect
+            self._backlog.append(line)
+
+    async def _connect(self) -> asyncio.StreamReader:
+        """Connects to the broker, starting it if no other worker runs it.
+
+        Returns:
+            The stream of the messages of the broker.
+        """
+        if self._lock_file is None:
+            lock_file = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_file)
+            else:
+                self._lock_file = lock_file
+                self.broker = BackplaneBroker(self.path, self.worker_id)
+                await self.broker.start()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONNECT_TIMEOUT
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The broker is still starting
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(RECONNECT_DELAY)
+
+        self._writer = writer
+        await self._write({"op": "hello", "worker": self.worker_id, "rooms": sorted(self._rooms)})
+        backlog, self._backlog = self._backlog, []
+        for line in backlog:
+            writer.write(line)
+        await writer.drain()
+        return reader
+
+    async def _receive(self, reader: asyncio.StreamReader) -> None:
+        """Handles the messages of the broker, reconnecting if it stops.
+
+        Args:
+            reader: The stream of the messages of the broker.
+        """
+        while True:
+            try:
+                async for line in reader:
+                    response = loads(line)
+                    match response["op"]:
+                        case "claimed":
+                            future = self._claims.get(response["id"])
+                            if future is not None and not future.done():
+                                future.set_result(response["owner"])
+                        case "welcome":
+                            self._broker_id = response["broker"]
+                        case _:
+                            await self._dispatch(response["message"])
+            except ConnectionError:
+                # A write failed first
+                pass
+
+            log.warning("Lost the connection to the backplane broker, reconnecting")
+            self._writer = None
+            # The broker stops with the worker running it, which is gone
+            if self._broker_id is not None and self._broker_id != self.worker_id:
+                await self._dispatch({"type": "released", "worker": self._broker_id})
+            self._broker_id = None
+            await asyncio.sleep(RECONNECT_DELAY)
+            reader = await self._connect()
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from server.events import Replacement
+from server.modifiers import Modifiers
+from server.token_index import TokenIndex
+
+MAX_WORKERS = 2
+TIMEOUT = 5.0
+INLINE_THRESHOLD = 50_000
+
+
+def compute_bugs(code: str, difficulty: int, seed: int, index: TokenIndex | None = None) -> list[Replacement]:
+    """Computes the replacements introducing bugs in some code.
+
+    The bugs only depend on the code, the difficulty and the seed.
+    Args:
+        code: The code in which bugs are introduced.
+        difficulty: The difficulty of the room.
+        seed: The seed of the random generator of the modifiers.
+        index (optional): The token index of the code, if already built.
+
+    Returns:
+        The replacements introducing the bugs.
+    """
+    return Modifiers(code, difficulty, index, random.Random(seed)).output.code
+
+
+class BugPool:
+    """A pool of processes computing the bugs introduced in the rooms.
+
+    The modifiers are pure CPU work, which would stall every connection of
+    the server while running in the event loop. The bugs of large codes are
+    computed in worker processes instead, while small codes, whose transfer
+    to a worker would cost more than their modification, are still modified
+    inline.
+    """
+
+    def __init__(
+        self, max_workers: int = MAX_WORKERS, timeout: float = TIMEOUT, inline_threshold: int = INLINE_THRESHOLD
+    ) -> None:
+        """Initializes the pool, whose workers are only started when needed.
+
+        Args:
+            max_workers: The maximum number of worker processes.
+            timeout: The time in seconds after which the bugs of a code are
+                given up.
+            inline_threshold: The length of the codes from which the bugs are
+                computed in a worker process.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.inline_threshold = inline_threshold
+
+        self._executor: ProcessPoolExecutor | None = None
+        self.timeouts = 0
+
+    def is_inline(self, code: str) -> bool:
+        """Checks if the bugs of some code are computed inline.
+
+        Args:
+            code: The code in which bugs are introduced.
+
+        Returns:
+            True if the code is too small to be sent to a worker process.
+        """
+        return len(code) < self.inline_threshold
+
+    async def compute(
+        self, code: str, difficulty: int, seed: int, index: TokenIndex | None = None
+    ) -> list[Replacement]:
+        """Computes the replacements introducing bugs in some code.
+
+        Args:
+            code: The code in which bugs are introduced.
+            difficulty: The difficulty of the room.
+            seed: The seed of the random generator of the modifiers.
+            index (optional): The token index of the code, used when the bugs
+                are computed inline.
+
+        Returns:
+            The replacements introducing the bugs, or an empty list if they
+            couldn't be computed in time.
+        """
+        if self.is_inline(code):
+            return compute_bugs(code, difficulty, seed, index)
+
+        if self._executor is None:
+            # Forking a process running an event loop and its threads isn't
+            # safe, so the workers are started from scratch
+            context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=context)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, compute_bugs, code, difficulty, seed)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return []
+        except BrokenProcessPool:
+            # A worker died, the pool is replaced on the next computation
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            return []
+
+    def shutdown(self) -> None:
+        """Stops the worker processes, without waiting for the computations."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
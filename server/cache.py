@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """A least recently used cache whose entries expire after some time."""
+
+    def __init__(self, max_size: int = 256, ttl: float = 300.0) -> None:
+        """Initializes the entries and the statistics of the cache.
+
+        Once the cache holds `max_size` entries, adding a new one evicts the
+        least recently used entry. Entries older than `ttl` seconds are
+        considered missing.
+        Args:
+            max_size: The maximum number of entries in the cache.
+            ttl: The time to live of an entry, in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> V | None:
+        """Gets an entry from the cache.
+
+        Args:
+            key: The key of the entry.
+        Returns:
+            The value of the entry, or None if it's missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: V) -> None:
+        """Adds an entry to the cache, evicting the oldest ones if needed.
+
+        Args:
+            key: The key of the entry.
+            value: The value of the entry.
+        """
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        """Returns the number of entries, including the expired ones."""
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        """Checks if a key is in the cache, without updating the statistics."""
+        entry = self._entries.get(key)  # type: ignore[call-overload]
+        return entry is not None and entry[0] > time.monotonic()
@@ -1,3 +1,4 @@
+import asyncio
 from json import JSONDecodeError
 from uuid import uuid4
 
@@ -5,7 +6,17 @@ from fastapi import WebSocket
 from pydantic import ValidationError
 
 from server.codes import StatusCode
-from server.events import ErrorData, EventRequest, EventResponse, EventType, ReplaceData
+from server.encoding import encode_event, loads
+from server.events import (
+    ErrorData,
+    EventRequest,
+    EventResponse,
+    EventType,
+    ReplaceData,
+    decode_request,
+)
+
+MAX_PENDING_MESSAGES = 256
 
 
 class Client:
@@ -15,11 +26,16 @@ class Client:
         """Initializes the WebSocket and the ID.
 
         A client is identified by an ID and contains the corresponding WebSocket
-        that is used to send and receive messages.
+        that is used to send and receive messages. Outgoing messages are
+        queued, and sent by a writer task so that a slow client never blocks
+        the other clients of its room.
         Args:
             websocket: A WebSocket instance.
         """
         self._websocket = websocket
+        # The messages, and whether they acknowledge changes of the client
+        self._queue: asyncio.Queue[tuple[str, bool]] = asyncio.Queue(MAX_PENDING_MESSAGES)
+        self._writer: asyncio.Task | None = None
         self.id = uuid4()
         self.default_replacement = EventRequest(
             type=EventType.REPLACE, data=ReplaceData(code=[{"from": 0, "to": 0, "value": ""}])
@@ -28,16 +44,102 @@ class Client:
         self.username: str
 
     async def accept(self) -> None:
-        """Accepts the WebSocket connection."""
+        """Accepts the WebSocket connection and starts the writer task."""
         await self._websocket.accept()
+        self._writer = asyncio.create_task(self._write())
 
     async def send(self, data: EventResponse) -> None:
         """Sends JSON data over the WebSocket connection.
 
+        If the queue of outgoing messages is full, this waits for the client to
+        catch up.
         Args:
             data: The data to be sent to the client.
         """
-        await self._websocket.send_json(data.dict())
+        await self.send_text(encode_event(data))
+
+    async def send_text(self, text: str) -> None:
+        """Sends an already encoded message over the WebSocket connection.
+
+        Args:
+            text: The encoded message.
+        """
+        if self._writer is None:
+            await self._websocket.send_text(text)
+        else:
+            await self._queue.put((text, False))
+
+    def enqueue(self, text: str, acknowledgement: bool = False) -> bool:
+        """Queues an encoded message without waiting.
+
+        Args:
+            text: The encoded message.
+            acknowledgement (optional): Whether the message acknowledges
+                changes of the client, which is kept when it's resynced.
+        Returns:
+            True if the message was queued, False if the client is lagging
+            too far behind.
+        """
+        try:
+            self._queue.put_nowait((text, acknowledgement))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def resync(self, text: str, acknowledgement: str | None = None) -> None:
+        """Drops the queued messages and replaces them by a single message.
+
+        This is used for clients lagging too far behind, which are sent the
+        whole state of the room instead of every missed message. The queued
+        acknowledgements are kept, and sent first: the client makes its
+        changes not acknowledged yet again on top of the state it receives.
+        Args:
+            text: The encoded message that replaces the queued ones.
+            acknowledgement (optional): An acknowledgement that didn't fit in
+                the queue, sent after the queued ones.
+        """
+        acknowledgements = []
+        while not self._queue.empty():
+            queued, is_acknowledgement = self._queue.get_nowait()
+            if is_acknowledgement:
+                acknowledgements.append(queued)
+        if acknowledgement is not None:
+            acknowledgements.append(acknowledgement)
+
+        # A client only waits for one acknowledgement at a time, unless it
+        # doesn't follow the protocol
+        space = self._queue.maxsize - 1
+        for queued in acknowledgements[-space:]:
+            self._queue.put_nowait((queued, True))
+        self._queue.put_nowait((text, False))
+
+    @property
+    def alive(self) -> bool:
+        """Whether the connection is still open, as far as sending goes.
+
+        The writer task stops when sending a message fails.
+        """
+        return self._writer is None or not self._writer.done()
+
+    @property
+    def lag(self) -> int:
+        """The number of messages waiting to be sent."""
+        return self._queue.qsize()
+
+    async def _write(self) -> None:
+        """Sends the queued messages until the connection is closed."""
+        while True:
+            text, _ = await self._queue.get()
+            try:
+                await self._websocket.send_text(text)
+            except Exception:
+                # The connection was closed, the receiving side will notice it
+                return
+
+    def stop(self) -> None:
+        """Stops the writer task."""
+        if self._writer is not None:
+            self._writer.cancel()
 
     async def receive(self) -> EventRequest:
         """Receives JSON data over the WebSocket connection.
@@ -46,8 +148,21 @@ class Client:
             The data received from the client or default EventRequests if an
             error occured.
         """
+        return await self.decode(await self._websocket.receive_text())
+
+    async def decode(self, text: str) -> EventRequest:
+        """Decodes a message received from the client.
+
+        The client is sent an error if the message isn't a valid request.
+        Args:
+            text: The message received.
+
+        Returns:
+            The request of the client or default EventRequests if an error
+            occured.
+        """
         try:
-            return EventRequest(**await self._websocket.receive_json())
+            return decode_request(loads(text))
         except (TypeError, JSONDecodeError):
             await self.send(
                 EventResponse(
@@ -69,6 +184,7 @@ class Client:
 
     async def close(self) -> None:
         """Closes the WebSocket connection."""
+        self.stop()
         return await self._websocket.close()
 
     def __eq__(self, other: object) -> bool:
@@ -9,3 +9,7 @@ class StatusCode(IntEnum):
     INVALID_REQUEST_DATA = 4002
     DATA_NOT_FOUND = 4003
     ROOM_ALREADY_EXISTS = 4004
+    EVALUATION_BUSY = 4005
+    EVALUATION_TIMEOUT = 4006
+    EVALUATION_FAILED = 4007
+    ROOM_UNAVAILABLE = 4008
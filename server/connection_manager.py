@@ -1,22 +1,70 @@
-from typing import TypeAlias
+import asyncio
+from typing import Awaitable, Callable
 
+from server.bug_pool import BugPool
 from server.client import Client
+from server.codes import StatusCode
+from server.encoding import encode_event
 from server.errors import RoomAlreadyExistsError, RoomNotFoundError
-from server.events import EventResponse
+from server.events import (
+    CursorsData,
+    DisconnectData,
+    EventResponse,
+    EventType,
+    Position,
+    ReplaceData,
+    Replacement,
+    SyncData,
+)
+from server.journal import RoomJournal
+from server.operations import ReplaceBatch, compact
+from server.registry import RoomRegistry
 from server.room import Room
+from server.scheduler import BugScheduler
+from server.snapshots import SnapshotStore
 
-ActiveRooms: TypeAlias = dict[str, Room]
+CURSOR_TICK_RATE = 20.0
+REPLACE_BATCH_WINDOW = 0.02
 
 
 class ConnectionManager:
     """Manager for the WebSocket clients."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        cursor_tick_rate: float = CURSOR_TICK_RATE,
+        replace_batch_window: float = REPLACE_BATCH_WINDOW,
+        store: SnapshotStore | None = None,
+        journal: RoomJournal | None = None,
+    ) -> None:
         """Initializes the active connections.
 
-        It stores the active connections and is able to broadcast data.
+        It stores the active connections and is able to broadcast data. Bugs
+        are introduced in the rooms by its bug scheduler, once started, and
+        computed by its bug pool.
+        Args:
+            cursor_tick_rate: The number of times per second the cursor moves
+                of a room are broadcast.
+            replace_batch_window: The time in seconds during which the
+                replacements of a client are batched before being broadcast.
+            store (optional): The snapshots of the hibernated rooms. Without
+                it, rooms are deleted instead of hibernated.
+            journal (optional): The journal recording the rooms, to recover
+                them after a restart.
         """
-        self._rooms: ActiveRooms = {}
+        self.rooms = RoomRegistry()
+        self.store = store
+        self.journal = journal
+        self._batches: dict[str, ReplaceBatch] = {}
+        # The latest operation of the snapshot store on each room, running in
+        # a thread
+        self._store_operations: dict[str, asyncio.Future] = {}
+        self.cursor_interval = 1 / cursor_tick_rate
+        self.replace_batch_window = replace_batch_window
+        self.removed_operations = 0
+        self.bug_scheduler = BugScheduler(self.send_bugs)
+        self.bug_pool = BugPool()
+        self.discarded_bugs = 0
 
     def disconnect(self, client: Client, room_code: str) -> None:
         """Removes the connection from the active connections.
@@ -27,56 +75,481 @@ class ConnectionManager:
             client: The client to disconnect.
             room_code: The room from which the client will be disconnected.
         """
-        self._rooms[room_code].clients.remove(client)
+        if self.rooms.leave(room_code, client):
+            self.bug_scheduler.remove(room_code)
+            if self.journal is not None:
+                self.journal.deleted(room_code)
+
+    async def drop_client(self, client: Client, room_code: str) -> None:
+        """Removes a client whose connection was lost from its room.
+
+        The other clients are sent a disconnect event, as if the client left.
+        A room left empty this way is hibernated, so that its clients can join
+        it again.
+        Args:
+            client: The client whose connection was lost.
+            room_code: The room of the client.
+        """
+        room = self.rooms.get(room_code)
+        if room is None or client not in room.clients:
+            return
+
+        response = EventResponse(
+            type=EventType.DISCONNECT,
+            data=DisconnectData(user=[{"id": client.id.hex, "username": client.username}]),
+            status_code=StatusCode.SUCCESS,
+        )
+        await self.broadcast(response, room_code, sender=client)
+
+        if room.clients == {client}:
+            room.clients.clear()
+            await self.hibernate(room_code)
+        else:
+            self.disconnect(client, room_code)
+
+    async def hibernate(self, room_code: str) -> bool:
+        """Moves a room from memory to a snapshot on disk.
+
+        The connections of the clients still in the room are closed, and
+        they get the room back from the snapshot when they join it again.
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            True if the room was hibernated, False if it didn't exist.
+        """
+        room = self.remove_room(room_code)
+        if room is None:
+            return False
+
+        store = self.store
+        if store is not None:
+            snapshot = room.snapshot()
+            await self._run_in_store(room_code, lambda: asyncio.to_thread(store.save, room_code, snapshot))
+
+        clients = list(room.clients)
+        room.clients.clear()
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+        return True
+
+    async def rehydrate(self, room_code: str) -> None:
+        """Loads a hibernated room back into memory, if it isn't already.
+
+        This has to be awaited before joining a room, which doesn't touch the
+        disk.
+        Args:
+            room_code: The code of the room.
+        """
+        if self.store is None or room_code in self.rooms:
+            return
+        await self._run_in_store(room_code, lambda: self._load(room_code))
+
+    async def _load(self, room_code: str) -> None:
+        """Loads the snapshot of a room, once the previous operations are done.
+
+        Args:
+            room_code: The code of the room.
+        """
+        if self.store is None or room_code in self.rooms:
+            return
+
+        snapshot = await asyncio.to_thread(self.store.load, room_code)
+        if snapshot is None:
+            return
+
+        room, created = self.rooms.create(room_code, lambda: Room.from_snapshot(snapshot))
+        if created:
+            self.bug_scheduler.add(room_code, room.difficulty)
+            if self.journal is not None:
+                self.journal.created(room_code, room)
+
+    async def _run_in_store(self, room_code: str, operation: Callable[[], Awaitable[None]]) -> None:
+        """Runs an operation of the snapshot store on a room.
+
+        The compression and the disk accesses of the store run in a thread,
+        so the operations on the same room are chained: a room being
+        hibernated is only loaded again once its snapshot is written.
+        Args:
+            room_code: The code of the room.
+            operation: Starts the operation.
+        """
+        previous = self._store_operations.get(room_code)
 
-        if not self._rooms[room_code].clients:
-            del self._rooms[room_code]
+        async def run() -> None:
+            if previous is not None:
+                await asyncio.wait({previous})
+            await operation()
 
-    def create_room(self, client: Client, room_code: str, difficulty: int) -> None:
+        future = self._store_operations[room_code] = asyncio.ensure_future(run())
+        try:
+            # The operation goes on if the caller is cancelled
+            await asyncio.shield(future)
+        finally:
+            if self._store_operations.get(room_code) is future:
+                del self._store_operations[room_code]
+
+    def remove_room(self, room_code: str) -> Room | None:
+        """Deletes a room, without closing the connections of its clients.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The deleted room, or None if it didn't exist.
+        """
+        # The batched replacements are already part of the code
+        self._batches.pop(room_code, None)
+        room = self.rooms.remove(room_code)
+        if room is None:
+            return None
+
+        self.bug_scheduler.remove(room_code)
+        if self.journal is not None:
+            self.journal.deleted(room_code)
+        return room
+
+    def recover(self) -> int:
+        """Recreates the rooms recorded by the journal, without any client.
+
+        Their clients get them back by joining them again.
+        Returns:
+            The number of recovered rooms.
+        """
+        if self.journal is None:
+            return 0
+
+        recovered = 0
+        for room_code, snapshot in self.journal.recover().items():
+            room, created = self.rooms.create(room_code, lambda: Room.from_snapshot(snapshot))
+            if created:
+                self.bug_scheduler.add(room_code, room.difficulty)
+                recovered += 1
+        return recovered
+
+    def create_room(self, client: Client, room_code: str, difficulty: int) -> Room:
         """Create the room for the client.
 
+        A hibernated room has to be rehydrated first, see `rehydrate`, which
+        doesn't touch the disk here.
         Args:
             client: The client that will join to the new room.
             room_code: The room to which the client will be connected.
             difficulty: The difficuty of the room.
+
+        Returns:
+            The new room.
         """
-        if not self._room_exists(room_code):
-            self._rooms[room_code] = Room(client.id, {client}, difficulty)
-        else:
+        # A room being hibernated still exists
+        if room_code in self._store_operations:
+            raise RoomAlreadyExistsError(f"The room with code '{room_code}' already exists.")
+
+        room, created = self.rooms.create(room_code, lambda: Room(client.id, {client}, difficulty))
+        if not created:
             raise RoomAlreadyExistsError(f"The room with code '{room_code}' already exists.")
 
-    def join_room(self, client: Client, room_code: str) -> None:
+        self.bug_scheduler.add(room_code, difficulty)
+        if self.journal is not None:
+            self.journal.created(room_code, room)
+        return room
+
+    def join_room(self, client: Client, room_code: str) -> Room:
         """Adds a client to an active room.
 
+        A hibernated room has to be rehydrated first, see `rehydrate`.
         Args:
             client: The client that will join the given room.
             room_code: The room to which the client will be connected.
+
+        Returns:
+            The room joined.
         """
-        if self._room_exists(room_code):
-            self._rooms[room_code].clients.add(client)
-        else:
+        # The code sent to the new client already includes the batched
+        # replacements, so they must not be sent to it again
+        self._flush_replacements(room_code)
+
+        room = self.rooms.join(room_code, client)
+        if room is None:
             raise RoomNotFoundError(f"The room with code '{room_code}' was not found.")
+        return room
 
     async def broadcast(self, data: EventResponse, room_code: str, sender: Client | None = None) -> None:
         """Broadcasts data to all active connections.
 
+        The data is encoded once and queued for every client, which send it
+        concurrently. Clients lagging too far behind are sent the whole state
+        of the room instead.
         Args:
             data: The data to be sent to the clients.
             room_code: The room to which the data will be sent.
             sender (optional): The client who sent the request.
         """
-        for connection in self._rooms[room_code].clients:
+        # The batched replacements were made before this event
+        self._flush_replacements(room_code)
+
+        room = self.rooms[room_code]
+        text = encode_event(data)
+
+        for connection in room.clients:
             if connection == sender:
                 continue
-            await connection.send(data)
+            self._enqueue(room, connection, text)
+
+    async def send_bugs(self, room_code: str) -> None:
+        """Introduces bugs in the code of a room and broadcasts them.
+
+        Args:
+            room_code: The room in which bugs are introduced.
+        """
+        room = self.rooms.get(room_code)
+        if room is None:
+            return
+
+        code = room.code
+        if code.strip() == "":
+            return
+        index = room.token_index if self.bug_pool.is_inline(code) else None
+        replacements = await self.bug_pool.compute(code, room.difficulty, room.rng.getrandbits(64), index)
+
+        # The bugs can only be introduced in the code they were computed from,
+        # otherwise they're discarded until the next time
+        room = self.rooms.get(room_code)
+        if room is None or room.code != code:
+            self.discarded_bugs += 1
+            return
+
+        # The batched replacements must be broadcast before the code they're
+        # part of is changed
+        self._flush_replacements(room_code)
+        replacements = room.introduce_bugs(replacements)
+        self._record_change(room_code, room, replacements)
+
+        # Send to every client the bugs, rather than the whole code
+        if replacements:
+            self._send_replacements(room, replacements)
+
+    def sync_code(self, client: Client, room_code: str, code: str) -> None:
+        """Sets the code of a room and sends the changes to every client.
+
+        Args:
+            client: The client who set the code.
+            room_code: The room whose code is set.
+            code: The new code of the room.
+        """
+        room = self.rooms[room_code]
+
+        # The batched replacements must be broadcast before the code they're
+        # part of is changed
+        self._flush_replacements(room_code)
+        replacements = room.set_code(code, client.id)
+        self._record_change(room_code, room, replacements)
+
+        # Send to every client the changes, rather than the whole code
+        if replacements:
+            self._send_replacements(room, replacements, client)
+            self._enqueue(room, client, self._encode_acknowledgement(room), acknowledgement=True)
+
+    def replace(self, client: Client, room_code: str, replace_data: ReplaceData) -> None:
+        """Updates the code of a room and schedules the broadcast of a change.
+
+        The replacements made by a client in a short window are batched,
+        compacted and broadcast together. A batch is broadcast early when
+        another event of the room has to be broadcast after it.
+
+        The client is acknowledged right away, with the version of the code
+        after its replacements. Replacements made from an older version of
+        the code are transformed against the changes made by others since
+        then. If that's not possible, the client is also sent the whole state
+        of the room. The replacements of a client outside the room are
+        ignored.
+        Args:
+            client: The client who made the replacements.
+            room_code: The room of the client.
+            replace_data: The replacements made by the client.
+        """
+        room = self.rooms[room_code]
+        if client not in room.clients:
+            return
+
+        batch = self._batches.get(room_code)
+        if batch is not None and batch.sender != client:
+            self._flush_replacements(room_code)
+            batch = None
+
+        if batch is None:
+            batch = self._batches[room_code] = ReplaceBatch(client, room.code_length, room.version)
+            asyncio.get_running_loop().call_later(
+                self.replace_batch_window, self._flush_replacements, room_code, batch
+            )
+
+        stale = replace_data.version is not None and room.is_stale(client.id, replace_data.version)
+        replacements = room.update_code(replace_data, client.id)
+        self._record_change(room_code, room, replacements)
+        batch.replacements.extend(replacements)
+
+        # The client waits for the acknowledgement to send its next changes,
+        # which would be batched with these ones anyway
+        self._enqueue(room, client, self._encode_acknowledgement(room), acknowledgement=True)
+        if stale:
+            room.synced(client.id)
+            self._enqueue(room, client, self._encode_sync(room, client))
+
+    def _flush_replacements(self, room_code: str, batch: ReplaceBatch | None = None) -> None:
+        """Broadcasts the batched replacements of a room.
+
+        Args:
+            room_code: The room whose replacements are broadcast.
+            batch (optional): The batch to broadcast. If it was already
+                broadcast, nothing is done.
+        """
+        current = self._batches.get(room_code)
+        if current is None or (batch is not None and current is not batch):
+            return
+        del self._batches[room_code]
+
+        room = self.rooms.get(room_code)
+        if room is None:
+            return
+
+        replacements = compact(current.replacements, current.length)
+        self.removed_operations += len(current.replacements) - len(replacements)
+        if room.version > current.version:
+            room.squash_history(current.version, replacements)
+        if not replacements:
+            return
+
+        # The sender was already acknowledged
+        self._send_replacements(room, replacements, current.sender)
+
+    def _record_change(self, room_code: str, room: Room, replacements: list[Replacement]) -> None:
+        """Records a change of the code of a room in the journal, if any.
+
+        Args:
+            room_code: The code of the room.
+            room: The room, with the version of the code after the change.
+            replacements: The replacements applied to the code.
+        """
+        if self.journal is not None and replacements:
+            self.journal.changed(room_code, room.version, replacements)
+
+    def _send_replacements(self, room: Room, replacements: list[Replacement], sender: Client | None = None) -> None:
+        """Sends the replacements made to the code of a room, with its version.
+
+        The sender of the replacements, who already made them, is skipped.
+        Args:
+            room: The room whose code was replaced.
+            replacements: The replacements made to the code.
+            sender (optional): The client who made the replacements.
+        """
+        response = EventResponse(
+            type=EventType.REPLACE,
+            data=ReplaceData(code=replacements, version=room.version),
+            status_code=StatusCode.SUCCESS,
+        )
+        text = encode_event(response)
+
+        for connection in room.clients:
+            if connection != sender:
+                self._enqueue(room, connection, text)
+
+    def _encode_acknowledgement(self, room: Room) -> str:
+        """Encodes a replace event acknowledging the replacements of a client.
+
+        A replace event without replacements is always an acknowledgement, and
+        holds the version of the code after them.
+        Args:
+            room: The room whose code was replaced.
+
+        Returns:
+            The encoded replace event.
+        """
+        response = EventResponse(
+            type=EventType.REPLACE,
+            data=ReplaceData(code=[], version=room.version),
+            status_code=StatusCode.SUCCESS,
+        )
+        return encode_event(response)
+
+    def move_cursor(self, client: Client, room_code: str, position: Position) -> None:
+        """Moves the cursor of a client, and schedules its broadcast.
+
+        The moves of a room are batched and broadcast together once per tick,
+        only the last position of each cursor being sent. The cursors of
+        clients outside the room are ignored.
+        Args:
+            client: The client whose cursor moved.
+            room_code: The room of the client.
+            position: The new position of the cursor.
+        """
+        room = self.rooms[room_code]
+        if client in room.clients and room.move_cursor(client.id, position):
+            asyncio.get_running_loop().call_later(self.cursor_interval, self._flush_cursors, room_code)
+
+    def _flush_cursors(self, room_code: str) -> None:
+        """Broadcasts the cursors moved in a room since the last tick.
+
+        Clients whose own cursor is the only one that moved are skipped.
+        Args:
+            room_code: The room whose cursors are broadcast.
+        """
+        room = self.rooms.get(room_code)
+        if room is None:
+            return
+
+        # Lagging clients may be sent the code, which includes the batched
+        # replacements
+        self._flush_replacements(room_code)
+
+        cursors = room.flush_cursors()
+        if not cursors:
+            return
+
+        response = EventResponse(
+            type=EventType.CURSORS, data=CursorsData(cursors=cursors), status_code=StatusCode.SUCCESS
+        )
+        text = encode_event(response)
+
+        for connection in room.clients:
+            if len(cursors) == 1 and connection.id.hex in cursors:
+                continue
+            self._enqueue(room, connection, text)
+
+    def _enqueue(self, room: Room, client: Client, text: str, acknowledgement: bool = False) -> None:
+        """Queues an encoded event for a client of a room.
+
+        If the client is lagging too far behind, it's sent the whole state of
+        the room instead, after the acknowledgements of its changes.
+        Args:
+            room: The room of the client.
+            client: The client to send the event to.
+            text: The encoded event.
+            acknowledgement (optional): Whether the event acknowledges changes
+                of the client.
+        """
+        if not client.enqueue(text, acknowledgement):
+            room.synced(client.id)
+            client.resync(self._encode_sync(room, client), text if acknowledgement else None)
 
-    def _room_exists(self, room_code: str) -> bool:
-        """Checks if a room exists.
+    def _encode_sync(self, room: Room, client: Client) -> str:
+        """Encodes a sync event holding the whole state of a room.
 
         Args:
-            room_code: The code associated with a particular room.
+            room: The room to sync.
+            client: The client that will receive the sync event.
 
         Returns:
-            True if the room exists. False otherwise.
+            The encoded sync event.
         """
-        return room_code in self._rooms
+        collaborators, time = room.get_sync_state(client)
+        response = EventResponse(
+            type=EventType.SYNC,
+            data=SyncData(
+                code=room.code,
+                collaborators=collaborators,
+                time=time,
+                owner_id=room.owner_id.hex,
+                difficulty=room.difficulty,
+                version=room.version,
+            ),
+            status_code=StatusCode.SUCCESS,
+        )
+        return encode_event(response)
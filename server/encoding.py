@@ -0,0 +1,42 @@
+"""Encoding of the events sent over the WebSocket connections.
+
+Events are encoded once per broadcast, and the resulting frame is sent to every
+client of the room. orjson is used when it's installed, as it's much faster than
+the standard library, both to encode and to decode the messages.
+"""
+import json
+from typing import Any, Callable
+
+from server.events import EventResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps_json(obj: Any) -> str:
+    """Encodes an object with the standard library."""
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def dumps_orjson(obj: Any) -> str:
+    """Encodes an object with orjson."""
+    return orjson.dumps(obj).decode()
+
+
+dumps: Callable[[Any], str] = dumps_orjson if orjson is not None else dumps_json
+loads: Callable[[str], Any] = orjson.loads if orjson is not None else json.loads
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+def encode_event(response: EventResponse) -> str:
+    """Encodes an event to a text frame.
+
+    Args:
+        response: The event to encode.
+
+    Returns:
+        The JSON text of the event.
+    """
+    return dumps(response.dict())
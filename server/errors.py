@@ -1,5 +1,5 @@
 from server.codes import StatusCode
-from server.events import ErrorData, EventResponse, EventType
+from server.events import ErrorData, EvaluateData, EventResponse, EventType
 
 
 class RoomNotFoundError(Exception):
@@ -22,3 +22,36 @@ class RoomAlreadyExistsError(Exception):
         self.response = EventResponse(
             type=EventType.ERROR, data=ErrorData(message=message), status_code=StatusCode.ROOM_ALREADY_EXISTS
         )
+
+
+class EvaluationBusyError(Exception):
+    """Custom exception raised when too many evaluations are already queued."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+        self.response = EventResponse(
+            type=EventType.EVALUATE, data=EvaluateData(result=message), status_code=StatusCode.EVALUATION_BUSY
+        )
+
+
+class EvaluationTimeoutError(Exception):
+    """Custom exception raised when an evaluation takes too long."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+        self.response = EventResponse(
+            type=EventType.EVALUATE, data=EvaluateData(result=message), status_code=StatusCode.EVALUATION_TIMEOUT
+        )
+
+
+class EvaluationFailedError(Exception):
+    """Custom exception raised when the snekbox API can't evaluate the code."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+        self.response = EventResponse(
+            type=EventType.EVALUATE, data=EvaluateData(result=message), status_code=StatusCode.EVALUATION_FAILED
+        )
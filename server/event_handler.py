@@ -1,10 +1,15 @@
-from datetime import datetime
 from typing import cast
 
 from server.client import Client
 from server.codes import StatusCode
 from server.connection_manager import ConnectionManager
-from server.errors import RoomAlreadyExistsError, RoomNotFoundError
+from server.errors import (
+    EvaluationBusyError,
+    EvaluationFailedError,
+    EvaluationTimeoutError,
+    RoomAlreadyExistsError,
+    RoomNotFoundError,
+)
 from server.events import (
     ConnectData,
     DisconnectData,
@@ -20,24 +25,26 @@ from server.events import (
     UserInfo,
 )
 from server.room import Room
-from server.snekbox import evaluate
+from server.snekbox import SnekboxPool
 
 
 class EventHandler:
     """An request event handler."""
 
-    def __init__(self, client: Client, manager: ConnectionManager):
+    def __init__(self, client: Client, manager: ConnectionManager, evaluator: SnekboxPool):
         """Initializes the event handler for each client.
 
         Args:
             client: The client sending the requests.
             manager: The ConnectionManager handling the rooms.
+            evaluator: The pool evaluating the code of the rooms.
         """
         self.client = client
         self.manager = manager
+        self.evaluator = evaluator
 
-        # The room code and the room will be set after the initial connection
-        # event is handled
+        # The room code and the room will be set once the client created or
+        # joined a room
         self.room_code: str
         self.room: Room
 
@@ -61,6 +68,20 @@ class EventHandler:
         except (RoomNotFoundError, RoomAlreadyExistsError) as err:
             await self.client.send(err.response)
 
+    async def handle_lost_connection(self) -> None:
+        """Handles a connection closed without a disconnect event.
+
+        The client is removed from its room, if it joined one, like on a
+        disconnect event.
+        """
+        room_code = getattr(self, "room_code", None)
+        if room_code is None:
+            return
+
+        await self.manager.drop_client(self.client, room_code)
+        if room_code not in self.manager.rooms:
+            self.evaluator.cancel(room_code)
+
     async def __call__(self, request: EventRequest) -> bool:
         """Handle a request received.
 
@@ -74,13 +95,22 @@ class EventHandler:
         """
         event_data = request.data
 
+        # A client whose connection failed isn't in any room
+        if request.type != EventType.CONNECT and not hasattr(self, "room_code"):
+            response = EventResponse(
+                type=EventType.ERROR,
+                data=ErrorData(message="The client must connect to a room first."),
+                status_code=StatusCode.INVALID_REQUEST_DATA,
+            )
+            await self.client.send(response)
+            return False
+
         match request.type:
             case EventType.CONNECT:
                 connect_data = cast(ConnectData, event_data)
                 connect_data.user_id = self.client.id.hex
 
                 self.client.username = connect_data.username
-                self.room_code = connect_data.room_code
 
                 match connect_data.connection_type:
                     case "create":
@@ -93,8 +123,12 @@ class EventHandler:
                             await self.client.send(response)
                             return False
 
-                        self.manager.create_room(self.client, connect_data.room_code, connect_data.difficulty)
-                        self.room = self.manager._rooms[self.room_code]
+                        # A hibernated room still exists
+                        await self.manager.rehydrate(connect_data.room_code)
+                        self.room = self.manager.create_room(
+                            self.client, connect_data.room_code, connect_data.difficulty
+                        )
+                        self.room_code = connect_data.room_code
 
                         collaborators, time = self._get_sync_state()
 
@@ -108,6 +142,7 @@ class EventHandler:
                                 time=time,
                                 owner_id=self.room.owner_id.hex,
                                 difficulty=self.room.difficulty,
+                                version=self.room.version,
                             ),
                             status_code=StatusCode.SUCCESS,
                         )
@@ -121,21 +156,30 @@ class EventHandler:
                         )
                         await self.client.send(response)
                     case "join":
-                        self.manager.join_room(self.client, self.room_code)
-                        self.room = self.manager._rooms[self.room_code]
+                        await self.manager.rehydrate(connect_data.room_code)
+                        self.room = self.manager.join_room(self.client, connect_data.room_code)
+                        self.room_code = connect_data.room_code
 
                         collaborators, time = self._get_sync_state()
 
+                        # A user joining again after losing their connection is
+                        # only sent the changes they missed, if still known
+                        changes = None
+                        if connect_data.version is not None:
+                            changes = self.room.changes_since(connect_data.version)
+
                         # Send a sync event to the client to update the code and
                         # the collaborators' list
                         response = EventResponse(
                             type=EventType.SYNC,
                             data=SyncData(
-                                code=self.room.code,
+                                code=self.room.code if changes is None else None,
                                 collaborators=collaborators,
                                 time=time,
                                 owner_id=self.room.owner_id.hex,
                                 difficulty=self.room.difficulty,
+                                version=self.room.version,
+                                changes=changes,
                             ),
                             status_code=StatusCode.SUCCESS,
                         )
@@ -160,72 +204,43 @@ class EventHandler:
                 await self.manager.broadcast(response, self.room_code, sender=self.client)
 
                 self.manager.disconnect(self.client, self.room_code)
+
+                # Nobody is left to see the result of a running evaluation
+                if not self.room.clients:
+                    self.evaluator.cancel(self.room_code)
             case EventType.SYNC:
                 # Validate the sender is the room owner
                 if self.client.id != self.room.owner_id:
                     return False
 
                 sync_data = cast(SyncData, event_data)
-                self.room.set_code(sync_data.code)
-
-                collaborators, time = self._get_sync_state(all_clients=True)
+                if sync_data.code is None:
+                    return False
 
-                # Broadcast to every client (including sender) a sync event
-                response = EventResponse(
-                    type=EventType.SYNC,
-                    data=SyncData(
-                        code=sync_data.code,
-                        collaborators=collaborators,
-                        time=time,
-                        owner_id=self.room.owner_id.hex,
-                        difficulty=self.room.difficulty,
-                    ),
-                    status_code=StatusCode.SUCCESS,
-                )
-                await self.manager.broadcast(response, self.room_code)
+                # Send to every client the changes made to the code, rather
+                # than the whole code
+                self.manager.sync_code(self.client, self.room_code, sync_data.code)
             case EventType.MOVE:
                 move_data = cast(MoveData, event_data)
-                self.room.cursors[self.client.id] = move_data.position
 
-                # Broadcast to every client a move event to update the cursors'
-                # positions
-                response = EventResponse(type=EventType.MOVE, data=move_data, status_code=StatusCode.SUCCESS)
-                await self.manager.broadcast(response, self.room_code, sender=self.client)
+                # The moves are batched and broadcast to every client as a
+                # cursors event to update the cursors' positions
+                self.manager.move_cursor(self.client, self.room_code, move_data.position)
             case EventType.REPLACE:
                 replace_data = cast(ReplaceData, event_data)
-                self.room.update_code(replace_data)
 
-                # Broadcast to every client a replace event to update the code
-                response = EventResponse(type=EventType.REPLACE, data=replace_data, status_code=StatusCode.SUCCESS)
-                await self.manager.broadcast(response, self.room_code, sender=self.client)
+                # The replacements are batched and broadcast to every client as
+                # a replace event to update the code
+                self.manager.replace(self.client, self.room_code, replace_data)
             case EventType.SEND_BUGS:
-                self.room.introduce_bugs()
-
-                collaborators, time = self._get_sync_state(all_clients=True)
-
-                # Broadcast to every client a sync event to update the code
-                response = EventResponse(
-                    type=EventType.SYNC,
-                    data=SyncData(
-                        code=self.room.code,
-                        collaborators=collaborators,
-                        time=time,
-                        owner_id=self.room.owner_id.hex,
-                        difficulty=self.room.difficulty,
-                    ),
-                    status_code=StatusCode.SUCCESS,
-                )
-                await self.manager.broadcast(response, self.room_code)
+                # Bugs are introduced by the bug scheduler of the manager, so
+                # that a room gets them once however many clients it has. The
+                # requests of older clients are ignored.
+                pass
             case EventType.EVALUATE:
-                result = evaluate(self.room.code)
-
-                # Broadcast to every client an evaluate event to show the result
-                response = EventResponse(
-                    type=EventType.EVALUATE,
-                    data=EvaluateData(result=result),
-                    status_code=StatusCode.SUCCESS,
-                )
-                await self.manager.broadcast(response, self.room_code)
+                # The evaluation runs in the background so that the other
+                # events of the room keep flowing while snekbox is busy
+                self.evaluator.schedule(self.room_code, self._evaluate(self.room.code))
             case _:
                 # Anything that doesn't match the request type
                 response = EventResponse(
@@ -237,6 +252,26 @@ class EventHandler:
 
         return False
 
+    async def _evaluate(self, code: str) -> None:
+        """Evaluates the code and broadcasts the result to the room.
+
+        Args:
+            code: The code to evaluate.
+        """
+        try:
+            result = await self.evaluator.evaluate(code)
+        except (EvaluationBusyError, EvaluationTimeoutError, EvaluationFailedError) as err:
+            await self.client.send(err.response)
+            return
+
+        # Broadcast to every client an evaluate event to show the result
+        response = EventResponse(
+            type=EventType.EVALUATE,
+            data=EvaluateData(result=result),
+            status_code=StatusCode.SUCCESS,
+        )
+        await self.manager.broadcast(response, self.room_code)
+
     def _get_sync_state(self, all_clients: bool = False) -> tuple[UserInfo, Time]:
         """Get the current state of a Room for syncing.
 
@@ -247,16 +282,4 @@ class EventHandler:
         Returns:
             The list of collaborators as well as the current time for syncing.
         """
-        if all_clients:
-            collaborators = [{"id": c.id.hex, "username": c.username} for c in self.room.clients]
-        else:
-            collaborators = [
-                {"id": c.id.hex, "username": c.username} for c in self.room.clients if c.id != self.client.id
-            ]
-
-        deltaseconds = (datetime.now() - self.room.epoch).total_seconds()
-        minutes, remainder = divmod(deltaseconds, 60)
-        seconds, milliseconds = divmod(remainder, 1)
-        time = Time(min=minutes, sec=seconds, mil=milliseconds)
-
-        return collaborators, time
+        return self.room.get_sync_state(None if all_clients else self.client)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Literal, Mapping, TypedDict
+from typing import Any, Literal, Mapping, TypedDict
 
 from pydantic import BaseModel, validator
 
@@ -27,6 +27,7 @@ class EventType(str, Enum):
     ERROR = "error"
     SEND_BUGS = "bugs"
     EVALUATE = "evaluate"
+    CURSORS = "cursors"
 
 
 class EventData(BaseModel):
@@ -47,6 +48,8 @@ class ConnectData(EventData):
         room_code: The unique four-letters code that will represent the room.
         username: The username of the user creating or joining the room.
         user_id (optional): The user_id of the connected user.
+        version (optional): The latest version of the code received by a user
+            joining the room again after losing their connection.
     """
 
     connection_type: Literal["create", "join"]
@@ -54,6 +57,7 @@ class ConnectData(EventData):
     room_code: str
     username: str
     user_id: str | None = None
+    version: int | None = None
 
     @validator("difficulty", pre=True, always=True)
     def valid_difficulty(cls, value, values):  # noqa: U100
@@ -77,18 +81,24 @@ class SyncData(EventData):
     """The data of a sync event.
 
     Fields:
-        code: The code that already exists in the room.
+        code (optional): The code that already exists in the room. Omitted when
+            the changes are sent instead.
         collaborators: The list of users that already collaborate in the room.
         time (optional): The elapsed time since the creation of the room.
         owner_id: The id of the owner of the room.
         difficulty: The level of difficulty.
+        version (optional): The version of the code. Only sent by the server.
+        changes (optional): The changes made to the code since the version
+            received by a user joining the room again. Only sent by the server.
     """
 
-    code: str
+    code: str | None = None
     collaborators: UserInfo
     time: Time | None = None
     owner_id: str
     difficulty: int
+    version: int | None = None
+    changes: list[Replacement] | None = None
 
 
 class MoveData(EventData):
@@ -101,14 +111,28 @@ class MoveData(EventData):
     position: Position
 
 
+class CursorsData(EventData):
+    """The data of a batch of cursor moves.
+
+    Fields:
+        cursors: The new positions of the cursors that moved, by user id.
+    """
+
+    cursors: dict[str, Position]
+
+
 class ReplaceData(EventData):
     """The data of a replace event.
 
     Fields:
         code: A list of modifications to the code.
+        version (optional): When sent by the server, the version of the code
+            after the modifications. When sent by a client, the latest version
+            it received.
     """
 
     code: list[Replacement]
+    version: int | None = None
 
 
 class ErrorData(EventData):
@@ -136,6 +160,19 @@ class EvaluateData(EventData):
     result: str | None
 
 
+EVENT_DATA_MODELS: dict[str, type[EventData]] = {
+    EventType.CONNECT: ConnectData,
+    EventType.DISCONNECT: DisconnectData,
+    EventType.SYNC: SyncData,
+    EventType.MOVE: MoveData,
+    EventType.REPLACE: ReplaceData,
+    EventType.ERROR: ErrorData,
+    EventType.SEND_BUGS: SendBugsData,
+    EventType.EVALUATE: EvaluateData,
+    EventType.CURSORS: CursorsData,
+}
+
+
 class EventRequest(BaseModel):
     """A WebSocket request event.
 
@@ -148,27 +185,13 @@ class EventRequest(BaseModel):
     @validator("data", pre=True)
     def valid_data(cls, value: EventData | Mapping, values):  # noqa: U100
         """Validates the data based on the event type."""
+        data_model = EVENT_DATA_MODELS[values["type"]]
+
+        if isinstance(value, data_model):
+            return value
         if isinstance(value, EventData):
             value = value.dict()
-
-        match values["type"]:
-            case EventType.CONNECT:
-                value = ConnectData(**value)
-            case EventType.DISCONNECT:
-                value = DisconnectData(**value)
-            case EventType.SYNC:
-                value = SyncData(**value)
-            case EventType.MOVE:
-                value = MoveData(**value)
-            case EventType.REPLACE:
-                value = ReplaceData(**value)
-            case EventType.ERROR:
-                value = ErrorData(**value)
-            case EventType.SEND_BUGS:
-                value = SendBugsData(**value)
-            case EventType.EVALUATE:
-                value = EvaluateData(**value)
-        return value
+        return data_model(**value)
 
 
 class EventResponse(EventRequest):
@@ -178,3 +201,71 @@ class EventResponse(EventRequest):
     """
 
     status_code: StatusCode
+
+
+def _decode_move(data: dict) -> MoveData | None:
+    """Decodes well-formed data of a move event without pydantic."""
+    position = data.get("position")
+    if type(position) is not dict:
+        return None
+
+    x, y = position.get("x"), position.get("y")
+    if type(x) is not int or type(y) is not int:
+        return None
+    return MoveData.construct(position={"x": x, "y": y})
+
+
+def _decode_replace(data: dict) -> ReplaceData | None:
+    """Decodes well-formed data of a replace event without pydantic."""
+    changes = data.get("code")
+    if type(changes) is not list:
+        return None
+
+    code = []
+    for change in changes:
+        if type(change) is not dict:
+            return None
+
+        from_index, to_index, value = change.get("from"), change.get("to"), change.get("value")
+        if type(from_index) is not int or type(to_index) is not int or type(value) is not str:
+            return None
+        code.append({"from": from_index, "to": to_index, "value": value})
+
+    version = data.get("version")
+    if version is not None and type(version) is not int:
+        return None
+    return ReplaceData.construct(code=code, version=version)
+
+
+_FAST_DECODERS = {
+    EventType.MOVE: _decode_move,
+    EventType.REPLACE: _decode_replace,
+}
+
+
+def decode_request(payload: Any) -> EventRequest:
+    """Decodes a request received from a client.
+
+    The type of the event is read first, so that only the matching data model
+    is validated, once. The data of move and replace events, sent while the
+    users type, is checked without pydantic when it's well-formed. Anything
+    else goes through the validation of EventRequest, to raise the same
+    errors.
+    Args:
+        payload: The decoded JSON sent by the client.
+
+    Returns:
+        The request of the client.
+    """
+    if type(payload) is dict and type(payload.get("type")) is str and type(payload.get("data")) is dict:
+        event_type = payload["type"]
+        data_model = EVENT_DATA_MODELS.get(event_type)
+
+        if data_model is not None:
+            decoder = _FAST_DECODERS.get(event_type)
+            data = decoder(payload["data"]) if decoder is not None else None
+            if data is None:
+                data = data_model(**payload["data"])
+            return EventRequest.construct(type=EventType(event_type), data=data)
+
+    return EventRequest(**payload)
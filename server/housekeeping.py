@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import NamedTuple
+
+from server.connection_manager import ConnectionManager
+
+# The time in seconds between two sweeps of the rooms
+SWEEP_INTERVAL = 30.0
+
+# The time in seconds without edits nor cursor moves after which a room nobody
+# is connected to is hibernated
+IDLE_TIMEOUT = 15 * 60.0
+
+log = logging.getLogger(__name__)
+
+
+class SweepStats(NamedTuple):
+    """What a sweep of the rooms cleaned up."""
+
+    dropped_clients: int
+    hibernated_rooms: int
+    pruned_snapshots: int
+
+
+class Housekeeper:
+    """Periodically cleans up the rooms of a connection manager.
+
+    The clients whose connection died without the server noticing are
+    dropped, the rooms nobody is connected to and nobody touched for a while
+    are hibernated to the snapshot store of the manager, and the snapshots
+    nobody came back to are deleted. A room whose clients only read its code
+    stays in memory for as long as they're connected.
+    """
+
+    def __init__(
+        self, manager: ConnectionManager, interval: float = SWEEP_INTERVAL, idle_timeout: float = IDLE_TIMEOUT
+    ) -> None:
+        """Initializes the housekeeper, without starting it.
+
+        Args:
+            manager: The connection manager whose rooms are cleaned up.
+            interval: The time in seconds between two sweeps.
+            idle_timeout: The time in seconds after which an idle room
+                without any client is hibernated.
+        """
+        self.manager = manager
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Starts sweeping the rooms, in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops sweeping the rooms."""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        """Sweeps the rooms once per interval."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception("Failed to sweep the rooms")
+
+    async def sweep(self) -> SweepStats:
+        """Cleans up the rooms once.
+
+        The rooms are walked one shard at a time, so the broadcasts aren't
+        delayed by a sweep of many rooms.
+        Returns:
+            The number of dropped clients, of hibernated rooms and of deleted
+            snapshots.
+        """
+        dropped = hibernated = 0
+        deadline = time.monotonic() - self.idle_timeout
+        async for _, rooms in self.manager.rooms.walk():
+            for room_code, room in rooms:
+                for client in [client for client in room.clients if not client.alive]:
+                    await self.manager.drop_client(client, room_code)
+                    dropped += 1
+
+                # Dropping the last client already hibernated the room
+                if room.clients or room.last_active >= deadline:
+                    continue
+                if await self.manager.hibernate(room_code):
+                    hibernated += 1
+
+        pruned = 0
+        if self.manager.store is not None:
+            pruned = await asyncio.to_thread(self.manager.store.prune)
+        return SweepStats(dropped, hibernated, pruned)
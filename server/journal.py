@@ -0,0 +1,357 @@
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterable
+
+from server.encoding import dumps, loads
+from server.events import Replacement
+from server.room import Room
+from server.rope import Rope
+from server.snapshots import RoomSnapshot
+
+# The time in seconds between two writes of the journal to disk, and so the
+# changes lost at most on a crash
+FLUSH_INTERVAL = 0.05
+
+# The size in bytes the journal grows to before the rooms are snapshot
+COMPACT_SIZE = 16 << 20
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+SNAPSHOT_PREFIX = "snapshot-"
+SNAPSHOT_SUFFIX = ".z"
+
+log = logging.getLogger(__name__)
+
+
+class RoomJournal:
+    """An append-only journal of the rooms, replayed to recover them.
+
+    The creation, changes and deletion of every room are recorded as JSON
+    lines. They're written and synced to disk in batches by a background task,
+    in a thread, so that the event loop never waits for the disk.
+
+    Once the journal grows past `compact_size`, the state of every room is
+    written as a snapshot, and the journal starts again in a new segment. The
+    snapshot numbered like a segment holds the state of the rooms before it,
+    so recovering loads the latest snapshot and replays the segments from
+    there. Older snapshots and segments are deleted once a snapshot is synced.
+
+    The journals of workers that are gone can be merged into the journal: their
+    rooms are recovered with its own, and they're deleted once its next
+    snapshot holds them.
+    """
+
+    def __init__(
+        self, directory: str | Path, flush_interval: float = FLUSH_INTERVAL, compact_size: int = COMPACT_SIZE
+    ) -> None:
+        """Initializes the journal, creating its directory if needed.
+
+        Args:
+            directory: The directory of the journal, used by a single process.
+            flush_interval: The time in seconds between two writes to disk.
+            compact_size: The size in bytes of the journal after which the
+                rooms are snapshot.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.compact_size = compact_size
+
+        self._pending: list[str] = []
+        # The segment written to, and the size of the journal since the latest
+        # snapshot
+        self._segment = 0
+        self._size = 0
+        self._file: BinaryIO | None = None
+        self._lock_file: int | None = None
+        self._rooms: Iterable[tuple[str, Room]] | None = None
+        self._task: asyncio.Task | None = None
+        self._writing: asyncio.Future | None = None
+        self._merged: list[RoomJournal] = []
+
+    def lock(self) -> bool:
+        """Locks the directory of the journal, so no other process uses it.
+
+        Returns:
+            True if the directory was locked, False if it's already in use.
+        """
+        if self._lock_file is not None:
+            return True
+
+        lock_file = os.open(self.directory / "lock", os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_file)
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def unlock(self) -> None:
+        """Unlocks the directory of the journal, for other processes."""
+        if self._lock_file is not None:
+            os.close(self._lock_file)
+            self._lock_file = None
+
+    def merge(self, journal: "RoomJournal") -> None:
+        """Merges the journal of a worker that is gone into this one.
+
+        Args:
+            journal: The journal, locked.
+        """
+        self._merged.append(journal)
+
+    def created(self, room_code: str, room: Room) -> None:
+        """Records the creation of a room, with its whole state.
+
+        Args:
+            room_code: The code of the room.
+            room: The room.
+        """
+        self._pending.append(dumps({"op": "create", "room": room_code, **room.snapshot().to_dict()}))
+
+    def changed(self, room_code: str, version: int, replacements: list[Replacement]) -> None:
+        """Records a change of the code of a room.
+
+        Args:
+            room_code: The code of the room.
+            version: The version of the code after the change.
+            replacements: The replacements applied to the code, in order.
+        """
+        self._pending.append(dumps({"op": "change", "room": room_code, "version": version, "changes": replacements}))
+
+    def deleted(self, room_code: str) -> None:
+        """Records the deletion of a room.
+
+        Args:
+            room_code: The code of the room.
+        """
+        self._pending.append(dumps({"op": "delete", "room": room_code}))
+
+    def _paths(self, prefix: str, suffix: str) -> list[tuple[int, Path]]:
+        """Lists the segments or snapshots of the journal, by number."""
+        paths = []
+        for path in self.directory.glob(f"{prefix}*{suffix}"):
+            start, stop = len(prefix), len(path.name) - len(suffix)
+            number = path.name[start:stop]
+            if number.isdigit():
+                paths.append((int(number), path))
+        return sorted(paths)
+
+    def _path(self, prefix: str, suffix: str, number: int) -> Path:
+        """Returns the path of a segment or a snapshot of the journal."""
+        return self.directory / f"{prefix}{number:08}{suffix}"
+
+    def recover(self) -> dict[str, RoomSnapshot]:
+        """Rebuilds the state of the rooms recorded by the journal.
+
+        A line cut short by a crash ends the segment it's in. The journal
+        carries on in a new segment. The rooms of the merged journals are
+        recovered too, unless this journal holds them.
+        Returns:
+            The state of the rooms, by room code.
+        """
+        rooms: dict[str, tuple[RoomSnapshot, Rope]] = {}
+        base = 0
+        snapshots = self._paths(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)
+        if snapshots:
+            base, path = snapshots[-1]
+            for room_code, data in loads(zlib.decompress(path.read_bytes())).items():
+                snapshot = RoomSnapshot.from_dict(data)
+                rooms[room_code] = (snapshot, Rope(snapshot.code))
+
+        last = base - 1
+        self._size = 0
+        for number, path in self._paths(SEGMENT_PREFIX, SEGMENT_SUFFIX):
+            last = max(last, number)
+            if number >= base:
+                self._size += self._replay(path, rooms)
+
+        self._segment = last + 1
+        recovered = {room_code: snapshot._replace(code=str(rope)) for room_code, (snapshot, rope) in rooms.items()}
+        for journal in self._merged:
+            for room_code, snapshot in journal.recover().items():
+                recovered.setdefault(room_code, snapshot)
+        return recovered
+
+    @staticmethod
+    def _replay(path: Path, rooms: dict[str, tuple[RoomSnapshot, Rope]]) -> int:
+        """Replays the records of a segment.
+
+        Args:
+            path: The path of the segment.
+            rooms: The state of the rooms, updated in place.
+
+        Returns:
+            The size in bytes of the segment.
+        """
+        content = path.read_bytes()
+        for line in content.splitlines():
+            try:
+                record = loads(line)
+            except ValueError:
+                log.warning("Journal segment %s cut short, ignoring its last records", path.name)
+                break
+
+            room_code = record["room"]
+            match record["op"]:
+                case "create":
+                    snapshot = RoomSnapshot.from_dict(record)
+                    rooms[room_code] = (snapshot, Rope(snapshot.code))
+                case "change":
+                    if room_code not in rooms:
+                        continue
+                    snapshot, rope = rooms[room_code]
+                    for replacement in record["changes"]:
+                        rope.replace(replacement["from"], replacement["to"], replacement["value"])
+                    rooms[room_code] = (snapshot._replace(version=record["version"]), rope)
+                case "delete":
+                    rooms.pop(room_code, None)
+        return len(content)
+
+    def start(self, rooms: Iterable[tuple[str, Room]]) -> None:
+        """Starts writing the journal, in the running event loop.
+
+        Args:
+            rooms: The rooms and their code, iterated over to snapshot them.
+        """
+        self._rooms = rooms
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Writes the remaining records and stops writing the journal."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await asyncio.gather(self._writing, return_exceptions=True)
+
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.unlock()
+        # The merged journals not snapshot yet are merged again on restart
+        for journal in self._merged:
+            journal.unlock()
+        self._merged.clear()
+
+    async def _run(self) -> None:
+        """Writes the journal once per flush interval."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to write the journal")
+
+    async def flush(self, compact: bool = False) -> None:
+        """Writes and syncs the pending records, and snapshots the rooms if due.
+
+        Args:
+            compact (optional): Whether to snapshot the rooms anyway.
+        """
+        # The rooms are only known once started, and the merged journals are
+        # deleted once snapshot
+        compact = (compact or self._size >= self.compact_size or bool(self._merged)) and self._rooms is not None
+        if not self._pending and not compact:
+            return
+
+        lines, self._pending = self._pending, []
+        # Every recorded change is already part of the rooms. Their snapshots
+        # are immutable, and only the code of the rooms that changed since it
+        # was last built is built again, the rest is left to the thread.
+        snapshots = None
+        if compact and self._rooms is not None:
+            snapshots = {room_code: room.snapshot() for room_code, room in self._rooms}
+
+        # The write goes on if the flushing task is cancelled, and the journal
+        # is only stopped once it's done
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, lines, snapshots))
+        await asyncio.shield(self._writing)
+
+    def _write(self, lines: list[str], snapshots: dict[str, RoomSnapshot] | None) -> None:
+        """Appends records to the journal, and writes a snapshot of the rooms.
+
+        This runs in a thread.
+        Args:
+            lines: The records.
+            snapshots: The state of every room after the records, if the rooms
+                are snapshot.
+        """
+        if self._file is None:
+            self._file = open(self._path(SEGMENT_PREFIX, SEGMENT_SUFFIX, self._segment), "ab")
+        if lines:
+            data = ("\n".join(lines) + "\n").encode()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(data)
+
+        if snapshots is None:
+            return
+
+        segment = self._segment + 1
+        path = self._path(SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX, segment)
+        temporary = path.with_suffix(".tmp")
+        with open(temporary, "wb") as file:
+            data = {room_code: snapshot.to_dict() for room_code, snapshot in snapshots.items()}
+            file.write(zlib.compress(dumps(data).encode(), 1))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+        self._file.close()
+        self._file = None
+        self._segment = segment
+        self._size = 0
+        for prefix, suffix in ((SEGMENT_PREFIX, SEGMENT_SUFFIX), (SNAPSHOT_PREFIX, SNAPSHOT_SUFFIX)):
+            for number, old_path in self._paths(prefix, suffix):
+                if number < segment:
+                    old_path.unlink(missing_ok=True)
+
+        merged, self._merged = self._merged, []
+        for journal in merged:
+            shutil.rmtree(journal.directory, ignore_errors=True)
+            journal.unlock()
+
+
+def claim_journal(directory: str | Path) -> RoomJournal:
+    """Finds a journal no other process uses, and locks it.
+
+    Each worker of the server has its own journal, in a numbered directory.
+    Workers started again take over the journals of the previous ones,
+    whatever their number. The journals no other process uses once this one
+    is claimed, left by workers that aren't started again, are merged into
+    it.
+    Args:
+        directory: The directory of the journals.
+
+    Returns:
+        The locked journal.
+    """
+    slot = 0
+    journal = RoomJournal(Path(directory) / "worker-0")
+    while not journal.lock():
+        slot += 1
+        journal = RoomJournal(Path(directory) / f"worker-{slot}")
+
+    for path in sorted(Path(directory).glob("worker-*")):
+        if path == journal.directory or not path.is_dir():
+            continue
+        orphan = RoomJournal(path)
+        if orphan.lock():
+            journal.merge(orphan)
+    return journal
@@ -4,16 +4,68 @@ This server handles user connection, disconnection and events.
 """
 from __future__ import annotations
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import os
+import tempfile
+from pathlib import Path
 
-from server.client import Client
+from fastapi import FastAPI, WebSocket
+
+from server.backplane import Backplane, InMemoryBackplane, UnixBackplane
 from server.connection_manager import ConnectionManager
-from server.event_handler import EventHandler
+from server.housekeeping import Housekeeper
+from server.journal import claim_journal
+from server.snapshots import SnapshotStore
+from server.snekbox import SnekboxPool
+from server.worker import Worker
+
+# The path of the Unix socket shared by the workers of the server, when it
+# runs several of them
+BACKPLANE_PATH = os.environ.get("BACKPLANE_PATH")
+
+# The directory of the snapshots of the hibernated rooms, shared by the
+# workers of the server
+SNAPSHOT_PATH = Path(os.environ.get("SNAPSHOT_PATH", Path(tempfile.gettempdir()) / "kindly-kappa-snapshots"))
+
+# The directory of the journals of the rooms, replayed when the server starts
+JOURNAL_PATH = Path(os.environ.get("JOURNAL_PATH", Path(tempfile.gettempdir()) / "kindly-kappa-journal"))
 
 app = FastAPI()
 
 
-manager = ConnectionManager()
+evaluator = SnekboxPool()
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    """Recovers the rooms, then starts the background tasks and workers.
+
+    The journal of the worker is claimed here rather than on import, which
+    would lock it for any process importing the module.
+    """
+    journal = claim_journal(JOURNAL_PATH)
+    manager = ConnectionManager(store=SnapshotStore(SNAPSHOT_PATH), journal=journal)
+    backplane: Backplane = UnixBackplane(BACKPLANE_PATH) if BACKPLANE_PATH else InMemoryBackplane()
+    app.state.journal = journal
+    app.state.housekeeper = Housekeeper(manager)
+    app.state.worker = Worker(manager, evaluator, backplane)
+
+    manager.recover()
+    manager.bug_scheduler.start()
+    app.state.housekeeper.start()
+    await app.state.worker.start()
+    journal.start(manager.rooms)
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    """Stops introducing bugs and closes the connections to the snekbox API."""
+    manager = app.state.worker.manager
+    await app.state.worker.stop()
+    await app.state.housekeeper.stop()
+    await app.state.journal.stop()
+    await manager.bug_scheduler.stop()
+    manager.bug_pool.shutdown()
+    await evaluator.aclose()
 
 
 @app.websocket("/room")
@@ -22,21 +74,7 @@ async def room(websocket: WebSocket) -> None:
 
     It creates a client and handles connection and disconnection with the
     ConnectionManager. It continuously receives and broadcasts data to the
-    active clients.
+    active clients. Clients of rooms owned by another worker are relayed to
+    it.
     """
-    client = Client(websocket)
-    await client.accept()
-
-    handler = EventHandler(client, manager)
-
-    initial_event = await client.receive()
-    await handler.handle_initial_connection(initial_event)
-
-    try:
-        while True:
-            event = await client.receive()
-            closed = await handler(event)
-            if closed:
-                break
-    except WebSocketDisconnect:
-        return
+    await app.state.worker.serve(websocket)
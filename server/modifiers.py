@@ -1,25 +1,88 @@
-import difflib
-import keyword
 import random
-import re
-from operator import methodcaller
+from bisect import insort
+from typing import Any, Callable, NamedTuple, TypeVar
 
 from typing_extensions import Self
 
-from server.events import ReplaceData
+from server.events import ReplaceData, Replacement
+from server.token_index import BOOLEANS, FOUR_SPACES, TYPES, TokenIndex, split_lines
 
-FOUR_SPACES = "    "
 TWO_SPACES = "  "
 STATEMENTS = ["cj9_kappa", "kindly_kappas", "buggy_feature", "jammers"]
-TYPES = ["bool", "int", "float", "bin", "str", "list", "tuple"]
 
-STARTSWITH_DEF_REGEX = re.compile(r"^\s*(async\s+def|def)\s(.*):")
+M = TypeVar("M", bound=Callable[..., Any])
+
+
+class Mutator(NamedTuple):
+    """A code modifier, and how often it's chosen relative to the others."""
+
+    name: str
+    apply: Callable[["Modifiers"], "Modifiers"]
+    weight: float
+
+
+# The code modifiers, in the order they're defined
+MUTATORS: dict[str, Mutator] = {}
+
+
+def mutator(weight: float = 1.0) -> Callable[[M], M]:
+    """Registers a method of the modifiers as a code modifier.
+
+    Args:
+        weight: How often the modifier is chosen, relative to the others.
+
+    Returns:
+        The decorator registering the method.
+    """
+
+    def register(method: M) -> M:
+        MUTATORS[method.__name__] = Mutator(method.__name__, method, weight)
+        return method
+
+    return register
+
+
+def plan(difficulty: int, rng: random.Random) -> list[Mutator]:
+    """Chooses the code modifiers applied to some code.
+
+    As many modifiers as the difficulty are drawn without replacement, each
+    with a chance proportional to its weight. A modifier whose weight is zero
+    is never drawn.
+
+    Args:
+        difficulty: The level of difficulty.
+        rng: The random generator drawing the modifiers.
+
+    Returns:
+        The modifiers to apply, in order.
+    """
+    candidates = [candidate for candidate in MUTATORS.values() if candidate.weight > 0]
+    chosen = []
+    for _ in range(min(difficulty, len(candidates))):
+        (drawn,) = rng.choices(candidates, weights=[candidate.weight for candidate in candidates])
+        candidates.remove(drawn)
+        chosen.append(drawn)
+    return chosen
+
+
+class Edit(NamedTuple):
+    """A replacement of the columns of a line of the original code."""
+
+    start: int
+    stop: int
+    value: str
 
 
 class Modifiers:
     """A set of code modifying methods."""
 
-    def __init__(self, file_contents: str, difficulty: int = 1) -> None:
+    def __init__(
+        self,
+        file_contents: str,
+        difficulty: int = 1,
+        index: TokenIndex | None = None,
+        rng: random.Random | None = None,
+    ) -> None:
         """This class has functions which introduce different types of bugs.
 
         All the functions should return Self so they can be chained to
@@ -27,16 +90,29 @@ class Modifiers:
         determined by the difficulty but they are randomly sampled
         across the entire codebase.
 
+        Each function records the exact columns it replaces in the lines
+        of the original code, from the positions of the token index, so the
+        replacements sent to the clients don't need any diffing.
+
         Args:
             file_contents: The raw data received from the websocket.
             difficulty: The level of difficulty selected. Defaults to 1.
+            index (optional): The token index of the contents, if already built.
+            rng (optional): The random generator of the modifiers. The same
+                contents, difficulty and seed always get the same bugs.
         """
-        _list_of_lines = [f"{line}\n" for line in file_contents.split("\n")][:-1]
+        _list_of_lines = split_lines(file_contents)
         self.file_contents = _list_of_lines.copy()
         self.difficulty = difficulty
 
         self.modified_contents = _list_of_lines
         self.modified_count = 0
+        # The edits of every modified line, sorted by column
+        self.edits: dict[int, list[Edit]] = {}
+
+        # The candidates of every modifier are found in a single pass
+        self.index = index if index is not None else TokenIndex(self.file_contents)
+        self.rng = rng if rng is not None else random.Random()
 
     @property
     def output(self) -> ReplaceData:
@@ -45,38 +121,62 @@ class Modifiers:
         Returns:
             Only the modified lines of code, including the line number.
         """
-        method_names = [
-            func
-            for func in dir(Modifiers)
-            if callable(getattr(Modifiers, func)) and not (func.startswith("__") or func.startswith("_"))
-        ]
-        methods = map(methodcaller, random.sample(method_names, self.difficulty))
-
-        for method in list(methods):
-            method(self)
+        for chosen in plan(self.difficulty, self.rng):
+            chosen.apply(self)
 
         return self._get_replacements()
 
+    def _edit(self, num: int, start: int, stop: int, value: str) -> bool:
+        """Replaces some columns of a line of the original code.
+
+        An edit overlapping an earlier edit of the line, or inserting at the
+        same column, is dropped, so that every edit applies to the original
+        code.
+
+        Args:
+            num: The number of the line.
+            start: The first replaced column.
+            stop: The column after the last replaced one.
+            value: The replacing text.
+
+        Returns:
+            True if the edit was recorded.
+        """
+        edits = self.edits.setdefault(num, [])
+        if any(start < edit.stop and edit.start < stop or start == edit.start for edit in edits):
+            return False
+        insort(edits, Edit(start, stop, value))
+
+        # The modified line is only rebuilt to be read
+        line = self.file_contents[num]
+        parts = []
+        position = 0
+        for edit_start, edit_stop, edit_value in edits:
+            parts.append(line[position:edit_start])
+            parts.append(edit_value)
+            position = edit_stop
+        parts.append(line[position:])
+        self.modified_contents[num] = "".join(parts)
+        return True
+
+    @mutator()
     def remove_indentation(self) -> Self:
         """A code modifier that causes an IndentationError.
 
-        This will reduce indentation from four spaces to two spaces.
+        This will reduce the indentation of a line by two spaces.
 
         Returns:
             The modifier instance.
         """
-        line_numbers = []
-        for num, line in enumerate(self.file_contents):
-            if line.startswith(FOUR_SPACES):
-                line_numbers.append(num)
-
-        line_subset = random.sample(line_numbers, min(self.difficulty, len(line_numbers)))
+        line_numbers = self.index.indented_lines
+        line_subset = self.rng.sample(line_numbers, min(self.difficulty, len(line_numbers)))
         for num in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace(FOUR_SPACES, TWO_SPACES)
+            self._edit(num, 0, len(TWO_SPACES), "")
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def remove_end_colon(self) -> Self:
         """A code modifier that causes a SyntaxError.
 
@@ -86,18 +186,17 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        line_numbers = []
-        for num, line in enumerate(self.file_contents):
-            if line.endswith(":\n"):
-                line_numbers.append(num)
-
-        line_subset = random.sample(line_numbers, min(self.difficulty, len(line_numbers)))
+        line_numbers = self.index.colon_lines
+        line_subset = self.rng.sample(line_numbers, min(self.difficulty, len(line_numbers)))
         for num in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace(":", "")
+            # The line ends with the colon and the newline
+            end = len(self.file_contents[num]) - 1
+            self._edit(num, end - 1, end, "")
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def change_keyword(self) -> Self:
         """A code modifier that causes a SyntaxError.
 
@@ -106,20 +205,17 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        python_keywords = keyword.kwlist
+        number_keyword_pairs = self.index.keywords
 
-        number_keyword_pairs = []
-        for num, line in enumerate(self.file_contents):
-            if any(key in line for key in python_keywords):
-                number_keyword_pairs.extend([(num, key) for key in python_keywords if key in line])
-
-        line_subset = random.sample(number_keyword_pairs, min(self.difficulty, len(number_keyword_pairs)))
+        line_subset = self.rng.sample(number_keyword_pairs, min(self.difficulty, len(number_keyword_pairs)))
         for num, key in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace(key, random.choice(STATEMENTS))
+            column = self.index.column(num, key)
+            self._edit(num, column, column + len(key), self.rng.choice(STATEMENTS))
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def comment(self) -> Self:
         """A code modifier that could raise an error.
 
@@ -128,18 +224,15 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        line_numbers = []
-        for num, line in enumerate(self.file_contents):
-            if line != "\n":
-                line_numbers.append(num)
-
-        line_subset = random.sample(line_numbers, min(self.difficulty, len(line_numbers)))
+        line_numbers = self.index.non_empty_lines
+        line_subset = self.rng.sample(line_numbers, min(self.difficulty, len(line_numbers)))
         for num in line_subset:
-            self.modified_contents[num] = f"# {self.modified_contents[num]}"
+            self._edit(num, 0, 0, "# ")
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def change_function_call_name(self) -> Self:
         """A code modifier that causes a NameError.
 
@@ -149,38 +242,28 @@ class Modifiers:
             The modifier instance.
         """
         function_names = []
-        for num, line in enumerate(self.file_contents):
-            match = STARTSWITH_DEF_REGEX.match(line)
-
-            if match:
-                func_name = match.groups()[1].split("(")[0]
-
-                # Don't include dunder methods
-                if func_name.startswith("__"):
-                    continue
-
-                # If the method is a property, don't use it as it's not callable
-                if self.file_contents[num - 1] == f"{FOUR_SPACES}@property\n":
-                    continue
-
-                function_names.append((num, func_name))
-
-        line_subset = random.sample(function_names, min(self.difficulty, len(function_names)))
-        for num, line in enumerate(self.file_contents):
-            for def_num, func_name in line_subset:
-                if num == def_num:
-                    continue
-
-                func_match = re.match(rf".*\.?({func_name}\().*", line)
-
-                if func_match:
-                    self.modified_contents[num] = self.modified_contents[num].replace(
-                        func_name, random.choice(STATEMENTS)
-                    )
+        for num, func_name in self.index.defs:
+            # Don't include dunder methods
+            if func_name.startswith("__"):
+                continue
+
+            # If the method is a property, don't use it as it's not callable
+            if self.file_contents[num - 1] == f"{FOUR_SPACES}@property\n":
+                continue
+
+            function_names.append((num, func_name))
+
+        line_subset = self.rng.sample(function_names, min(self.difficulty, len(function_names)))
+        for _, func_name in line_subset:
+            # Every call of the function is renamed to the same statement
+            statement = self.rng.choice(STATEMENTS)
+            for num, column in self.index.calls.get(func_name, []):
+                self._edit(num, column, column + len(func_name), statement)
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def insert_empty_statements(self) -> Self:
         """A code modifier that causes an IndentationError.
 
@@ -190,14 +273,17 @@ class Modifiers:
             The modifier instance.
         """
         total_length = len(self.file_contents)
-        random_position = random.randrange(total_length)
+        random_position = self.rng.randrange(total_length)
 
-        statement = f"if {random.choice(STATEMENTS)}\n"
-        self.modified_contents[random_position] = f"{self.modified_contents[random_position]}\n{statement}"
+        statement = f"if {self.rng.choice(STATEMENTS)}\n"
+        # After the newline ending the line
+        end = len(self.file_contents[random_position])
+        self._edit(random_position, end, end, f"\n{statement}")
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def reverse_booleans(self) -> Self:
         """A code modifier that messes up some conditions.
 
@@ -206,20 +292,17 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        number_boolean_pairs = []
-        for num, line in enumerate(self.file_contents):
-            if any(key in line for key in ["True", "False"]):
-                number_boolean_pairs.extend([(num, key) for key in ["True", "False"] if key in line])
+        number_boolean_pairs = self.index.booleans
 
-        line_subset = random.sample(number_boolean_pairs, min(self.difficulty, len(number_boolean_pairs)))
+        line_subset = self.rng.sample(number_boolean_pairs, min(self.difficulty, len(number_boolean_pairs)))
         for num, key in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace(
-                key, str(bool(["True", "False"].index(key)))
-            )
+            column = self.index.column(num, key)
+            self._edit(num, column, column + len(key), str(bool(BOOLEANS.index(key))))
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def break_equals_statement(self) -> Self:
         """A code modifier that causes a SyntaxError.
 
@@ -228,18 +311,16 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        line_numbers = []
-        for num, line in enumerate(self.file_contents):
-            if "==" in line:
-                line_numbers.append(num)
-
-        line_subset = random.sample(line_numbers, min(self.difficulty, len(line_numbers)))
+        line_numbers = self.index.equals_lines
+        line_subset = self.rng.sample(line_numbers, min(self.difficulty, len(line_numbers)))
         for num in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace("==", "=")
+            for column in self.index.tokens[num].equals:
+                self._edit(num, column, column + 1, "")
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def mix_type_keywords(self) -> Self:
         """A code modifier that causes a ValueError.
 
@@ -248,20 +329,18 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        number_type_pairs = []
-        for num, line in enumerate(self.file_contents):
-            if any(key in line for key in TYPES):
-                number_type_pairs.extend([(num, key) for key in TYPES if key in line])
+        number_type_pairs = self.index.types
 
-        line_subset = random.sample(number_type_pairs, min(self.difficulty, len(number_type_pairs)))
+        line_subset = self.rng.sample(number_type_pairs, min(self.difficulty, len(number_type_pairs)))
         for num, key in line_subset:
-            self.modified_contents[num] = self.modified_contents[num].replace(
-                key, random.choice([type_kw for type_kw in TYPES if type_kw != key])
-            )
+            column = self.index.column(num, key)
+            new_type = self.rng.choice([type_kw for type_kw in TYPES if type_kw != key])
+            self._edit(num, column, column + len(key), new_type)
         self.modified_count += 1
 
         return self
 
+    @mutator()
     def add_or_remove_brackets(self) -> Self:
         """A code modifier that causes a SyntaxError.
 
@@ -271,29 +350,18 @@ class Modifiers:
         Returns:
             The modifier instance.
         """
-        line_count_brackets = []
-        for num, line in enumerate(self.file_contents):
-            if any(bracket in line for bracket in "()[]"):
-                line_count_brackets.append(
-                    (
-                        num,
-                        line.count("(") + line.count(")") + line.count("[") + line.count("]"),
-                        [(index, bracket) for index, bracket in enumerate(line) if bracket in "()[]"],
-                    )
-                )
+        line_count_brackets = [(num, len(brackets), brackets) for num, brackets in self.index.brackets.items()]
 
         for _ in range(min(self.difficulty, len(line_count_brackets))):
-            chosen = random.choices(
+            chosen = self.rng.choices(
                 population=line_count_brackets,
                 weights=[count[1] for count in line_count_brackets],
                 k=1,
             )[0]
             line_count_brackets.remove(chosen)
 
-            bracket = random.choice(chosen[2])
-            string_contents = list(self.modified_contents[chosen[0]])
-            string_contents[bracket[0]] = random.choice(["", bracket[1] * 2])
-            self.modified_contents[chosen[0]] = "".join(string_contents)
+            column, bracket = self.rng.choice(chosen[2])
+            self._edit(chosen[0], column, column + 1, self.rng.choice(["", bracket * 2]))
         self.modified_count += 1
 
         return self
@@ -303,29 +371,24 @@ class Modifiers:
 
         This method is to convert all of the code modifications
         into a format that can be sent as an EventResponse to
-        the client.
+        the client. Every edit gives a single replacement, at its
+        position in the code once the previous edits are made.
 
         Returns:
             The converted replacement data.
         """
-        replacements = []
-
-        current_position = 0
-        deletes = 0
-        for input_line, output_line in zip(self.file_contents, self.modified_contents):
-            for diff in difflib.ndiff(input_line, output_line):
-                if diff[0] == "-":
-                    # Removed values should always have the value set to ""
-                    replacements.append(
-                        {"from": current_position - deletes, "to": (current_position + 1) - deletes, "value": ""}
-                    )
-                    deletes += 1
-
-                if diff[0] == "+":
-                    replacements.append(
-                        {"from": current_position - deletes, "to": current_position - deletes, "value": diff[-1]}
-                    )
-
-                current_position += 1
+        replacements: list[Replacement] = []
+        line_start = 0
+        previous = 0
+        shift = 0
+        for num in sorted(self.edits):
+            line_start += sum(map(len, self.file_contents[previous:num]))
+            previous = num
+            for start, stop, value in self.edits[num]:
+                # The previous edits moved the line by `shift` characters
+                start += line_start + shift
+                stop += line_start + shift
+                replacements.append({"from": start, "to": stop, "value": value})
+                shift += len(value) - (stop - start)
 
         return ReplaceData(code=replacements)
@@ -0,0 +1,130 @@
+from typing import Iterable
+
+from server.client import Client
+from server.events import Replacement
+
+
+def merge(first: Replacement, second: Replacement) -> Replacement | None:
+    """Merges two replacements applied one after the other into one.
+
+    This is only possible if the second replacement touches the text inserted
+    by the first one, which is the case for most of the changes made while
+    typing or deleting.
+    Args:
+        first: The replacement applied first.
+        second: The replacement applied to the result of the first one.
+
+    Returns:
+        The replacement equivalent to both, or None if they can't be merged.
+    """
+    first_from, first_to, first_value = first["from"], first["to"], first["value"]
+    second_from, second_to, second_value = second["from"], second["to"], second["value"]
+
+    if not (0 <= first_from <= first_to and 0 <= second_from <= second_to):
+        return None
+
+    # The range of the text inserted by the first replacement, once applied
+    inserted_end = first_from + len(first_value)
+    if second_from > inserted_end or second_to < first_from:
+        return None
+
+    prefix_end = max(0, second_from - first_from)
+    suffix_start = max(0, second_to - first_from)
+    return {
+        "from": min(first_from, second_from),
+        "to": first_to + max(0, second_to - inserted_end),
+        "value": first_value[:prefix_end] + second_value + first_value[suffix_start:],
+    }
+
+
+def compact(replacements: Iterable[Replacement], length: int) -> list[Replacement]:
+    """Compacts a list of replacements applied one after the other.
+
+    Adjacent insertions and deletions are merged into a single replacement of
+    the whole range, and replacements that don't change anything are dropped.
+    Applying the compacted replacements gives the same result as applying
+    the original ones.
+    Args:
+        replacements: The replacements to compact, in the order of application.
+        length: The length of the text the replacements are applied to.
+
+    Returns:
+        The compacted replacements.
+    """
+    compacted: list[Replacement] = []
+    last_in_bounds = False
+    for replacement in replacements:
+        # Replacements outside of the text are clamped when applied, so they
+        # are kept as they are
+        in_bounds = replacement["to"] <= length
+        start, stop, _ = slice(replacement["from"], replacement["to"]).indices(length)
+        length += len(replacement["value"]) - max(0, stop - start)
+
+        merged = merge(compacted[-1], replacement) if compacted and last_in_bounds and in_bounds else None
+        if merged is not None:
+            compacted[-1] = replacement = merged
+        else:
+            compacted.append(replacement)
+            last_in_bounds = in_bounds
+
+        if replacement["from"] == replacement["to"] and not replacement["value"]:
+            compacted.pop()
+            last_in_bounds = False
+    return compacted
+
+
+def _common_prefix(first: str, second: str) -> int:
+    """Returns the length of the common prefix of two strings.
+
+    The prefix is found by bisection, comparing slices of the strings rather
+    than their characters one by one.
+    """
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def diff(old: str, new: str) -> list[Replacement]:
+    """Finds a replacement changing a text into another.
+
+    Only the range between the common prefix and the common suffix of the
+    texts is replaced.
+    Args:
+        old: The text to change.
+        new: The text to change it into.
+
+    Returns:
+        The replacement, or no replacement if the texts are equal.
+    """
+    if old == new:
+        return []
+
+    prefix = _common_prefix(old, new)
+    max_suffix = min(len(old), len(new)) - prefix
+    old_tail, new_tail = len(old) - max_suffix, len(new) - max_suffix
+    suffix = _common_prefix(old[old_tail:][::-1], new[new_tail:][::-1])
+
+    value_end = len(new) - suffix
+    return [{"from": prefix, "to": len(old) - suffix, "value": new[prefix:value_end]}]
+
+
+class ReplaceBatch:
+    """Replacements made by a client, waiting to be broadcast together."""
+
+    def __init__(self, sender: Client, length: int, version: int) -> None:
+        """Initializes the batch.
+
+        Args:
+            sender: The client who made the replacements.
+            length: The length of the code before the replacements.
+            version: The version of the code before the replacements.
+        """
+        self.sender = sender
+        self.length = length
+        self.version = version
+        self.replacements: list[Replacement] = []
@@ -0,0 +1,205 @@
+"""Operational transformation of concurrent replacements.
+
+Two clients may replace the code at the same time, both from the same
+version. The server applies one of the changes first, and the other one is
+transformed so that it applies after it, giving the same code as applying
+them in the opposite order. The clients transform the changes they receive
+against their own changes not yet acknowledged by the server in the same way.
+"""
+from server.events import ReplaceData, Replacement, SyncData
+
+
+def _shift(replacement: Replacement, delta: int) -> Replacement:
+    """Moves a replacement by some number of characters."""
+    return {"from": replacement["from"] + delta, "to": replacement["to"] + delta, "value": replacement["value"]}
+
+
+def transform_pair(first: Replacement, applied: Replacement) -> tuple[Replacement, Replacement]:
+    """Transforms two concurrent replacements against each other.
+
+    Replacements of separate ranges are only moved. When the ranges overlap,
+    the union of both is replaced by both values, in the order of their
+    starts. Insertions at the same place are made in the order the server
+    applies them.
+    Args:
+        first: A replacement not applied yet.
+        applied: A replacement made from the same text, and applied before.
+
+    Returns:
+        The first replacement to apply after the applied one, and the applied
+        replacement to apply after the first one.
+    """
+    start, stop, value = first["from"], first["to"], first["value"]
+    applied_start, applied_stop, applied_value = applied["from"], applied["to"], applied["value"]
+    delta = len(value) - (stop - start)
+    applied_delta = len(applied_value) - (applied_stop - applied_start)
+
+    if applied_stop <= start:
+        return _shift(first, applied_delta), applied
+    if stop <= applied_start:
+        return first, _shift(applied, delta)
+
+    if applied_start <= start:
+        # The applied value comes first, and the first value right after it
+        inserted_at = applied_start + len(applied_value)
+        first = {"from": inserted_at, "to": inserted_at + max(0, stop - applied_stop), "value": value}
+        overlapped_stop = start + len(value) + max(0, applied_stop - stop)
+        applied = {"from": applied_start, "to": overlapped_stop, "value": applied_value + value}
+    else:
+        inserted_at = start + len(value)
+        overlapped_stop = applied_start + len(applied_value) + max(0, stop - applied_stop)
+        first = {"from": start, "to": overlapped_stop, "value": value + applied_value}
+        applied = {"from": inserted_at, "to": inserted_at + max(0, applied_stop - stop), "value": applied_value}
+    return first, applied
+
+
+def transform(
+    replacements: list[Replacement], applied: list[Replacement]
+) -> tuple[list[Replacement], list[Replacement]]:
+    """Transforms two concurrent lists of replacements against each other.
+
+    Each list is applied in order, and both are made from the same text.
+    Args:
+        replacements: The replacements not applied yet.
+        applied: The replacements applied before.
+
+    Returns:
+        The replacements to apply after the applied ones, and the applied
+        replacements to apply after the others.
+    """
+    transformed = []
+    for replacement in replacements:
+        transformed_applied = []
+        for applied_replacement in applied:
+            replacement, applied_replacement = transform_pair(replacement, applied_replacement)
+            transformed_applied.append(applied_replacement)
+
+        transformed.append(replacement)
+        applied = transformed_applied
+    return transformed, applied
+
+
+def normalize(replacements: list[Replacement], length: int) -> list[Replacement]:
+    """Clamps replacements to the text they're applied to.
+
+    Indices are handled like slice indices, as when applied to the code, and
+    reversed ranges are made empty, so that they can be transformed.
+    Args:
+        replacements: The replacements, in the order of application.
+        length: The length of the text the replacements are applied to.
+
+    Returns:
+        The normalized replacements.
+    """
+    normalized: list[Replacement] = []
+    for replacement in replacements:
+        start, stop, _ = slice(replacement["from"], replacement["to"]).indices(length)
+        stop = max(start, stop)
+        normalized.append({"from": start, "to": stop, "value": replacement["value"]})
+        length += len(replacement["value"]) - (stop - start)
+    return normalized
+
+
+def apply(text: str, replacements: list[Replacement]) -> str:
+    """Applies replacements to a text, in order.
+
+    Args:
+        text: The text to change.
+        replacements: The replacements to apply.
+
+    Returns:
+        The changed text.
+    """
+    for replacement in replacements:
+        start, stop = replacement["from"], replacement["to"]
+        text = text[:start] + replacement["value"] + text[stop:]
+    return text
+
+
+class ClientDocument:
+    """The code of a room as seen by a client, following the protocol.
+
+    A client only has one list of replacements waiting to be acknowledged by
+    the server at a time, sent with the latest version of the code it
+    received. The replacements it makes in the meantime are queued, and sent
+    one list at a time, as they were made. The replacements of others it
+    receives are transformed against its own replacements not acknowledged
+    yet, which are transformed in the same way by the server.
+
+    This is the behavior of the frontend, used to simulate clients.
+    """
+
+    def __init__(self, code: str = "", version: int = 0) -> None:
+        """Initializes the document.
+
+        Args:
+            code: The code of the room.
+            version: The version of the code.
+        """
+        self.code = code
+        self.version = version
+        self.pending: list[Replacement] | None = None
+        self.queued: list[list[Replacement]] = []
+
+    def edit(self, replacements: list[Replacement]) -> ReplaceData | None:
+        """Makes replacements to the code.
+
+        Args:
+            replacements: The replacements, in order.
+
+        Returns:
+            The data of the replace event to send, if any.
+        """
+        self.code = apply(self.code, replacements)
+        if self.pending is not None:
+            self.queued.append(replacements)
+            return None
+
+        self.pending = replacements
+        return ReplaceData(code=replacements, version=self.version)
+
+    def receive(self, replace_data: ReplaceData) -> ReplaceData | None:
+        """Handles a replace event sent by the server.
+
+        Args:
+            replace_data: The data of the event.
+
+        Returns:
+            The data of the replace event to send next, if any.
+        """
+        if replace_data.version is not None:
+            self.version = replace_data.version
+
+        if not replace_data.code:
+            # The pending replacements were acknowledged
+            self.pending = None
+            if not self.queued:
+                return None
+            self.pending = self.queued.pop(0)
+            return ReplaceData(code=self.pending, version=self.version)
+
+        replacements = replace_data.code
+        if self.pending is not None:
+            self.pending, replacements = transform(self.pending, replacements)
+        for num, queued in enumerate(self.queued):
+            self.queued[num], replacements = transform(queued, replacements)
+        self.code = apply(self.code, replacements)
+        return None
+
+    def sync(self, sync_data: SyncData) -> None:
+        """Handles a sync event sent by the server.
+
+        The replacements not acknowledged yet are made again on top of the
+        code received, as the server will make them.
+        Args:
+            sync_data: The data of the event.
+        """
+        if sync_data.code is not None:
+            self.code = sync_data.code
+        elif sync_data.changes is not None:
+            self.code = apply(self.code, sync_data.changes)
+        if sync_data.version is not None:
+            self.version = sync_data.version
+
+        for replacements in [self.pending or [], *self.queued]:
+            self.code = apply(self.code, replacements)
@@ -0,0 +1,181 @@
+import asyncio
+import zlib
+from typing import AsyncIterator, Callable, Iterator, NamedTuple
+
+from server.client import Client
+from server.room import Room
+
+SHARD_COUNT = 64
+
+
+class ShardStats(NamedTuple):
+    """The statistics of a shard of the room registry."""
+
+    rooms: int
+    clients: int
+    memory: int
+
+
+class RoomRegistry:
+    """The active rooms, split in shards by room code.
+
+    Every operation on a room is a single step on the dict of its shard,
+    without awaiting anything in between, so checking if a room exists and
+    creating or joining it can't be interleaved with another operation on the
+    same room. No lock is needed: the event loop runs one step at a time.
+
+    Iterating over the rooms copies one shard at a time, and the asynchronous
+    iteration lets the event loop run between shards, so that walking tens of
+    thousands of rooms doesn't delay the broadcasts.
+    """
+
+    def __init__(self, shard_count: int = SHARD_COUNT) -> None:
+        """Initializes the empty shards.
+
+        Args:
+            shard_count: The number of shards.
+        """
+        self._shards: list[dict[str, Room]] = [{} for _ in range(shard_count)]
+
+    def shard_of(self, room_code: str) -> int:
+        """Finds the shard holding a room.
+
+        The hash of the room code is stable across processes, unlike the
+        built-in hash of strings, so that shards mean the same for every
+        worker.
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The index of the shard.
+        """
+        return zlib.crc32(room_code.encode()) % len(self._shards)
+
+    def _shard(self, room_code: str) -> dict[str, Room]:
+        """Returns the shard holding a room."""
+        return self._shards[self.shard_of(room_code)]
+
+    def get(self, room_code: str) -> Room | None:
+        """Gets a room.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The room, or None if it doesn't exist.
+        """
+        return self._shard(room_code).get(room_code)
+
+    def __getitem__(self, room_code: str) -> Room:
+        """Gets a room, raising a KeyError if it doesn't exist."""
+        return self._shard(room_code)[room_code]
+
+    def __contains__(self, room_code: object) -> bool:
+        """Checks if a room exists."""
+        return isinstance(room_code, str) and room_code in self._shard(room_code)
+
+    def __len__(self) -> int:
+        """Returns the number of rooms."""
+        return sum(len(shard) for shard in self._shards)
+
+    def create(self, room_code: str, factory: Callable[[], Room]) -> tuple[Room, bool]:
+        """Creates a room, unless it already exists.
+
+        Args:
+            room_code: The code of the room.
+            factory: The function creating the room, only called if needed.
+
+        Returns:
+            The room, and True if it was created.
+        """
+        shard = self._shard(room_code)
+        room = shard.get(room_code)
+        if room is not None:
+            return room, False
+
+        room = shard[room_code] = factory()
+        return room, True
+
+    def join(self, room_code: str, client: Client) -> Room | None:
+        """Adds a client to a room, if it exists.
+
+        Args:
+            room_code: The code of the room.
+            client: The client joining the room.
+
+        Returns:
+            The room, or None if it doesn't exist.
+        """
+        room = self._shard(room_code).get(room_code)
+        if room is not None:
+            room.clients.add(client)
+        return room
+
+    def leave(self, room_code: str, client: Client) -> bool:
+        """Removes a client from a room, deleting the room if it's empty.
+
+        Args:
+            room_code: The code of the room.
+            client: The client leaving the room.
+
+        Returns:
+            True if the room was deleted.
+        """
+        shard = self._shard(room_code)
+        room = shard.get(room_code)
+        if room is None:
+            return False
+
+        room.clients.discard(client)
+        room.cursors.pop(client.id, None)
+        room.moved_cursors.discard(client.id)
+        room.synced_versions.pop(client.id, None)
+        if room.clients:
+            return False
+
+        del shard[room_code]
+        return True
+
+    def remove(self, room_code: str) -> Room | None:
+        """Deletes a room.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The deleted room, or None if it didn't exist.
+        """
+        return self._shard(room_code).pop(room_code, None)
+
+    def __iter__(self) -> Iterator[tuple[str, Room]]:
+        """Iterates over the rooms and their code, one shard at a time."""
+        for shard in self._shards:
+            yield from list(shard.items())
+
+    async def walk(self) -> AsyncIterator[tuple[int, list[tuple[str, Room]]]]:
+        """Iterates over the shards, letting other tasks run between them.
+
+        The rooms of a shard are copied, so they can be created or deleted
+        while walking.
+        Returns:
+            The index of every shard, and its rooms with their code.
+        """
+        for index, shard in enumerate(self._shards):
+            yield index, list(shard.items())
+            await asyncio.sleep(0)
+
+    def stats(self) -> list[ShardStats]:
+        """Gets the statistics of every shard.
+
+        Returns:
+            The number of rooms, of clients and the estimated memory in bytes
+            of every shard.
+        """
+        return [
+            ShardStats(
+                len(shard),
+                sum(len(room.clients) for room in shard.values()),
+                sum(room.memory_usage for room in shard.values()),
+            )
+            for shard in self._shards
+        ]
@@ -1,67 +1,400 @@
+import random
+import time
+from collections import deque
 from datetime import datetime
 from uuid import UUID
 
 from server.client import Client
-from server.events import Position, ReplaceData, Replacement
-from server.modifiers import FOUR_SPACES, Modifiers
+from server.events import Position, ReplaceData, Replacement, Time, UserInfo
+from server.modifiers import Modifiers
+from server.operations import compact, diff
+from server.ot import normalize, transform
+from server.rope import Rope
+from server.snapshots import RoomSnapshot
+from server.token_index import TokenCache, TokenIndex, split_lines
+
+HISTORY_SIZE = 256
+HISTORY_MAX_CHARACTERS = 1 << 20
 
 
 class Room:
     """A room handled by the connection manager."""
 
-    def __init__(self, owner_id: UUID, clients: set[Client], difficulty: int) -> None:
+    def __init__(self, owner_id: UUID, clients: set[Client], difficulty: int, seed: int | None = None) -> None:
         """Initializes the room.
 
         Args:
             owner_id: The id of the owner of the room.
             clients: The connected clients.
             difficulty: The difficulty of the room.
+            seed (optional): The seed of the random generator of the bugs of
+                the room. A random one by default.
         """
         self.owner_id = owner_id
         self.clients = clients
         self.difficulty = difficulty
-        self.code = ""
+        self._document = Rope()
         self.cursors: dict[UUID, Position] = {}
+        self.moved_cursors: set[UUID] = set()
         self.epoch = datetime.now()
+        self.removed_operations = 0
+        # The bugs of the room only depend on its code and on this generator,
+        # so they can be reproduced
+        self.rng = random.Random(seed)
+        # The time of the last change or move of a client, from the monotonic
+        # clock
+        self.last_active = time.monotonic()
+
+        self._tokens = TokenCache()
+        self._token_index: TokenIndex | None = None
+
+        # The version of the code, increased on every change, and a ring
+        # buffer of the latest changes with the versions before and after them
+        # and their author (None for the server)
+        self.version = 0
+        # The version of the code last sent whole to each client, which makes
+        # its changes not acknowledged yet again on top of it
+        self.synced_versions: dict[UUID, int] = {}
+        self._history: deque[tuple[int, int, UUID | None, list[Replacement]]] = deque(maxlen=HISTORY_SIZE)
+        self._history_characters = 0
+
+    @property
+    def code(self) -> str:
+        """The code of the room, built from the document only when requested."""
+        return str(self._document)
+
+    @property
+    def code_length(self) -> int:
+        """The length of the code of the room."""
+        return len(self._document)
+
+    @property
+    def memory_usage(self) -> int:
+        """An estimate of the memory held by the room, in bytes.
+
+        The code and its history hold most of it, at about a byte per
+        character of code.
+        """
+        return len(self._document) + self._history_characters
+
+    @property
+    def token_index(self) -> TokenIndex:
+        """The token index of the code, only rescanning the changed lines."""
+        if self._token_index is None:
+            self._token_index = self._tokens.index(split_lines(self.code))
+        return self._token_index
+
+    def move_cursor(self, client_id: UUID, position: Position) -> bool:
+        """Moves the cursor of a client.
+
+        Args:
+            client_id: The id of the client whose cursor moved.
+            position: The new position of the cursor.
 
-    def update_code(self, replace_data: ReplaceData) -> None:
+        Returns:
+            True if it's the first cursor moved since the last flush.
+        """
+        self.cursors[client_id] = position
+        self.last_active = time.monotonic()
+
+        first_move = not self.moved_cursors
+        self.moved_cursors.add(client_id)
+        return first_move
+
+    def flush_cursors(self) -> dict[str, Position]:
+        """Gets the cursors moved since the last flush.
+
+        Returns:
+            The positions of the moved cursors, by user id.
+        """
+        moved = {
+            client_id.hex: self.cursors[client_id] for client_id in self.moved_cursors if client_id in self.cursors
+        }
+        self.moved_cursors.clear()
+        return moved
+
+    def update_code(self, replace_data: ReplaceData, author: UUID | None = None) -> list[Replacement]:
         """Updates the code.
 
+        Changes made from an older version of the code are transformed against
+        the changes made by others since then. If that's not possible, see
+        `is_stale`, they're applied as they are.
         Args:
             replace_data: A list of changes to make to the code.
+            author (optional): The id of the client who made the changes.
+
+        Returns:
+            The replacements applied to the code.
         """
-        current_code = self.code
+        replacements = replace_data.code
+        version = None if replace_data.version is None else self._base_version(author, replace_data.version)
+        if version is not None and version < self.version:
+            concurrent = self._concurrent_changes(author, version)
+            if concurrent:
+                # Only others changed the code since the version of the client
+                base_length = self.code_length - sum(len(r["value"]) - (r["to"] - r["from"]) for r in concurrent)
+                replacements, _ = transform(normalize(replacements, base_length), concurrent)
+
+        return self._apply(replacements, author)
 
-        # This checks if there was a de-indent (E.g after a function or class)
-        # and adds the newline since it doesn't get passed from the frontend
-        if len(replace_data.code) == 2:
-            new_value = f"\n{FOUR_SPACES}"
-            repalcement_value = Replacement(**replace_data.code[1])
-            repalcement_value["value"] = new_value
-            replace_data.code[1] |= repalcement_value
+    def _apply(self, replacements: list[Replacement], author: UUID | None = None) -> list[Replacement]:
+        """Applies replacements to the code, in a single pass once compacted.
 
-        for replacement in replace_data.code:
-            from_index = replacement["from"]
-            to_index = replacement["to"]
-            new_value = replacement["value"]
+        Args:
+            replacements: The replacements to apply, in order.
+            author (optional): The id of the client who made the replacements.
+
+        Returns:
+            The compacted replacements, within the bounds of the code.
+        """
+        compacted = compact(replacements, len(self._document))
+        self.removed_operations += len(replacements) - len(compacted)
 
-            updated_code = current_code[:from_index] + new_value + current_code[to_index:]
-            self.code = updated_code
+        # The replacements are kept in the history as they were applied, with
+        # slice indices resolved, so that others can be transformed against
+        # them
+        applied: list[Replacement] = []
+        for replacement in compacted:
+            start, stop, _ = slice(replacement["from"], replacement["to"]).indices(len(self._document))
+            value = replacement["value"]
+            if stop < start:
+                # The characters between stop and start end up twice in the text
+                value += self._document[stop:start]
+                stop = start
+            if start == stop and not value:
+                continue
 
-    def set_code(self, updated_code: str) -> None:
+            self._document.replace(start, stop, value)
+            applied.append({"from": start, "to": stop, "value": value})
+
+        if applied:
+            self._token_index = None
+            self.version += 1
+            if author is not None:
+                self.last_active = time.monotonic()
+            self._record(self.version - 1, applied, author)
+        return applied
+
+    def _record(self, since: int, replacements: list[Replacement], author: UUID | None) -> None:
+        """Adds a change to the history, dropping the oldest ones if needed.
+
+        Args:
+            since: The version of the code before the change.
+            replacements: The replacements of the change.
+            author: The id of the client who made the change.
+        """
+        if len(self._history) == self._history.maxlen:
+            self._history_characters -= sum(len(r["value"]) for r in self._history[0][3])
+        self._history.append((since, self.version, author, replacements))
+        self._history_characters += sum(len(r["value"]) for r in replacements)
+
+        while self._history_characters > HISTORY_MAX_CHARACTERS and len(self._history) > 1:
+            *_, dropped = self._history.popleft()
+            self._history_characters -= sum(len(r["value"]) for r in dropped)
+
+    def squash_history(self, since: int, replacements: list[Replacement]) -> None:
+        """Merges the latest changes of the history into one.
+
+        The changes of a client are broadcast compacted together, and clients
+        transform their own changes against them as they receive them. The
+        history holds the same changes, so that the server transforms the
+        changes it receives in the same way. The versions between the merged
+        changes aren't known anymore.
+        Args:
+            since: The version of the code before the changes, all made by the
+                same client.
+            replacements: The replacements equivalent to the changes.
+        """
+        author = None
+        while self._history and self._history[-1][0] >= since:
+            _, _, author, dropped = self._history.pop()
+            self._history_characters -= sum(len(r["value"]) for r in dropped)
+        self._record(since, replacements, author)
+
+    def snapshot(self) -> RoomSnapshot:
+        """Takes a snapshot of the state of the room kept while hibernated.
+
+        Returns:
+            The snapshot of the room.
+        """
+        return RoomSnapshot(self.code, self.owner_id, self.difficulty, self.epoch, self.version)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: RoomSnapshot) -> "Room":
+        """Rehydrates a hibernated room, without any client.
+
+        The history of the code isn't kept, so clients joining again are
+        sent the whole code unless they already have its latest version.
+        Args:
+            snapshot: The snapshot of the room.
+
+        Returns:
+            The room.
+        """
+        room = cls(snapshot.owner_id, set(), snapshot.difficulty)
+        room.epoch = snapshot.epoch
+        room._document = Rope(snapshot.code)
+        room.version = snapshot.version
+        return room
+
+    def set_code(self, updated_code: str, author: UUID | None = None) -> list[Replacement]:
         """Sets the code.
 
         Args:
             updated_code: A string containing the new code.
+            author (optional): The id of the client who set the code.
+
+        Returns:
+            The replacements changing the previous code into the new one.
         """
-        self.code = updated_code
+        return self._apply(diff(self.code, updated_code), author)
 
-    def introduce_bugs(self) -> None:
-        """Introduces bugs based on the current code."""
-        if self.code.strip() == "":
-            return
+    def is_stale(self, client_id: UUID, version: int) -> bool:
+        """Checks if the changes of a client can't be applied as expected.
 
-        modifier = Modifiers(self.code, self.difficulty)
+        Changes made from an older version of the code are transformed against
+        the changes made by others since then, or applied as they are if the
+        client made every change since then. This isn't possible when the
+        version isn't in the history anymore, or when both the client and
+        others changed the code since then.
+        Args:
+            client_id: The id of the client.
+            version: The latest version of the code the client received.
+
+        Returns:
+            True if the client has to be sent the whole code again.
+        """
+        version = self._base_version(client_id, version)
+        if version == self.version:
+            return False
+        return self._concurrent_changes(client_id, version) is None
+
+    def synced(self, client_id: UUID) -> None:
+        """Records that a client is sent the whole code of the room.
+
+        Args:
+            client_id: The id of the client.
+        """
+        self.synced_versions[client_id] = self.version
+
+    def _base_version(self, client_id: UUID | None, version: int) -> int:
+        """Gets the version of the code the changes of a client are made on.
+
+        The changes a client sent before receiving the whole code are made
+        again on top of it, by the client, so they're made on its version.
+        Args:
+            client_id: The id of the client.
+            version: The latest version of the code the client received.
+
+        Returns:
+            The version of the code the changes are made on.
+        """
+        return max(version, self.synced_versions.get(client_id, version))
+
+    def _changes_after(self, version: int) -> list[tuple[UUID | None, list[Replacement]]] | None:
+        """Gets the changes made after a version, with their author.
+
+        Args:
+            version: A version of the code.
+
+        Returns:
+            The changes made after the version, or None if the version isn't
+            in the history anymore, or was merged with other ones.
+        """
+        if version == self.version:
+            return []
+        if version > self.version or not self._history or self._history[0][0] > version:
+            return None
+
+        changes = []
+        for since, change_version, author, replacements in self._history:
+            if change_version <= version:
+                continue
+            if since < version:
+                return None
+            changes.append((author, replacements))
+        return changes
+
+    def _concurrent_changes(self, client_id: UUID | None, version: int) -> list[Replacement] | None:
+        """Gets the changes made by others since a version.
+
+        Args:
+            client_id: The id of the client.
+            version: The latest version of the code the client received.
+
+        Returns:
+            The replacements of the changes made by others since the version,
+            or None if they can't be known or if the client also made some.
+        """
+        changes = self._changes_after(version)
+        if changes is None:
+            return None
+
+        own = False
+        concurrent = []
+        for author, replacements in changes:
+            if author == client_id:
+                own = True
+            else:
+                concurrent.extend(replacements)
+
+        if own and concurrent:
+            return None
+        return concurrent
+
+    def get_sync_state(self, exclude: Client | None = None) -> tuple[UserInfo, Time]:
+        """Get the current state of the room for syncing.
+
+        Args:
+            exclude (optional): A client not to include in the collaborators.
+
+        Returns:
+            The list of collaborators as well as the current time for syncing.
+        """
+        collaborators = [{"id": c.id.hex, "username": c.username} for c in self.clients if c != exclude]
+
+        deltaseconds = (datetime.now() - self.epoch).total_seconds()
+        minutes, remainder = divmod(deltaseconds, 60)
+        seconds, milliseconds = divmod(remainder, 1)
+        time = Time(min=minutes, sec=seconds, mil=milliseconds)
+
+        return collaborators, time
+
+    def changes_since(self, version: int) -> list[Replacement] | None:
+        """Gets the changes made to the code since a version.
+
+        Args:
+            version: The latest version of the code a client received.
+
+        Returns:
+            The replacements changing that version into the current one, or
+            None if the version isn't in the history anymore or if sending the
+            whole code would be cheaper.
+        """
+        changes_after = self._changes_after(version)
+        if changes_after is None:
+            return None
+
+        changes = [replacement for _, replacements in changes_after for replacement in replacements]
+        if sum(len(r["value"]) for r in changes) > self.code_length:
+            return None
+        return changes
+
+    def introduce_bugs(self, replacements: list[Replacement] | None = None) -> list[Replacement]:
+        """Introduces bugs based on the current code.
+
+        Args:
+            replacements (optional): The replacements introducing the bugs, if
+                already computed from the current code.
+
+        Returns:
+            The replacements applied to the code.
+        """
+        if replacements is not None:
+            return self._apply(replacements)
+
+        if self.code.strip() == "":
+            return []
 
-        for code_change in modifier.output.code:
-            self.update_code(ReplaceData(code=[code_change]))
+        modifier = Modifiers(self.code, self.difficulty, self.token_index, self.rng)
+        return self._apply(modifier.output.code)
@@ -0,0 +1,222 @@
+import random
+from typing import Iterator
+
+CHUNK_SIZE = 512
+
+
+class _Node:
+    """A node of the rope, holding a chunk of text."""
+
+    __slots__ = ("text", "priority", "left", "right", "length")
+
+    def __init__(self, text: str, priority: float | None = None) -> None:
+        self.text = text
+        self.priority = random.random() if priority is None else priority
+        self.left: _Node | None = None
+        self.right: _Node | None = None
+        self.length = len(text)
+
+
+def _length(node: _Node | None) -> int:
+    """Returns the number of characters under a node."""
+    return node.length if node is not None else 0
+
+
+def _update(node: _Node) -> None:
+    """Updates the number of characters under a node after a change."""
+    node.length = len(node.text) + _length(node.left) + _length(node.right)
+
+
+def _split(node: _Node | None, index: int) -> tuple[_Node | None, _Node | None]:
+    """Splits a tree in two, the left one holding `index` characters."""
+    if node is None:
+        return None, None
+
+    left_length = _length(node.left)
+    if index <= left_length:
+        left, node.left = _split(node.left, index)
+        _update(node)
+        return left, node
+
+    text_end = left_length + len(node.text)
+    if index >= text_end:
+        node.right, right = _split(node.right, index - text_end)
+        _update(node)
+        return node, right
+
+    # The index falls inside the chunk of this node, so the chunk is cut in two.
+    # Both halves keep the priority of the node to preserve the heap order.
+    offset = index - left_length
+    right = _Node(node.text[offset:], node.priority)
+    right.right = node.right
+    node.text = node.text[:offset]
+    node.right = None
+    _update(right)
+    _update(node)
+    return node, right
+
+
+def _merge(left: _Node | None, right: _Node | None) -> _Node | None:
+    """Concatenates two trees."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _edit_chunk(node: _Node | None, start: int, stop: int, value: str) -> bool:
+    """Replaces a range of a tree in place, if it lies within a single chunk."""
+    path = []
+    while node is not None:
+        left_length = _length(node.left)
+        text_end = left_length + len(node.text)
+        if stop <= left_length:
+            path.append(node)
+            node = node.left
+        elif start >= text_end and node.right is not None:
+            path.append(node)
+            node = node.right
+            start -= text_end
+            stop -= text_end
+        elif left_length <= start and stop <= text_end:
+            offset = start - left_length
+            if len(node.text) - (stop - start) + len(value) > CHUNK_SIZE * 2:
+                return False
+
+            end = offset + stop - start
+            node.text = node.text[:offset] + value + node.text[end:]
+            delta = len(value) - (stop - start)
+            node.length += delta
+            for parent in path:
+                parent.length += delta
+            return True
+        else:
+            return False
+    return False
+
+
+def _append(node: _Node, value: str) -> bool:
+    """Appends text to the last chunk of a tree, if it's small enough."""
+    if node.right is not None:
+        appended = _append(node.right, value)
+    elif len(node.text) + len(value) <= CHUNK_SIZE:
+        node.text += value
+        appended = True
+    else:
+        appended = False
+
+    if appended:
+        node.length += len(value)
+    return appended
+
+
+def _build(text: str) -> _Node | None:
+    """Builds a tree from some text, cut in chunks."""
+    root = None
+    for start in range(0, len(text), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        root = _merge(root, _Node(text[start:end]))
+    return root
+
+
+def _chunks(node: _Node | None) -> Iterator[str]:
+    """Yields the chunks of a tree in order."""
+    stack: list[_Node] = []
+    while stack or node is not None:
+        while node is not None:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node.text
+        node = node.right
+
+
+class Rope:
+    """A text document supporting edits in logarithmic time.
+
+    The text is stored in chunks, in a binary tree balanced by random
+    priorities (a treap). The full string is only built when it's requested,
+    and is then cached until the next edit.
+    """
+
+    def __init__(self, text: str = "") -> None:
+        """Initializes the tree from the initial text.
+
+        Args:
+            text: The initial text of the document.
+        """
+        self._root = _build(text)
+        self._text: str | None = text
+
+    def replace(self, start: int, stop: int, value: str) -> None:
+        """Replaces a range of the document.
+
+        This is equivalent to `text[:start] + value + text[stop:]`.
+
+        Indices are handled like slice indices, so negative indices count from
+        the end and indices outside of the document are clamped.
+        Args:
+            start: The index of the first replaced character.
+            stop: The index after the last replaced character.
+            value: The text inserted in place of the range.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if stop < start:
+            # The characters between stop and start end up twice in the text
+            value += self[stop:start]
+            stop = start
+        if start == stop and not value:
+            return
+
+        # Most edits are made while typing, and stay within a single chunk
+        if _edit_chunk(self._root, start, stop, value):
+            self._text = None
+            return
+
+        left, right = _split(self._root, start)
+        if stop > start:
+            _, right = _split(right, stop - start)
+
+        if value and (left is None or not _append(left, value)):
+            left = _merge(left, _build(value))
+        self._root = _merge(left, right)
+        self._text = None
+
+    def __getitem__(self, key: slice) -> str:
+        """Returns a range of the document.
+
+        Args:
+            key: The slice of the document to return, without step.
+        """
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("a rope can only be sliced with a step of 1")
+        if self._text is not None or stop - start > len(self) // 2:
+            return str(self)[start:stop]
+        if stop <= start:
+            return ""
+
+        left, rest = _split(self._root, start)
+        middle, right = _split(rest, stop - start)
+        text = "".join(_chunks(middle))
+        self._root = _merge(left, _merge(middle, right))
+        return text
+
+    def __len__(self) -> int:
+        """Returns the number of characters in the document."""
+        return _length(self._root)
+
+    def __str__(self) -> str:
+        """Returns the whole document."""
+        if self._text is None:
+            self._text = "".join(_chunks(self._root))
+        return self._text
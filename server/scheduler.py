@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable
+
+# The time in seconds between the bugs introduced in a room, by difficulty
+BUG_INTERVALS = {1: 60.0, 2: 45.0, 3: 30.0}
+
+TICK = 1.0
+WHEEL_SIZE = 64
+JITTER = 0.1
+
+log = logging.getLogger(__name__)
+
+
+class BugScheduler:
+    """Introduces bugs in every room at the frequency of its difficulty.
+
+    The rooms are kept in a timer wheel: a ring of slots, one per tick, each
+    holding the rooms due when the wheel reaches it, with the number of turns
+    left before they are. A single task advances the wheel once per tick, so
+    the cost of scheduling doesn't depend on the number of rooms.
+
+    Each interval is randomly lengthened or shortened by up to `jitter` of
+    its value, so rooms created together don't all get bugs on the same tick.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[str], Awaitable[None]],
+        intervals: dict[int, float] = BUG_INTERVALS,
+        tick: float = TICK,
+        wheel_size: int = WHEEL_SIZE,
+        jitter: float = JITTER,
+    ) -> None:
+        """Initializes an empty wheel.
+
+        Args:
+            callback: The coroutine function introducing bugs in a room, called
+                with the code of the room.
+            intervals: The time in seconds between the bugs introduced in a
+                room, by difficulty.
+            tick: The time in seconds between two slots of the wheel.
+            wheel_size: The number of slots of the wheel.
+            jitter: The maximum change of an interval, as a fraction of it.
+        """
+        self.callback = callback
+        self.intervals = intervals
+        self.tick = tick
+        self.jitter = jitter
+
+        self._slots: list[dict[str, int]] = [{} for _ in range(wheel_size)]
+        self._positions: dict[str, int] = {}
+        self._intervals: dict[str, float] = {}
+        self._cursor = 0
+        self._task: asyncio.Task | None = None
+
+    def add(self, room_code: str, difficulty: int) -> None:
+        """Schedules the bugs of a room, the first ones after an interval.
+
+        Args:
+            room_code: The code of the room.
+            difficulty: The difficulty of the room.
+        """
+        self.remove(room_code)
+        self._intervals[room_code] = self.intervals.get(difficulty, max(self.intervals.values()))
+        self._schedule(room_code)
+
+    def remove(self, room_code: str) -> None:
+        """Stops introducing bugs in a room.
+
+        Args:
+            room_code: The code of the room.
+        """
+        slot = self._positions.pop(room_code, None)
+        if slot is not None:
+            del self._slots[slot][room_code]
+        self._intervals.pop(room_code, None)
+
+    def start(self) -> None:
+        """Starts advancing the wheel, in the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops advancing the wheel."""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def __len__(self) -> int:
+        """Returns the number of scheduled rooms."""
+        return len(self._positions)
+
+    def _schedule(self, room_code: str) -> None:
+        """Puts a room in the slot of the wheel where its next bugs are due.
+
+        Args:
+            room_code: The code of the room.
+        """
+        interval = self._intervals[room_code]
+        delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+        ticks = max(1, round(delay / self.tick))
+
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][room_code] = (ticks - 1) // len(self._slots)
+        self._positions[room_code] = slot
+
+    async def _run(self) -> None:
+        """Advances the wheel once per tick, without drifting."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            await self.advance()
+
+    async def advance(self) -> None:
+        """Moves the wheel to the next slot and introduces the bugs due."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+
+        due = []
+        for room_code, turns in slot.items():
+            if turns:
+                slot[room_code] = turns - 1
+            else:
+                due.append(room_code)
+
+        for room_code in due:
+            del slot[room_code]
+            self._schedule(room_code)
+
+        for room_code in due:
+            try:
+                await self.callback(room_code)
+            except Exception:
+                log.exception("Failed to introduce bugs in room %s", room_code)
@@ -0,0 +1,131 @@
+import os
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, NamedTuple
+from uuid import UUID
+
+from server.encoding import dumps, loads
+
+# The time in seconds after which the snapshot of a room nobody joined again
+# is deleted
+SNAPSHOT_TTL = 7 * 24 * 3600.0
+
+SUFFIX = ".snapshot"
+
+
+class RoomSnapshot(NamedTuple):
+    """The state of a hibernated room."""
+
+    code: str
+    owner_id: UUID
+    difficulty: int
+    epoch: datetime
+    version: int
+
+    def to_dict(self) -> dict[str, Any]:
+        """Converts the snapshot to a JSON serializable dict."""
+        return {
+            "code": self.code,
+            "owner_id": self.owner_id.hex,
+            "difficulty": self.difficulty,
+            "epoch": self.epoch.isoformat(),
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "RoomSnapshot":
+        """Converts a dict made by `to_dict` back to a snapshot."""
+        return cls(
+            data["code"],
+            UUID(data["owner_id"]),
+            data["difficulty"],
+            datetime.fromisoformat(data["epoch"]),
+            data["version"],
+        )
+
+
+class SnapshotStore:
+    """The snapshots of the hibernated rooms, one compressed file per room.
+
+    A snapshot is removed when its room is rehydrated, so a room is either in
+    memory or on disk.
+    """
+
+    def __init__(self, directory: str | Path, ttl: float = SNAPSHOT_TTL) -> None:
+        """Initializes the store, creating its directory if needed.
+
+        Args:
+            directory: The directory of the snapshots.
+            ttl: The time in seconds after which a snapshot is deleted.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+
+    def _path(self, room_code: str) -> Path:
+        """Returns the path of the snapshot of a room.
+
+        Room codes are chosen by the users, so they're hex encoded to be safe
+        file names.
+        """
+        return self.directory / f"{room_code.encode().hex()}{SUFFIX}"
+
+    def save(self, room_code: str, snapshot: RoomSnapshot) -> None:
+        """Saves the snapshot of a room, replacing the previous one.
+
+        The snapshot is written to a temporary file first, so a crash never
+        leaves a partial snapshot.
+        Args:
+            room_code: The code of the room.
+            snapshot: The state of the room.
+        """
+        path = self._path(room_code)
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(zlib.compress(dumps(snapshot.to_dict()).encode()))
+        os.replace(temporary, path)
+
+    def load(self, room_code: str) -> RoomSnapshot | None:
+        """Loads the snapshot of a room, and removes it from the store.
+
+        Args:
+            room_code: The code of the room.
+
+        Returns:
+            The state of the room, or None if it wasn't hibernated.
+        """
+        path = self._path(room_code)
+        try:
+            compressed = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        path.unlink(missing_ok=True)
+
+        return RoomSnapshot.from_dict(loads(zlib.decompress(compressed)))
+
+    def __contains__(self, room_code: object) -> bool:
+        """Checks if a room is hibernated."""
+        return isinstance(room_code, str) and self._path(room_code).exists()
+
+    def __len__(self) -> int:
+        """Returns the number of hibernated rooms."""
+        return sum(1 for _ in self.directory.glob(f"*{SUFFIX}"))
+
+    def prune(self) -> int:
+        """Deletes the snapshots older than the time to live of the store.
+
+        Returns:
+            The number of deleted snapshots.
+        """
+        deadline = time.time() - self.ttl
+        pruned = 0
+        for path in self.directory.glob(f"*{SUFFIX}"):
+            try:
+                if path.stat().st_mtime < deadline:
+                    path.unlink()
+                    pruned += 1
+            except FileNotFoundError:
+                # Rehydrated meanwhile
+                continue
+        return pruned
@@ -1,13 +1,207 @@
-import requests
+import asyncio
+from functools import partial
+from hashlib import sha256
+from typing import Any, Coroutine
+
+import httpx
+
+from server.cache import LRUCache
+from server.errors import (
+    EvaluationBusyError,
+    EvaluationFailedError,
+    EvaluationTimeoutError,
+)
 
 EVAL_URL = "http://snekbox:8060/eval"
+MAX_CONCURRENCY = 4
+MAX_QUEUE_SIZE = 16
+EVAL_TIMEOUT = 15.0
+CACHE_SIZE = 512
+CACHE_TTL = 300.0
+
+
+class SnekboxPool:
+    """A pool of evaluations sent to the snekbox API."""
+
+    def __init__(
+        self,
+        url: str = EVAL_URL,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_queue_size: int = MAX_QUEUE_SIZE,
+        timeout: float = EVAL_TIMEOUT,
+        transport: httpx.AsyncBaseTransport | None = None,
+        cache: LRUCache[str] | None = None,
+    ) -> None:
+        """Initializes the HTTP connection pool and the concurrency limits.
+
+        At most `max_concurrency` evaluations are sent to snekbox at the same
+        time, the others wait in a queue of at most `max_queue_size`
+        evaluations. When the queue is full, new evaluations are refused.
+
+        Results are cached by the hash of the evaluated code, and identical
+        evaluations requested at the same time share a single snekbox call.
+        Args:
+            url: The URL of the snekbox evaluation endpoint.
+            max_concurrency: The number of evaluations running at once.
+            max_queue_size: The number of evaluations waiting for a slot.
+            timeout: The time in seconds after which an evaluation is aborted.
+            transport (optional): The HTTP transport, mostly used for testing.
+            cache (optional): The cache of the evaluation results.
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=timeout,
+            transport=transport,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0
+        self._tasks: dict[str, set[asyncio.Task]] = {}
+
+        self.cache: LRUCache[str] = cache if cache is not None else LRUCache(CACHE_SIZE, CACHE_TTL)
+        self.coalesced = 0
+        self._in_flight: dict[str, asyncio.Task[str]] = {}
+        self._waiters: dict[str, int] = {}
+
+    @property
+    def pending(self) -> int:
+        """The number of evaluations either running or waiting in the queue."""
+        return self._pending
+
+    async def evaluate(self, code: str) -> str:
+        """Evaluate code thanks to the snekbox API.
+
+        If the same code was evaluated recently, the cached result is returned.
+        If it's being evaluated for another room, that evaluation is awaited.
+        Args:
+            code: The code to evaluate.
+        Returns:
+            The standard output of the evaluation.
+        Raises:
+            EvaluationBusyError: If the queue of evaluations is full.
+            EvaluationTimeoutError: If the evaluation took too long.
+            EvaluationFailedError: If snekbox couldn't be reached, or didn't
+                return a result.
+        """
+        key = sha256(code.encode()).hexdigest()
+
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._request(key, code))
+            task.add_done_callback(partial(self._finish_request, key))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+
+        # Cancelling one of the rooms waiting for the result must not cancel
+        # the evaluation shared with the other rooms, unless it was the last one
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    async def _request(self, key: str, code: str) -> str:
+        """Sends the code to snekbox and caches the result.
+
+        Args:
+            key: The hash of the code.
+            code: The code to evaluate.
+        Returns:
+            The standard output of the evaluation.
+        Raises:
+            EvaluationBusyError: If the queue of evaluations is full.
+            EvaluationTimeoutError: If the evaluation took too long.
+            EvaluationFailedError: If snekbox couldn't be reached, or didn't
+                return a result.
+        """
+        if self._pending >= self.max_concurrency + self.max_queue_size:
+            raise EvaluationBusyError("The evaluation server is busy, please try again later.")
+
+        self._pending += 1
+        try:
+            async with self._semaphore:
+                response = await asyncio.wait_for(self._client.post(self.url, json={"input": code}), self.timeout)
+            response.raise_for_status()
+            result = response.json()["stdout"]
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            raise EvaluationTimeoutError("The evaluation timed out.") from None
+        except (httpx.HTTPError, ValueError, KeyError, TypeError):
+            # Snekbox is down, or answered with an error or something else
+            # than a result
+            raise EvaluationFailedError("The evaluation server is unavailable, please try again later.") from None
+        finally:
+            self._pending -= 1
+
+        self.cache.set(key, result)
+        return result
+
+    def _finish_request(self, key: str, task: asyncio.Task[str]) -> None:
+        """Forgets an evaluation once it's done.
+
+        Args:
+            key: The hash of the evaluated code.
+            task: The task of the finished evaluation.
+        """
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+        # Retrieve the exception so it isn't reported when no room awaited it
+        if not task.cancelled():
+            task.exception()
+
+    def schedule(self, room_code: str, coro: Coroutine[Any, Any, None]) -> asyncio.Task:
+        """Runs a coroutine depending on an evaluation in the background.
+
+        The task is tracked by room, so that it can be cancelled if the room
+        becomes empty before the evaluation is done.
+        Args:
+            room_code: The room that requested the evaluation.
+            coro: The coroutine evaluating the code and sending the result.
+        Returns:
+            The task running the coroutine.
+        """
+        task = asyncio.create_task(coro)
+        tasks = self._tasks.setdefault(room_code, set())
+        tasks.add(task)
+
+        def discard(done: asyncio.Task) -> None:
+            tasks.discard(done)
+            if not tasks and self._tasks.get(room_code) is tasks:
+                del self._tasks[room_code]
+
+        task.add_done_callback(discard)
+        return task
 
+    def cancel(self, room_code: str) -> None:
+        """Cancels every evaluation running for a room.
 
-def evaluate(code: str) -> str:
-    """Evaluate code thanks to the snekbox API.
+        Args:
+            room_code: The room whose evaluations will be cancelled.
+        """
+        for task in self._tasks.pop(room_code, set()):
+            task.cancel()
 
-    Args:
-        code: The code to evaluate.
-    """
-    response = requests.post(EVAL_URL, json={"input": code})
-    return response.json()["stdout"]
+    async def aclose(self) -> None:
+        """Cancels the running evaluations and closes the HTTP connections."""
+        for room_code in list(self._tasks):
+            self.cancel(room_code)
+        in_flight = list(self._in_flight.values())
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        await self._client.aclose()
@@ -0,0 +1,287 @@
+import keyword
+import re
+from functools import cached_property
+from typing import NamedTuple
+
+BOOLEANS = ["True", "False"]
+BRACKETS = "()[]"
+TYPES = ["bool", "int", "float", "bin", "str", "list", "tuple"]
+
+FOUR_SPACES = "    "
+
+KEYWORDS = frozenset(keyword.kwlist)
+INDEXED_NAMES = KEYWORDS | frozenset(TYPES)
+
+# The tokens the modifiers look for, following the grammar of the tokenize
+# module. Strings, comments and numbers are matched so that the names they
+# contain are skipped, other tokens are not matched at all. Strings opened
+# with triple quotes and closed on a later line are matched by `open_string`.
+TOKEN_REGEX = re.compile(
+    r"""
+    (?P<string>[bBrRuUfF]{0,2}(?:
+        '''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''
+        |\"\"\"[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*\"\"\"
+    ))
+    |(?P<open_string>[bBrRuUfF]{0,2}(?:'''|\"\"\"))
+    |(?P<short_string>[bBrRuUfF]{0,2}(?:
+        '[^'\\\n]*(?:\\.[^'\\\n]*)*'
+        |"[^"\\\n]*(?:\\.[^"\\\n]*)*"
+    ))
+    |(?P<comment>\#[^\n]*)
+    |(?P<number>\d\w*)
+    |(?P<name>[^\W\d]\w*)
+    |(?P<op>==|[()\[\]])
+    """,
+    re.VERBOSE,
+)
+
+# The end of a string opened with triple quotes on a previous line
+STRING_END_REGEXES = {
+    "'''": re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"),
+    '"""': re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""'),
+}
+
+
+def split_lines(code: str) -> list[str]:
+    """Splits some code in lines, each ending with a newline.
+
+    The text after the last newline is not included.
+    Args:
+        code: The code to split.
+
+    Returns:
+        The lines of the code.
+    """
+    return [f"{line}\n" for line in code.split("\n")][:-1]
+
+
+class LineTokens(NamedTuple):
+    """The tokens of a line the modifiers look for.
+
+    The names are only listed once, and the column of their first occurrence
+    is kept in `columns`. The equality operators and the brackets are listed
+    with their column, and so are the names called, directly followed by an
+    opening parenthesis, other than the one of a definition.
+    """
+
+    keywords: tuple[str, ...]
+    booleans: tuple[str, ...]
+    types: tuple[str, ...]
+    equals: tuple[int, ...]
+    brackets: tuple[tuple[int, str], ...]
+    definition: str | None
+    columns: tuple[tuple[str, int], ...]
+    calls: tuple[tuple[int, str], ...]
+
+
+def scan_line(line: str, open_string: str | None = None) -> tuple[LineTokens, str | None]:
+    """Finds the names, brackets and equality operators of a line of code.
+
+    Unlike the tokenize module, this never fails on broken code, which the
+    modifiers often work on, and is much faster.
+    Args:
+        line: The line to scan.
+        open_string (optional): The quotes of the string left open by the
+            previous lines, if any.
+
+    Returns:
+        The tokens of the line, and the quotes of the string it leaves open.
+    """
+    names: dict[str, int] = {}
+    equals: list[int] = []
+    brackets: list[tuple[int, str]] = []
+    calls: list[tuple[int, str]] = []
+    definition = None
+
+    position = 0
+    after_def = False
+    while True:
+        if open_string is not None:
+            end = STRING_END_REGEXES[open_string].match(line, position)
+            if end is None:
+                break
+            position = end.end()
+            open_string = None
+
+        for match in TOKEN_REGEX.finditer(line, position):
+            kind = match.lastgroup
+            text = match.group()
+            if kind == "name":
+                if after_def and definition is None:
+                    definition = text
+                elif line.startswith("(", match.end()):
+                    calls.append((match.start(), text))
+                after_def = text == "def"
+
+                if text in INDEXED_NAMES and text not in names:
+                    names[text] = match.start()
+            elif kind == "op":
+                after_def = False
+                if text == "==":
+                    equals.append(match.start())
+                else:
+                    brackets.append((match.start(), text))
+            elif kind == "open_string":
+                open_string = text[-3:]
+                position = match.end()
+                break
+        else:
+            break
+
+    line_tokens = LineTokens(
+        tuple(name for name in names if name in KEYWORDS),
+        tuple(name for name in names if name in BOOLEANS),
+        tuple(name for name in names if name in TYPES),
+        tuple(equals),
+        tuple(brackets),
+        definition,
+        tuple(names.items()),
+        tuple(calls),
+    )
+    return line_tokens, open_string
+
+
+class TokenIndex:
+    """An index of the tokens the modifiers look for, by line.
+
+    Every list holds line numbers, or pairs of a line number and a token, in
+    the order they appear in the code. A token is only listed once per line.
+    The lists are only built when first used, since each modifier only uses
+    one of them.
+    """
+
+    def __init__(self, lines: list[str], tokens: list[LineTokens] | None = None) -> None:
+        """Scans the tokens of every line, in a single pass.
+
+        Args:
+            lines: The lines of code, each ending with a newline.
+            tokens (optional): The tokens of every line, if already scanned.
+        """
+        if tokens is None:
+            tokens = []
+            open_string = None
+            for line in lines:
+                line_tokens, open_string = scan_line(line, open_string)
+                tokens.append(line_tokens)
+
+        self.lines = lines
+        self.tokens = tokens
+
+    @cached_property
+    def indented_lines(self) -> list[int]:
+        """The lines starting with an indentation of four spaces."""
+        return [num for num, line in enumerate(self.lines) if line.startswith(FOUR_SPACES)]
+
+    @cached_property
+    def colon_lines(self) -> list[int]:
+        """The lines ending with a colon."""
+        return [num for num, line in enumerate(self.lines) if line.endswith(":\n")]
+
+    @cached_property
+    def non_empty_lines(self) -> list[int]:
+        """The lines that aren't empty."""
+        return [num for num, line in enumerate(self.lines) if line != "\n"]
+
+    @cached_property
+    def keywords(self) -> list[tuple[int, str]]:
+        """The keywords of every line."""
+        return [(num, name) for num, tokens in enumerate(self.tokens) for name in tokens.keywords]
+
+    @cached_property
+    def booleans(self) -> list[tuple[int, str]]:
+        """The booleans of every line."""
+        return [(num, name) for num, tokens in enumerate(self.tokens) for name in tokens.booleans]
+
+    @cached_property
+    def types(self) -> list[tuple[int, str]]:
+        """The built-in type names of every line."""
+        return [(num, name) for num, tokens in enumerate(self.tokens) for name in tokens.types]
+
+    def column(self, num: int, name: str) -> int:
+        """Finds the column of a name of a line.
+
+        Args:
+            num: The number of the line.
+            name: A keyword, boolean or type listed for the line.
+
+        Returns:
+            The column of the first occurrence of the name in the line.
+        """
+        return dict(self.tokens[num].columns)[name]
+
+    @cached_property
+    def equals_lines(self) -> list[int]:
+        """The lines with an equality operator."""
+        return [num for num, tokens in enumerate(self.tokens) if tokens.equals]
+
+    @cached_property
+    def brackets(self) -> dict[int, list[tuple[int, str]]]:
+        """The columns of the brackets, by line, for the lines having some."""
+        return {num: list(tokens.brackets) for num, tokens in enumerate(self.tokens) if tokens.brackets}
+
+    @cached_property
+    def defs(self) -> list[tuple[int, str]]:
+        """The names of the functions defined on every line."""
+        return [(num, tokens.definition) for num, tokens in enumerate(self.tokens) if tokens.definition is not None]
+
+    @cached_property
+    def calls(self) -> dict[str, list[tuple[int, int]]]:
+        """The lines and columns of the calls of every name called.
+
+        Calls inside strings and comments aren't listed, and neither are the
+        names of the definitions.
+        """
+        calls: dict[str, list[tuple[int, int]]] = {}
+        for num, tokens in enumerate(self.tokens):
+            for column, name in tokens.calls:
+                calls.setdefault(name, []).append((num, column))
+        return calls
+
+
+class TokenCache:
+    """The tokens of the lines of a document, kept across its versions.
+
+    Lines are only scanned when their content, or the string left open
+    before them, wasn't in the previous version of the document. Lines that
+    aren't in the document anymore are dropped, so the cache never holds
+    more entries than the document has lines.
+    """
+
+    def __init__(self) -> None:
+        """Initializes the entries and the statistics of the cache."""
+        self._entries: dict[tuple[str | None, str], tuple[LineTokens, str | None]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def index(self, lines: list[str]) -> TokenIndex:
+        """Builds the index of a version of the document.
+
+        Args:
+            lines: The lines of the document, each ending with a newline.
+
+        Returns:
+            The index of the lines.
+        """
+        entries = {}
+        tokens = []
+        open_string = None
+        misses = 0
+        for line in lines:
+            key = (open_string, line)
+            entry = self._entries.get(key)
+            if entry is None:
+                misses += 1
+                entry = scan_line(line, open_string)
+            entries[key] = entry
+
+            line_tokens, open_string = entry
+            tokens.append(line_tokens)
+
+        self._entries = entries
+        self.hits += len(lines) - misses
+        self.misses += misses
+        return TokenIndex(lines, tokens)
+
+    def __len__(self) -> int:
+        """Returns the number of lines in the cache."""
+        return len(self._entries)
@@ -0,0 +1,282 @@
+import asyncio
+from typing import Any, cast
+from uuid import uuid4
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from server.backplane import Backplane
+from server.client import Client
+from server.codes import StatusCode
+from server.connection_manager import ConnectionManager
+from server.encoding import encode_event
+from server.event_handler import EventHandler
+from server.events import ConnectData, ErrorData, EventRequest, EventResponse, EventType
+from server.snekbox import SnekboxPool
+
+
+class RelayedWebSocket:
+    """The WebSocket of a client connected to another worker.
+
+    The owner of the room of the client handles it like any other client,
+    through this WebSocket, whose messages are relayed by the backplane.
+    """
+
+    def __init__(self, backplane: Backplane, worker_id: str, key: str) -> None:
+        """Initializes the WebSocket.
+
+        Args:
+            backplane: The backplane of the owner of the room.
+            worker_id: The id of the worker the client is connected to.
+            key: The key of the client on that worker.
+        """
+        self.backplane = backplane
+        self.worker_id = worker_id
+        self.key = key
+        self._received: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def accept(self) -> None:
+        """Accepts the connection, which the other worker already did."""
+
+    async def send_text(self, text: str) -> None:
+        """Sends a message to the client, through the other worker.
+
+        Args:
+            text: The encoded message.
+        """
+        await self.backplane.send(self.worker_id, {"type": "send", "client": self.key, "text": text})
+
+    async def receive_text(self) -> str:
+        """Receives a message of the client, relayed by the other worker.
+
+        Returns:
+            The message.
+
+        Raises:
+            WebSocketDisconnect: If the client disconnected.
+        """
+        text = await self._received.get()
+        if text is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def close(self) -> None:
+        """Closes the connection of the client on the other worker."""
+        await self.backplane.send(self.worker_id, {"type": "close", "client": self.key})
+
+    def feed(self, text: str | None) -> None:
+        """Adds a message relayed by the other worker.
+
+        Args:
+            text: The message, or None if the client disconnected.
+        """
+        self._received.put_nowait(text)
+
+
+class Worker:
+    """A worker serving the rooms it owns, and relaying the other ones.
+
+    The first worker a room is connected to becomes its owner, and keeps its
+    state for as long as it exists. The clients of the room connected to
+    other workers are relayed to the owner, which handles them like its own
+    clients. When a worker is gone, the clients relayed to it are closed, to
+    join their room again through another worker, and the clients it relayed
+    leave their room.
+    """
+
+    def __init__(self, manager: ConnectionManager, evaluator: SnekboxPool, backplane: Backplane) -> None:
+        """Initializes the worker.
+
+        Args:
+            manager: The ConnectionManager of the rooms owned by the worker.
+            evaluator: The pool evaluating the code of the rooms.
+            backplane: The connection to the other workers.
+        """
+        self.manager = manager
+        self.evaluator = evaluator
+        self.backplane = backplane
+
+        # The clients relayed to this worker, and the clients this worker
+        # relays to others with the owner of their room, by key
+        self._relayed: dict[str, RelayedWebSocket] = {}
+        self._relaying: dict[str, Client] = {}
+        self._owners: dict[str, str] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """Connects the worker to the other workers.
+
+        The rooms the manager already has, recovered after a restart, are
+        claimed. A room another worker claimed first is deleted, as its
+        clients are sent there.
+        """
+        await self.backplane.start(self._handle_message)
+        for room_code, _ in self.manager.rooms:
+            if await self.backplane.claim(room_code) != self.backplane.worker_id:
+                self.manager.remove_room(room_code)
+
+    async def stop(self) -> None:
+        """Disconnects the worker, and stops handling relayed clients."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backplane.stop()
+
+    async def serve(self, websocket: WebSocket) -> None:
+        """Handles the connection of a client, until it disconnects.
+
+        Args:
+            websocket: The WebSocket of the client.
+        """
+        client = Client(websocket)
+        await client.accept()
+
+        try:
+            text = await websocket.receive_text()
+            initial_event = await client.decode(text)
+
+            owner = self.backplane.worker_id
+            if initial_event.type == EventType.CONNECT:
+                try:
+                    owner = await self.backplane.claim(cast(ConnectData, initial_event.data).room_code)
+                except asyncio.TimeoutError:
+                    # The claim was lost while the backplane reconnected
+                    response = EventResponse(
+                        type=EventType.ERROR,
+                        data=ErrorData(message="The room is unavailable, please try again later."),
+                        status_code=StatusCode.ROOM_UNAVAILABLE,
+                    )
+                    await websocket.send_text(encode_event(response))
+                    await websocket.close()
+                    return
+
+            if owner == self.backplane.worker_id:
+                await self._run(client, initial_event)
+            else:
+                await self._relay(client, websocket, owner, text)
+        except WebSocketDisconnect:
+            return
+        finally:
+            client.stop()
+
+    async def _run(self, client: Client, initial_event: EventRequest) -> None:
+        """Handles the events of a client of a room owned by the worker.
+
+        Args:
+            client: The client.
+            initial_event: The initial event sent by the client.
+        """
+        handler = EventHandler(client, self.manager, self.evaluator)
+        try:
+            await handler.handle_initial_connection(initial_event)
+            while True:
+                event = await client.receive()
+                closed = await handler(event)
+                if closed:
+                    break
+        finally:
+            await handler.handle_lost_connection()
+            # The room is owned until it's deleted or hibernated, with its
+            # last client, and not at all if the client failed to connect
+            room_code = getattr(handler, "room_code", None)
+            if room_code is None and initial_event.type == EventType.CONNECT:
+                room_code = cast(ConnectData, initial_event.data).room_code
+            if room_code is not None and room_code not in self.manager.rooms:
+                await self.backplane.release(room_code)
+
+    async def _relay(self, client: Client, websocket: WebSocket, owner: str, text: str) -> None:
+        """Relays the messages of a client to the owner of its room.
+
+        Args:
+            client: The client.
+            websocket: The WebSocket of the client.
+            owner: The id of the worker owning the room.
+            text: The initial message sent by the client.
+        """
+        key = uuid4().hex
+        self._relaying[key] = client
+        self._owners[key] = owner
+        try:
+            worker_id = self.backplane.worker_id
+            await self.backplane.send(owner, {"type": "connect", "client": key, "worker": worker_id, "text": text})
+            # The connection is closed by the owner when the room is left
+            while key in self._relaying:
+                text = await websocket.receive_text()
+                await self.backplane.send(owner, {"type": "receive", "client": key, "text": text})
+        finally:
+            self._relaying.pop(key, None)
+            self._owners.pop(key, None)
+            await self.backplane.send(owner, {"type": "disconnect", "client": key})
+
+    async def _handle_message(self, message: dict[str, Any]) -> None:
+        """Handles a message of another worker.
+
+        Args:
+            message: The message.
+        """
+        match message["type"]:
+            case "connect":
+                key = message["client"]
+                websocket = self._relayed[key] = RelayedWebSocket(self.backplane, message["worker"], key)
+                task = asyncio.create_task(self._run_relayed(websocket, message["text"]))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            case "receive" | "disconnect":
+                relayed = self._relayed.get(message["client"])
+                if relayed is not None:
+                    relayed.feed(message.get("text"))
+            case "send":
+                client = self._relaying.get(message["client"])
+                # A client lagging too far behind is disconnected, and gets the
+                # changes it missed when it joins again
+                if client is not None and not client.enqueue(message["text"]):
+                    self._close(message["client"])
+            case "close":
+                self._close(message["client"])
+            case "released":
+                self._release(message["worker"])
+
+    async def _run_relayed(self, websocket: RelayedWebSocket, text: str) -> None:
+        """Handles the events of a client relayed by another worker.
+
+        Args:
+            websocket: The WebSocket relaying the client.
+            text: The initial message sent by the client.
+        """
+        client = Client(websocket)  # type: ignore[arg-type]
+        await client.accept()
+        try:
+            await self._run(client, await client.decode(text))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            client.stop()
+            del self._relayed[websocket.key]
+            await websocket.close()
+
+    def _release(self, worker_id: str) -> None:
+        """Disconnects the clients relayed to or by a worker that is gone.
+
+        Args:
+            worker_id: The id of the worker.
+        """
+        for key, owner in list(self._owners.items()):
+            if owner == worker_id:
+                self._close(key)
+        for websocket in self._relayed.values():
+            if websocket.worker_id == worker_id:
+                websocket.feed(None)
+
+    def _close(self, key: str) -> None:
+        """Closes the connection of a client relayed to another worker.
+
+        Args:
+            key: The key of the client.
+        """
+        self._owners.pop(key, None)
+        client = self._relaying.pop(key, None)
+        if client is None:
+            return
+
+        task = asyncio.create_task(client.close())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
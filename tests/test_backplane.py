@@ -0,0 +1,313 @@
+import asyncio
+import json
+
+from fastapi import WebSocketDisconnect
+
+from server.backplane import (
+    InMemoryBackplane,
+    InMemoryHub,
+    RoomDirectory,
+    UnixBackplane,
+)
+from server.connection_manager import ConnectionManager
+from server.snekbox import SnekboxPool
+from server.worker import Worker
+
+
+class ScriptedWebSocket:
+    def __init__(self) -> None:
+        self.sent: list[dict] = []
+        self.closed = False
+        self._received: asyncio.Queue[str | None] = asyncio.Queue()
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        self.sent.append(json.loads(text))
+
+    async def receive_text(self) -> str:
+        text = await self._received.get()
+        if text is None:
+            raise WebSocketDisconnect()
+        return text
+
+    async def close(self) -> None:
+        self.closed = True
+        self._received.put_nowait(None)
+
+    def send(self, event_type: str, data: dict) -> None:
+        self._received.put_nowait(json.dumps({"type": event_type, "data": data}))
+
+    def hang_up(self) -> None:
+        self._received.put_nowait(None)
+
+    def types(self) -> list[str]:
+        return [event["type"] for event in self.sent]
+
+
+def connect(websocket: ScriptedWebSocket, connection_type: str, username: str) -> None:
+    data = {"connection_type": connection_type, "room_code": "CODE", "username": username}
+    if connection_type == "create":
+        data["difficulty"] = 1
+    websocket.send("connect", data)
+
+
+async def collaborate(first: Worker, second: Worker) -> tuple[ScriptedWebSocket, ScriptedWebSocket]:
+    owner, guest = ScriptedWebSocket(), ScriptedWebSocket()
+    tasks = [asyncio.create_task(first.serve(owner))]  # type: ignore[arg-type]
+    connect(owner, "create", "owner")
+    await asyncio.sleep(0.05)
+
+    tasks.append(asyncio.create_task(second.serve(guest)))  # type: ignore[arg-type]
+    connect(guest, "join", "guest")
+    await asyncio.sleep(0.05)
+
+    guest.send("replace", {"code": [{"from": 0, "to": 0, "value": "a"}], "version": 0})
+    await asyncio.sleep(0.1)
+    owner.send("replace", {"code": [{"from": 1, "to": 1, "value": "b"}], "version": 1})
+    await asyncio.sleep(0.1)
+
+    for websocket in (guest, owner):
+        websocket.send("disconnect", {})
+        websocket.hang_up()
+        await asyncio.sleep(0.05)
+    await asyncio.wait_for(asyncio.gather(*tasks), 1)
+    return owner, guest
+
+
+async def relay(first: Worker, second: Worker) -> tuple[ScriptedWebSocket, ScriptedWebSocket, list[asyncio.Task]]:
+    owner, guest = ScriptedWebSocket(), ScriptedWebSocket()
+    tasks = [asyncio.create_task(first.serve(owner))]  # type: ignore[arg-type]
+    connect(owner, "create", "owner")
+    await asyncio.sleep(0.05)
+    tasks.append(asyncio.create_task(second.serve(guest)))  # type: ignore[arg-type]
+    connect(guest, "join", "guest")
+    await asyncio.sleep(0.05)
+    return owner, guest, tasks
+
+
+def workers(hub: InMemoryHub) -> list[Worker]:
+    return [Worker(ConnectionManager(), SnekboxPool(), InMemoryBackplane(hub)) for _ in range(2)]
+
+
+class TestRoomDirectory:
+    def test_ownership_sticky(self):
+        directory = RoomDirectory()
+
+        assert directory.claim("CODE", "first") == "first"
+        assert directory.claim("CODE", "second") == "first"
+        directory.release("CODE", "second")
+        assert directory.claim("CODE", "second") == "first"
+
+    def test_rooms_of_worker_released(self):
+        directory = RoomDirectory()
+        directory.claim("CODE", "first")
+        directory.claim("OTHER", "second")
+        directory.release_worker("first")
+
+        assert directory.owners == {"OTHER": "second"}
+
+
+class TestInMemoryBackplane:
+    def test_clients_of_other_worker_relayed(self):
+        async def run():
+            hub = InMemoryHub()
+            first, second = workers(hub)
+            await first.start()
+            await second.start()
+            owner, guest = await collaborate(first, second)
+            code = first.manager.rooms.get("CODE")
+            owners = dict(hub.owners)
+            await first.stop()
+            await second.stop()
+            return owner, guest, code, second, owners
+
+        owner, guest, code, second, owners = asyncio.run(run())
+        assert len(second.manager.rooms) == 0
+        assert owner.types()[:2] == ["sync", "connect"]
+        assert guest.types()[0] == "sync"
+        assert [event["data"] for event in owner.sent if event["type"] == "replace"] == [
+            {"code": [{"from": 0, "to": 0, "value": "a"}], "version": 1},
+            {"code": [], "version": 2},
+        ]
+        assert [event["data"] for event in guest.sent if event["type"] == "replace"] == [
+            {"code": [], "version": 1},
+            {"code": [{"from": 1, "to": 1, "value": "b"}], "version": 2},
+        ]
+        # The room was deleted with its last client, and released
+        assert code is None
+        assert owners == {}
+
+    def test_stopped_worker_releases_rooms(self):
+        async def run():
+            hub = InMemoryHub()
+            backplane = InMemoryBackplane(hub, "first")
+            await backplane.start(lambda message: asyncio.sleep(0))
+            await backplane.claim("CODE")
+            await backplane.stop()
+            return await InMemoryBackplane(hub, "second").claim("CODE")
+
+        assert asyncio.run(run()) == "second"
+
+    def test_lost_claim_closes_connection(self):
+        class LostBackplane(InMemoryBackplane):
+            async def claim(self, room_code: str) -> str:
+                raise asyncio.TimeoutError
+
+        async def run():
+            worker = Worker(ConnectionManager(), SnekboxPool(), LostBackplane())
+            websocket = ScriptedWebSocket()
+            connect(websocket, "create", "owner")
+            await asyncio.wait_for(worker.serve(websocket), 1)  # type: ignore[arg-type]
+            return websocket
+
+        websocket = asyncio.run(run())
+        assert websocket.closed
+        assert [(event["type"], event["status_code"]) for event in websocket.sent] == [("error", 4008)]
+
+    def test_clients_relayed_to_stopped_worker_closed(self):
+        async def run():
+            first, second = workers(InMemoryHub())
+            await first.start()
+            await second.start()
+            _, guest, tasks = await relay(first, second)
+            # The worker dies, without closing its clients
+            await first.backplane.stop()
+            await asyncio.wait_for(tasks[1], 1)
+            tasks[0].cancel()
+            await first.stop()
+            await second.stop()
+            return guest
+
+        assert asyncio.run(run()).closed
+
+    def test_clients_relayed_by_stopped_worker_leave(self):
+        async def run():
+            first, second = workers(InMemoryHub())
+            await first.start()
+            await second.start()
+            _, _, tasks = await relay(first, second)
+            await second.stop()
+            await asyncio.sleep(0.05)
+            clients = {client.username for client in first.manager.rooms["CODE"].clients}
+            for task in tasks:
+                task.cancel()
+            await first.stop()
+            return clients
+
+        assert asyncio.run(run()) == {"owner"}
+
+
+class TestUnixBackplane:
+    def test_clients_of_other_worker_relayed(self, tmp_path):
+        async def run():
+            path = str(tmp_path / "backplane.sock")
+            first = Worker(ConnectionManager(), SnekboxPool(), UnixBackplane(path, "first"))
+            second = Worker(ConnectionManager(), SnekboxPool(), UnixBackplane(path, "second"))
+            await first.start()
+            await second.start()
+            claimed = await second.backplane.claim("OTHER"), await first.backplane.claim("OTHER")
+            owner, guest = await collaborate(first, second)
+            await second.stop()
+            await first.stop()
+            return owner, guest, claimed, first.backplane, second.backplane
+
+        owner, guest, claimed, first, second = asyncio.run(run())
+        assert first.broker is None and second.broker is None
+        assert claimed == ("second", "second")
+        assert [event["data"]["code"] for event in owner.sent if event["type"] == "replace"] == [
+            [{"from": 0, "to": 0, "value": "a"}],
+            [],
+        ]
+        assert [event["data"]["code"] for event in guest.sent if event["type"] == "replace"] == [
+            [],
+            [{"from": 1, "to": 1, "value": "b"}],
+        ]
+
+    def test_broker_taken_over(self, tmp_path):
+        async def run():
+            path = str(tmp_path / "backplane.sock")
+            first, second = UnixBackplane(path, "first"), UnixBackplane(path, "second")
+            received = []
+
+            async def handle(message):
+                received.append(message)
+
+            await first.start(handle)
+            await second.start(handle)
+            assert first.broker is not None and second.broker is None
+            await second.claim("CODE")
+
+            await first.stop()
+            await asyncio.sleep(0.5)
+            # The room is still owned by the worker that claimed it
+            third = UnixBackplane(path, "third")
+            await third.start(handle)
+            owner = await third.claim("CODE")
+            await third.send("second", {"type": "ping"})
+            await asyncio.sleep(0.05)
+            broker = second.broker
+            await third.stop()
+            await second.stop()
+            return owner, received, broker
+
+        owner, received, broker = asyncio.run(run())
+        assert broker is not None
+        assert owner == "second"
+        # The first worker ran the broker
+        assert received == [{"type": "released", "worker": "first"}, {"type": "ping"}]
+
+    def test_slow_worker_not_blocking(self, tmp_path):
+        async def run():
+            path = str(tmp_path / "backplane.sock")
+            sender, receiver = UnixBackplane(path, "sender"), UnixBackplane(path, "receiver")
+            received = asyncio.Event()
+
+            async def handle(message):
+                received.set()
+
+            await sender.start(handle)
+            await receiver.start(handle)
+            # A worker that never reads what it is sent
+            _, slow = await asyncio.open_unix_connection(path)
+            slow.write(b'{"op": "hello", "worker": "slow"}\n')
+            await slow.drain()
+
+            for _ in range(16):
+                await sender.send("slow", {"code": "x" * 1_000_000})
+            await sender.send("receiver", {"type": "ping"})
+            await asyncio.wait_for(received.wait(), 5)
+            assert sender.broker is not None
+            lag = sender.broker._connections["slow"].lag
+
+            slow.close()
+            await receiver.stop()
+            await sender.stop()
+            return lag
+
+        assert asyncio.run(run()) > 0
+
+    def test_clients_relayed_to_stopped_broker_closed(self, tmp_path):
+        async def run():
+            path = str(tmp_path / "backplane.sock")
+            first = Worker(ConnectionManager(), SnekboxPool(), UnixBackplane(path, "first"))
+            second = Worker(ConnectionManager(), SnekboxPool(), UnixBackplane(path, "second"))
+            third = Worker(ConnectionManager(), SnekboxPool(), UnixBackplane(path, "third"))
+            for worker in (first, second, third):
+                await worker.start()
+            # The owner doesn't run the broker, then does
+            _, guest, tasks = await relay(second, third)
+            await second.backplane.stop()
+            await asyncio.wait_for(tasks[1], 1)
+            _, other_guest, other_tasks = await relay(first, third)
+            await first.backplane.stop()
+            await asyncio.wait_for(other_tasks[1], 1)
+            for task in (tasks[0], other_tasks[0]):
+                task.cancel()
+            for worker in (first, second, third):
+                await worker.stop()
+            return guest, other_guest
+
+        guest, other_guest = asyncio.run(run())
+        assert guest.closed and other_guest.closed
@@ -0,0 +1,325 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import pytest
+
+from server import client as client_module
+from server.client import Client
+from server.codes import StatusCode
+from server.connection_manager import ConnectionManager
+from server.errors import RoomAlreadyExistsError
+from server.event_handler import EventHandler
+from server.events import (
+    ConnectData,
+    EventRequest,
+    EventResponse,
+    EventType,
+    MoveData,
+    ReplaceData,
+)
+from server.ot import ClientDocument
+from server.room import Room
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.sent: list[dict] = []
+        self.sending = 0
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        self.sending += 1
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(text))
+        self.sending -= 1
+
+
+async def drain(clients: list[Client]) -> None:
+    # A writer takes a message off its queue and starts sending it at once
+    while any(client.lag or client._websocket.sending for client in clients):
+        await asyncio.sleep(0)
+
+
+def move(x: int) -> EventResponse:
+    return EventResponse(type=EventType.MOVE, data=MoveData(position={"x": x, "y": 0}), status_code=StatusCode.SUCCESS)
+
+
+async def create_room(*delays: float) -> tuple[ConnectionManager, list[Client]]:
+    manager = ConnectionManager()
+    clients = []
+    for num, delay in enumerate(delays):
+        client = Client(FakeWebSocket(delay))  # type: ignore[arg-type]
+        client.username = f"user{num}"
+        await client.accept()
+        if num == 0:
+            manager.create_room(client, "CODE", 1)
+        else:
+            manager.join_room(client, "CODE")
+        clients.append(client)
+    return manager, clients
+
+
+class TestBroadcast:
+    def test_slow_client_does_not_block_room(self):
+        async def run():
+            manager, clients = await create_room(0, 0, 10)
+            for x in range(5):
+                await manager.broadcast(move(x), "CODE")
+            await asyncio.sleep(0.05)
+            for client in clients:
+                client.stop()
+            return clients
+
+        fast, other, slow = asyncio.run(run())
+        assert [event["data"]["position"]["x"] for event in fast._websocket.sent] == list(range(5))
+        assert [event["data"]["position"]["x"] for event in other._websocket.sent] == list(range(5))
+        assert slow._websocket.sent == []
+
+    def test_lagging_client_resynced(self, monkeypatch):
+        monkeypatch.setattr(client_module, "MAX_PENDING_MESSAGES", 3)
+
+        async def run():
+            manager, clients = await create_room(0, 0.01)
+            for x in range(10):
+                await manager.broadcast(move(x), "CODE", sender=clients[0])
+            await asyncio.sleep(0.1)
+            for client in clients:
+                client.stop()
+            return clients
+
+        _, lagging = asyncio.run(run())
+        events = lagging._websocket.sent
+        assert events[-1]["type"] == EventType.SYNC
+        assert len(events) < 10
+
+    def test_cursor_moves_batched(self):
+        async def run():
+            manager, clients = await create_room(*[0] * 10)
+            for x in range(10):
+                for client in clients:
+                    manager.move_cursor(client, "CODE", {"x": x, "y": 0})
+            await asyncio.sleep(manager.cursor_interval * 2)
+            for client in clients:
+                client.stop()
+            return clients
+
+        clients = asyncio.run(run())
+        for client in clients:
+            events = client._websocket.sent
+            assert len(events) == 1
+            assert events[0]["type"] == EventType.CURSORS
+            assert events[0]["data"]["cursors"][clients[0].id.hex] == {"x": 9, "y": 0}
+
+    def test_own_cursor_not_sent_back(self):
+        async def run():
+            manager, clients = await create_room(0, 0)
+            manager.move_cursor(clients[0], "CODE", {"x": 1, "y": 1})
+            await asyncio.sleep(manager.cursor_interval * 2)
+            for client in clients:
+                client.stop()
+            return clients
+
+        mover, other = asyncio.run(run())
+        assert mover._websocket.sent == []
+        assert other._websocket.sent[0]["data"]["cursors"] == {mover.id.hex: {"x": 1, "y": 1}}
+
+    def test_replacements_batched(self):
+        async def run():
+            manager, clients = await create_room(0, 0)
+            for num, char in enumerate("hello"):
+                manager.replace(clients[0], "CODE", ReplaceData(code=[{"from": num, "to": num, "value": char}]))
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain(clients)
+            for client in clients:
+                client.stop()
+            return manager, clients
+
+        manager, (sender, other) = asyncio.run(run())
+        assert [event["data"] for event in sender._websocket.sent] == [
+            {"code": [], "version": version} for version in range(1, 6)
+        ]
+        assert [event["data"] for event in other._websocket.sent] == [
+            {"code": [{"from": 0, "to": 0, "value": "hello"}], "version": 5}
+        ]
+        assert manager.rooms["CODE"].code == "hello"
+        assert manager.removed_operations == 4
+
+    def test_replacements_flushed_before_other_events(self):
+        async def run():
+            manager, clients = await create_room(0, 0)
+            manager.replace(clients[0], "CODE", ReplaceData(code=[{"from": 0, "to": 0, "value": "a"}]))
+            manager.replace(clients[1], "CODE", ReplaceData(code=[{"from": 1, "to": 1, "value": "b"}]))
+            await manager.broadcast(move(1), "CODE")
+            await asyncio.sleep(0.01)
+            for client in clients:
+                client.stop()
+            return clients
+
+        first, second = asyncio.run(run())
+        assert [event["type"] for event in first._websocket.sent] == [
+            EventType.REPLACE,
+            EventType.REPLACE,
+            EventType.MOVE,
+        ]
+        assert [event["type"] for event in second._websocket.sent] == [
+            EventType.REPLACE,
+            EventType.REPLACE,
+            EventType.MOVE,
+        ]
+        assert [event["data"]["code"] for event in first._websocket.sent[:2]] == [
+            [],
+            [{"from": 1, "to": 1, "value": "b"}],
+        ]
+
+
+class TestMembership:
+    def test_replace_after_failed_connect(self):
+        async def run():
+            manager, clients = await create_room(0)
+            intruder = Client(FakeWebSocket())  # type: ignore[arg-type]
+            await intruder.accept()
+            handler = EventHandler(intruder, manager, None)  # type: ignore[arg-type]
+            data = ConnectData(connection_type="create", room_code="CODE", username="intruder", difficulty=1)
+            with pytest.raises(RoomAlreadyExistsError):
+                await handler(EventRequest(type=EventType.CONNECT, data=data))
+
+            replace_data = ReplaceData(code=[{"from": 0, "to": 0, "value": "x"}])
+            await handler(EventRequest(type=EventType.REPLACE, data=replace_data))
+            manager.replace(intruder, "CODE", replace_data)
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain([*clients, intruder])
+            for client in (*clients, intruder):
+                client.stop()
+            return manager.rooms["CODE"], clients[0], intruder
+
+        room, owner, intruder = asyncio.run(run())
+        assert room.code == "" and room.version == 0
+        assert intruder not in room.clients
+        assert owner._websocket.sent == []
+        assert [event["type"] for event in intruder._websocket.sent] == [EventType.ERROR]
+
+    def test_move_from_outside_room(self):
+        async def run():
+            manager, clients = await create_room(0)
+            intruder = Client(FakeWebSocket())  # type: ignore[arg-type]
+            await intruder.accept()
+            manager.move_cursor(intruder, "CODE", {"x": 1, "y": 1})
+            await asyncio.sleep(manager.cursor_interval * 2)
+            for client in (*clients, intruder):
+                client.stop()
+            return manager.rooms["CODE"], clients[0]
+
+        room, owner = asyncio.run(run())
+        assert room.cursors == {}
+        assert owner._websocket.sent == []
+
+
+class TestDeltaSync:
+    def test_owner_sync_sends_changes(self):
+        async def run():
+            manager, (owner, other) = await create_room(0, 0)
+            manager.sync_code(owner, "CODE", "def f():\n    pass\n")
+            manager.sync_code(owner, "CODE", "def f():\n    pass\n")
+            manager.sync_code(owner, "CODE", "def g():\n    pass\n")
+            await asyncio.sleep(0.01)
+            for client in (owner, other):
+                client.stop()
+            return owner, other
+
+        owner, other = asyncio.run(run())
+        assert [event["data"] for event in owner._websocket.sent] == [
+            {"code": [], "version": 1},
+            {"code": [], "version": 2},
+        ]
+        assert [event["data"] for event in other._websocket.sent] == [
+            {"code": [{"from": 0, "to": 0, "value": "def f():\n    pass\n"}], "version": 1},
+            {"code": [{"from": 4, "to": 5, "value": "g"}], "version": 2},
+        ]
+
+    def test_concurrent_changes_transformed(self):
+        async def run():
+            manager, (first, second) = await create_room(0, 0)
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 0, "to": 0, "value": "a"}], version=0))
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 1, "to": 1, "value": "b"}], version=0))
+            manager.replace(second, "CODE", ReplaceData(code=[{"from": 0, "to": 0, "value": "c"}], version=0))
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain([first, second])
+            for client in (first, second):
+                client.stop()
+            return manager, first, second
+
+        manager, first, second = asyncio.run(run())
+        assert manager.rooms["CODE"].code == "abc"
+        assert [event["data"] for event in first._websocket.sent] == [
+            {"code": [], "version": 1},
+            {"code": [], "version": 2},
+            {"code": [{"from": 2, "to": 2, "value": "c"}], "version": 3},
+        ]
+        assert "sync" not in [event["type"] for event in second._websocket.sent]
+
+    def test_stale_client_synced(self):
+        async def run():
+            manager, (first, second) = await create_room(0, 0)
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 0, "to": 0, "value": "a"}], version=0))
+            manager.replace(second, "CODE", ReplaceData(code=[{"from": 0, "to": 0, "value": "c"}], version=0))
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 1, "to": 1, "value": "b"}], version=0))
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain([first, second])
+            for client in (first, second):
+                client.stop()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert "sync" not in [event["type"] for event in second._websocket.sent]
+        assert [event["type"] for event in first._websocket.sent] == ["replace", "replace", "replace", "sync"]
+        assert first._websocket.sent[2]["data"] == {"code": [], "version": 3}
+        assert first._websocket.sent[3]["data"]["code"] == "abc"
+        assert first._websocket.sent[3]["data"]["version"] == 3
+
+    def test_multiple_changes_kept(self):
+        async def run():
+            manager, (first, second) = await create_room(0, 0)
+            manager.sync_code(first, "CODE", "x = 1\ny = 2\n")
+            changes = [{"from": 6, "to": 6, "value": "a"}, {"from": 0, "to": 0, "value": "a"}]
+            manager.replace(first, "CODE", ReplaceData(code=changes, version=1))
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain([first, second])
+            for client in (first, second):
+                client.stop()
+            return manager.rooms["CODE"].code, second
+
+        code, second = asyncio.run(run())
+        document = ClientDocument()
+        for event in second._websocket.sent:
+            document.receive(ReplaceData(**event["data"]))
+
+        assert code == "ax = 1\nay = 2\n"
+        assert document.code == code
+
+
+class TestVersion:
+    def test_changes_increase_version(self):
+        room = Room(uuid4(), set(), 1)
+        room.update_code(ReplaceData(code=[{"from": 0, "to": 0, "value": "x"}]))
+        room.update_code(ReplaceData(code=[{"from": 1, "to": 1, "value": ""}]))
+        room.set_code("x")
+
+        assert room.version == 1
+
+    def test_stale_after_changes_of_both(self):
+        author, other = uuid4(), uuid4()
+        room = Room(author, set(), 1)
+        room.update_code(ReplaceData(code=[{"from": 0, "to": 0, "value": "x"}]), author)
+
+        assert not room.is_stale(author, 0)
+        assert not room.is_stale(other, 0)
+
+        room.update_code(ReplaceData(code=[{"from": 0, "to": 0, "value": "y"}]), other)
+
+        assert room.is_stale(author, 0)
+        assert not room.is_stale(author, 1)
+        assert room.is_stale(author, 3)
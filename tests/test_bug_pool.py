@@ -0,0 +1,73 @@
+import asyncio
+import random
+
+from server.bug_pool import BugPool, compute_bugs
+from tests.test_broadcast import create_room
+
+CODE = "def f(x: int) -> bool:\n    if x == 1:\n        return True\n    return False\n"
+
+
+class TestBugPool:
+    def test_seeded_bugs(self):
+        assert compute_bugs(CODE, 3, 42) == compute_bugs(CODE, 3, 42)
+
+    def test_global_generator_untouched(self):
+        state = random.getstate()
+        compute_bugs(CODE, 3, 42)
+
+        assert random.getstate() == state
+
+    def test_small_code_inline(self):
+        async def run():
+            pool = BugPool()
+            replacements = await pool.compute(CODE, 3, 42)
+            return pool, replacements
+
+        pool, replacements = asyncio.run(run())
+        assert replacements
+        assert pool._executor is None
+
+    def test_large_code_in_worker(self):
+        async def run():
+            pool = BugPool(max_workers=1, timeout=30, inline_threshold=0)
+            try:
+                return await pool.compute(CODE, 3, 7)
+            finally:
+                pool.shutdown()
+
+        assert asyncio.run(run()) == compute_bugs(CODE, 3, 7)
+
+    def test_timeout(self):
+        async def run():
+            pool = BugPool(max_workers=1, timeout=0, inline_threshold=0)
+            try:
+                return pool, await pool.compute(CODE, 3, 42)
+            finally:
+                pool.shutdown()
+
+        pool, replacements = asyncio.run(run())
+        assert replacements == []
+        assert pool.timeouts == 1
+
+
+class TestRoomBugs:
+    def test_bugs_discarded_when_code_changed(self):
+        async def run():
+            manager, clients = await create_room(0)
+            room = manager.rooms["CODE"]
+            room.set_code(CODE)
+            compute = manager.bug_pool.compute
+
+            async def edit_while_computing(*args):
+                replacements = await compute(*args)
+                room.set_code(CODE + "x = 1\n")
+                return replacements
+
+            manager.bug_pool.compute = edit_while_computing
+            await manager.send_bugs("CODE")
+            clients[0].stop()
+            return manager, room
+
+        manager, room = asyncio.run(run())
+        assert room.code == CODE + "x = 1\n"
+        assert manager.discarded_bugs == 1
@@ -0,0 +1,33 @@
+import time
+
+from server.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_hits_and_misses(self):
+        cache: LRUCache[str] = LRUCache()
+        assert cache.get("a") is None
+
+        cache.set("a", "1")
+        assert cache.get("a") == "1"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_least_recently_used_evicted(self):
+        cache: LRUCache[str] = LRUCache(max_size=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+        assert cache.evictions == 1
+
+    def test_expired_entries(self):
+        cache: LRUCache[str] = LRUCache(ttl=0.01)
+        cache.set("a", "1")
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
@@ -0,0 +1,63 @@
+import pytest
+from pydantic import ValidationError
+
+from server.events import EventRequest, EventType, MoveData, ReplaceData, decode_request
+
+valid_payloads = [
+    {"type": "move", "data": {"position": {"x": 1, "y": 2}}},
+    {"type": "move", "data": {"position": {"x": "1", "y": 2}}},
+    {"type": "replace", "data": {"code": [{"from": 0, "to": 1, "value": "a", "extra": 1}]}},
+    {"type": "replace", "data": {"code": []}},
+    {"type": "replace", "data": {"code": [], "version": 3}},
+    {"type": "replace", "data": {"code": [], "version": "3"}},
+    {"type": "connect", "data": {"connection_type": "join", "room_code": "ABCD", "username": "kappa"}},
+    {"type": "sync", "data": {"code": "", "collaborators": [], "owner_id": "abc", "difficulty": 1}},
+    {"type": "bugs", "data": {}},
+    {"type": "evaluate", "data": {}},
+]
+
+invalid_payloads = [
+    [],
+    {},
+    {"type": "move"},
+    {"type": "unknown", "data": {}},
+    {"type": ["move"], "data": {}},
+    {"type": "move", "data": []},
+    {"type": "move", "data": {"position": {"x": 1}}},
+    {"type": "replace", "data": {"code": [{"from": 0, "to": 1}]}},
+    {"type": "replace", "data": {"code": [], "version": "three"}},
+    {"type": "connect", "data": {"connection_type": "create", "room_code": "ABCD", "username": "kappa"}},
+    {"type": "connect", "data": {"room_code": "ABCD"}},
+]
+
+
+def outcome(decode, payload):
+    try:
+        return decode(payload)
+    except (TypeError, ValueError, KeyError) as err:
+        return type(err)
+
+
+class TestDecoding:
+    @pytest.mark.parametrize("payload", valid_payloads)
+    def test_same_as_event_request(self, payload):
+        request = decode_request(payload)
+
+        assert request == EventRequest(**payload)
+        assert request.dict() == EventRequest(**payload).dict()
+
+    @pytest.mark.parametrize("payload", invalid_payloads)
+    def test_same_errors_as_event_request(self, payload):
+        assert outcome(decode_request, payload) == outcome(lambda payload: EventRequest(**payload), payload)
+
+    def test_fast_path(self):
+        move = decode_request(valid_payloads[0])
+        replace = decode_request(valid_payloads[2])
+
+        assert move.type == EventType.MOVE and isinstance(move.data, MoveData)
+        assert replace.type == EventType.REPLACE and isinstance(replace.data, ReplaceData)
+        assert replace.data.code == [{"from": 0, "to": 1, "value": "a"}]
+
+    def test_validation_error(self):
+        with pytest.raises(ValidationError):
+            decode_request({"type": "move", "data": {"position": None}})
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from server import encoding
+from server.codes import StatusCode
+from server.events import EventResponse, EventType, ReplaceData, SyncData
+
+responses = [
+    EventResponse(
+        type=EventType.REPLACE,
+        data=ReplaceData(code=[{"from": 0, "to": 1, "value": "é"}]),
+        status_code=StatusCode.SUCCESS,
+    ),
+    EventResponse(
+        type=EventType.SYNC,
+        data=SyncData(
+            code="print('hi')\n",
+            collaborators=[{"id": "abc", "username": "kappa"}],
+            time={"min": 1.0, "sec": 2.0, "mil": 0.5},
+            owner_id="abc",
+            difficulty=2,
+        ),
+        status_code=StatusCode.SUCCESS,
+    ),
+]
+
+
+class TestEncoding:
+    @pytest.mark.parametrize("response", responses)
+    @pytest.mark.parametrize("dumps", (encoding.dumps_json, encoding.dumps_orjson))
+    def test_same_as_send_json(self, dumps, response: EventResponse):
+        if dumps is encoding.dumps_orjson and encoding.orjson is None:
+            pytest.skip("orjson is not installed")
+
+        assert json.loads(dumps(response.dict())) == json.loads(json.dumps(response.dict()))
+
+    def test_encode_event(self):
+        assert json.loads(encoding.encode_event(responses[0]))["type"] == "replace"
@@ -0,0 +1,102 @@
+import asyncio
+from uuid import uuid4
+
+from server import room as room_module
+from server.client import Client
+from server.event_handler import EventHandler
+from server.events import ConnectData, EventRequest, EventType, ReplaceData
+from server.room import Room
+from tests.test_broadcast import FakeWebSocket, create_room
+
+
+def replace(room: Room, start: int, value: str) -> None:
+    room.update_code(ReplaceData(code=[{"from": start, "to": start, "value": value}]))
+
+
+def join(version: int | None) -> EventRequest:
+    data = ConnectData(connection_type="join", room_code="CODE", username="again", version=version)
+    return EventRequest(type=EventType.CONNECT, data=data)
+
+
+class TestHistory:
+    def test_changes_since_version(self):
+        room = Room(uuid4(), set(), 1)
+        room.set_code("hello world\n")
+        for num, char in enumerate("abc"):
+            replace(room, num, char)
+
+        assert room.changes_since(4) == []
+        assert room.changes_since(2) == [{"from": 1, "to": 1, "value": "b"}, {"from": 2, "to": 2, "value": "c"}]
+        assert room.changes_since(5) is None
+
+    def test_old_version_not_in_history(self, monkeypatch):
+        monkeypatch.setattr(room_module, "HISTORY_SIZE", 2)
+        room = Room(uuid4(), set(), 1)
+        room.set_code("hello world\n")
+        for num, char in enumerate("abc"):
+            replace(room, num, char)
+
+        assert room.changes_since(2) is not None
+        assert room.changes_since(1) is None
+
+    def test_whole_code_cheaper(self):
+        room = Room(uuid4(), set(), 1)
+        replace(room, 0, "a" * 10)
+        replace(room, 0, "b" * 10)
+        room.set_code("c")
+
+        assert room.changes_since(0) is None
+
+    def test_history_bounded_by_characters(self, monkeypatch):
+        monkeypatch.setattr(room_module, "HISTORY_MAX_CHARACTERS", 10)
+        room = Room(uuid4(), set(), 1)
+        for _ in range(10):
+            replace(room, 0, "abcd")
+
+        assert room._history_characters <= 10
+        assert [version for _, version, _, _ in room._history] == [9, 10]
+
+    def test_squashed_versions_unknown(self):
+        room = Room(uuid4(), set(), 1)
+        room.set_code("hello world\n")
+        for num, char in enumerate("abc"):
+            replace(room, num, char)
+        room.squash_history(1, [{"from": 0, "to": 0, "value": "abc"}])
+
+        assert room.changes_since(1) == [{"from": 0, "to": 0, "value": "abc"}]
+        assert room.changes_since(2) is None
+        assert room.changes_since(4) == []
+
+
+class TestReconnection:
+    def run_join(self, version: int | None) -> dict:
+        async def run():
+            manager, clients = await create_room(0)
+            room = manager.rooms["CODE"]
+            room.set_code("def f():\n    pass\n")
+            replace(room, 4, "g")
+
+            client = Client(FakeWebSocket())  # type: ignore[arg-type]
+            await client.accept()
+            await EventHandler(client, manager, None)(join(version))  # type: ignore[arg-type]
+            await asyncio.sleep(0.01)
+            for connected in (*clients, client):
+                connected.stop()
+            return client._websocket.sent[0]
+
+        return asyncio.run(run())
+
+    def test_missing_changes_sent(self):
+        sync = self.run_join(1)
+
+        assert sync["type"] == "sync"
+        assert sync["data"]["code"] is None
+        assert sync["data"]["changes"] == [{"from": 4, "to": 4, "value": "g"}]
+        assert sync["data"]["version"] == 2
+
+    def test_whole_code_sent(self):
+        for version in (None, 3):
+            sync = self.run_join(version)
+
+            assert sync["data"]["code"] == "def gf():\n    pass\n"
+            assert sync["data"]["changes"] is None
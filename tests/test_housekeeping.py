@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+from uuid import uuid4
+
+import pytest
+
+from server.client import Client
+from server.connection_manager import ConnectionManager
+from server.errors import RoomAlreadyExistsError
+from server.events import ReplaceData
+from server.housekeeping import Housekeeper, SweepStats
+from server.room import Room
+from server.snapshots import SnapshotStore
+from tests.test_broadcast import FakeWebSocket
+
+
+class ClosingWebSocket(FakeWebSocket):
+    def __init__(self, broken: bool = False) -> None:
+        super().__init__()
+        self.broken = broken
+        self.closed = False
+
+    async def send_text(self, text: str) -> None:
+        if self.broken:
+            raise RuntimeError("The connection is closed")
+        await super().send_text(text)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+async def connect(manager: ConnectionManager, broken: bool = False, create: bool = False) -> Client:
+    client = Client(ClosingWebSocket(broken))  # type: ignore[arg-type]
+    client.username = "user"
+    await client.accept()
+    await manager.rehydrate("CODE")
+    if create:
+        manager.create_room(client, "CODE", 2)
+    else:
+        manager.join_room(client, "CODE")
+    return client
+
+
+class TestSnapshotStore:
+    def test_round_trip(self, tmp_path):
+        store = SnapshotStore(tmp_path)
+        room = Room(uuid4(), set(), 3)
+        room.set_code("def f():\n    pass\n")
+        room.update_code(ReplaceData(code=[{"from": 4, "to": 4, "value": "g"}]))
+        store.save("CODE/..", room.snapshot())
+
+        assert "CODE/.." in store and len(store) == 1
+        restored = Room.from_snapshot(store.load("CODE/.."))
+        assert "CODE/.." not in store
+        assert store.load("CODE/..") is None
+
+        assert restored.code == room.code
+        assert (restored.owner_id, restored.difficulty, restored.epoch) == (room.owner_id, 3, room.epoch)
+        assert restored.version == room.version
+        # The history isn't kept, so reconnecting clients get the whole code
+        assert restored.changes_since(room.version - 1) is None
+
+    def test_prune(self, tmp_path):
+        store = SnapshotStore(tmp_path, ttl=60)
+        for room_code in ("OLD", "NEW"):
+            store.save(room_code, Room(uuid4(), set(), 1).snapshot())
+        old = time.time() - 120
+        os.utime(store._path("OLD"), (old, old))
+
+        assert store.prune() == 1
+        assert "OLD" not in store and "NEW" in store
+
+
+class TestHibernation:
+    def test_rehydrated_on_join(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            owner = await connect(manager, create=True)
+            manager.rooms["CODE"].set_code("hello\n")
+            hibernated = await manager.hibernate("CODE")
+            in_memory = "CODE" in manager.rooms
+
+            with pytest.raises(RoomAlreadyExistsError):
+                await connect(manager, create=True)
+            guest = await connect(manager)
+            return manager, owner, guest, hibernated, in_memory
+
+        manager, owner, guest, hibernated, in_memory = asyncio.run(run())
+        assert hibernated and not in_memory
+        assert owner._websocket.closed
+        room = manager.rooms["CODE"]
+        assert room.code == "hello\n"
+        assert room.owner_id == owner.id
+        assert room.clients == {guest}
+        assert "CODE" not in manager.store
+        assert len(manager.bug_scheduler) == 1
+
+    def test_joined_while_hibernating(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            await connect(manager, create=True)
+            manager.rooms["CODE"].set_code("hello\n")
+            hibernating = asyncio.create_task(manager.hibernate("CODE"))
+            # The snapshot is being written in a thread
+            await asyncio.sleep(0)
+
+            with pytest.raises(RoomAlreadyExistsError):
+                await connect(manager, create=True)
+            guest = await connect(manager)
+            await hibernating
+            return manager, guest
+
+        manager, guest = asyncio.run(run())
+        room = manager.rooms["CODE"]
+        assert room.code == "hello\n"
+        assert room.clients == {guest}
+        assert "CODE" not in manager.store
+
+    def test_created_without_disk_access(self, tmp_path, monkeypatch):
+        def exists(self, room_code):
+            raise AssertionError("The store was read on the event loop")
+
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            monkeypatch.setattr(SnapshotStore, "__contains__", exists)
+            return manager, await connect(manager, create=True)
+
+        manager, owner = asyncio.run(run())
+        assert manager.rooms["CODE"].clients == {owner}
+
+    def test_deleted_without_store(self):
+        async def run():
+            manager = ConnectionManager()
+            await connect(manager, create=True)
+            await manager.hibernate("CODE")
+            return manager
+
+        manager = asyncio.run(run())
+        assert len(manager.rooms) == 0
+        assert len(manager.bug_scheduler) == 0
+
+
+class TestHousekeeper:
+    def test_dead_clients_dropped(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            owner = await connect(manager, create=True)
+            dead = await connect(manager, broken=True)
+            dead.enqueue(manager._encode_acknowledgement(manager.rooms["CODE"]))
+            await asyncio.sleep(0.01)
+
+            stats = await Housekeeper(manager).sweep()
+            await asyncio.sleep(0.01)
+            owner.stop()
+            return manager, owner, dead, stats
+
+        manager, owner, dead, stats = asyncio.run(run())
+        assert stats == SweepStats(dropped_clients=1, hibernated_rooms=0, pruned_snapshots=0)
+        assert manager.rooms["CODE"].clients == {owner}
+        assert owner._websocket.sent[-1]["type"] == "disconnect"
+        assert owner._websocket.sent[-1]["data"]["user"][0]["id"] == dead.id.hex
+
+    def test_idle_rooms_hibernated(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            # A room recovered from the journal, which nobody joined again
+            manager.rooms.create("CODE", lambda: Room(uuid4(), set(), 1))
+            housekeeper = Housekeeper(manager, idle_timeout=60)
+            active = await housekeeper.sweep()
+
+            manager.rooms["CODE"].last_active -= 120
+            idle = await housekeeper.sweep()
+            return manager, active, idle
+
+        manager, active, idle = asyncio.run(run())
+        assert active.hibernated_rooms == 0
+        assert idle.hibernated_rooms == 1
+        assert "CODE" not in manager.rooms and "CODE" in manager.store
+
+    def test_connected_clients_left_alone(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            client = await connect(manager, create=True)
+            manager.rooms["CODE"].last_active -= 120
+            stats = await Housekeeper(manager, idle_timeout=60).sweep()
+            client.stop()
+            return manager, client, stats
+
+        manager, client, stats = asyncio.run(run())
+        assert stats.hibernated_rooms == 0
+        assert manager.rooms["CODE"].clients == {client}
+        assert not client._websocket.closed
+
+    def test_sweeps_periodically(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(store=SnapshotStore(tmp_path))
+            manager.rooms.create("CODE", lambda: Room(uuid4(), set(), 1))
+            housekeeper = Housekeeper(manager, interval=0.01, idle_timeout=0)
+            housekeeper.start()
+            await asyncio.sleep(0.05)
+            await housekeeper.stop()
+            return manager
+
+        manager = asyncio.run(run())
+        assert len(manager.rooms) == 0
+        assert len(manager.store) == 1
@@ -0,0 +1,191 @@
+import asyncio
+import importlib
+import threading
+from uuid import uuid4
+
+from server.backplane import InMemoryBackplane, InMemoryHub
+from server.connection_manager import ConnectionManager
+from server.events import ReplaceData
+from server.journal import RoomJournal, claim_journal
+from server.room import Room
+from server.snapshots import RoomSnapshot
+from server.snekbox import SnekboxPool
+from server.worker import Worker
+from tests.test_housekeeping import connect
+
+
+def replace(manager: ConnectionManager, client, start: int, value: str) -> None:
+    manager.replace(client, "CODE", ReplaceData(code=[{"from": start, "to": start, "value": value}]))
+
+
+async def edit_room(manager: ConnectionManager) -> None:
+    owner = await connect(manager, create=True)
+    manager.sync_code(owner, "CODE", "def f():\n    pass\n")
+    replace(manager, owner, 4, "g")
+    replace(manager, owner, 5, "h")
+    owner.stop()
+
+
+class TestRoomJournal:
+    def test_rooms_recovered(self, tmp_path):
+        async def run():
+            journal = RoomJournal(tmp_path, flush_interval=0.01)
+            manager = ConnectionManager(journal=journal)
+            journal.start(manager.rooms)
+            await edit_room(manager)
+            await asyncio.sleep(0.05)
+            # Nothing is written on stop, as if the server crashed
+            journal._task.cancel()
+            return manager.rooms["CODE"]
+
+        room = asyncio.run(run())
+        manager = ConnectionManager(journal=RoomJournal(tmp_path))
+
+        assert manager.recover() == 1
+        recovered = manager.rooms["CODE"]
+        assert recovered.code == room.code == "def ghf():\n    pass\n"
+        assert (recovered.owner_id, recovered.difficulty, recovered.epoch) == (room.owner_id, 2, room.epoch)
+        assert recovered.version == room.version
+        assert recovered.clients == set()
+        assert len(manager.bug_scheduler) == 1
+
+    def test_deleted_rooms_not_recovered(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(journal=RoomJournal(tmp_path))
+            client = await connect(manager, create=True)
+            manager.disconnect(client, "CODE")
+            await manager.journal.stop()
+
+        asyncio.run(run())
+        assert RoomJournal(tmp_path).recover() == {}
+
+    def test_line_cut_short_ignored(self, tmp_path):
+        async def run():
+            manager = ConnectionManager(journal=RoomJournal(tmp_path))
+            await edit_room(manager)
+            await manager.journal.stop()
+
+        asyncio.run(run())
+        (segment,) = tmp_path.glob("journal-*.log")
+        content = segment.read_bytes()
+        segment.write_bytes(content[:-10])
+
+        journal = RoomJournal(tmp_path)
+        rooms = journal.recover()
+        assert rooms["CODE"].code == "def gf():\n    pass\n"
+        assert journal._segment == 1
+
+    def test_compacted_into_snapshot(self, tmp_path):
+        async def run():
+            journal = RoomJournal(tmp_path)
+            manager = ConnectionManager(journal=journal)
+            journal.start(manager.rooms)
+            await edit_room(manager)
+            await journal.flush(compact=True)
+            # The snapshot already holds the room, this goes to a new segment
+            room = manager.rooms["CODE"]
+            manager._record_change("CODE", room, room.set_code("x = 1\n"))
+            await journal.stop()
+
+        asyncio.run(run())
+        assert [path.name for path in sorted(tmp_path.glob("*-*"))] == ["journal-00000001.log", "snapshot-00000001.z"]
+        rooms = RoomJournal(tmp_path).recover()
+        assert rooms["CODE"].code == "x = 1\n"
+
+    def test_compacted_once_grown(self, tmp_path):
+        async def run():
+            journal = RoomJournal(tmp_path, compact_size=1)
+            manager = ConnectionManager(journal=journal)
+            journal.start(manager.rooms)
+            await edit_room(manager)
+            await journal.flush()
+            await journal.flush()
+            await journal.stop()
+
+        asyncio.run(run())
+        assert [path.name for path in tmp_path.glob("*-*")] == ["snapshot-00000001.z"]
+        assert RoomJournal(tmp_path).recover()["CODE"].code == "def ghf():\n    pass\n"
+
+    def test_snapshot_encoded_in_thread(self, tmp_path, monkeypatch):
+        threads = set()
+        to_dict = RoomSnapshot.to_dict
+
+        def recording_to_dict(snapshot):
+            threads.add(threading.current_thread())
+            return to_dict(snapshot)
+
+        async def run():
+            journal = RoomJournal(tmp_path)
+            manager = ConnectionManager(journal=journal)
+            journal.start(manager.rooms)
+            await edit_room(manager)
+            monkeypatch.setattr(RoomSnapshot, "to_dict", recording_to_dict)
+            await journal.flush(compact=True)
+            await journal.stop()
+
+        asyncio.run(run())
+        assert threads and threading.main_thread() not in threads
+        assert RoomJournal(tmp_path).recover()["CODE"].code == "def ghf():\n    pass\n"
+
+    def test_journals_claimed_by_workers(self, tmp_path):
+        first = claim_journal(tmp_path)
+        second = claim_journal(tmp_path)
+
+        assert first.directory.name == "worker-0"
+        assert second.directory.name == "worker-1"
+
+        async def stop():
+            await first.stop()
+
+        asyncio.run(stop())
+        assert claim_journal(tmp_path).directory.name == "worker-0"
+
+    def test_journals_of_gone_workers_merged(self, tmp_path):
+        async def run():
+            journals = [claim_journal(tmp_path) for _ in range(2)]
+            for journal, code in zip(journals, ("first", "second")):
+                room = Room(uuid4(), set(), 1)
+                room.set_code(code)
+                journal.created(code.upper(), room)
+                await journal.stop()
+
+            journal = claim_journal(tmp_path)
+            manager = ConnectionManager(journal=journal)
+            recovered = manager.recover()
+            journal.start(manager.rooms)
+            await journal.flush()
+            await journal.stop()
+            return recovered
+
+        assert asyncio.run(run()) == 2
+        assert [path.name for path in tmp_path.iterdir()] == ["worker-0"]
+        rooms = RoomJournal(tmp_path / "worker-0").recover()
+        assert {room_code: snapshot.code for room_code, snapshot in rooms.items()} == {
+            "FIRST": "first",
+            "SECOND": "second",
+        }
+
+    def test_not_claimed_on_import(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("JOURNAL_PATH", str(tmp_path / "journal"))
+        monkeypatch.setenv("SNAPSHOT_PATH", str(tmp_path / "snapshots"))
+        importlib.reload(importlib.import_module("server.main"))
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_recovered_rooms_claimed(self, tmp_path):
+        async def run():
+            hub = InMemoryHub()
+            await InMemoryBackplane(hub, "other").claim("CODE")
+            manager = ConnectionManager()
+            for room_code in ("CODE", "MINE"):
+                manager.rooms.create(room_code, lambda: Room(uuid4(), set(), 1))
+
+            worker = Worker(manager, SnekboxPool(), InMemoryBackplane(hub, "worker"))
+            await worker.start()
+            owners = dict(hub.owners)
+            await worker.stop()
+            return manager, owners
+
+        manager, owners = asyncio.run(run())
+        assert [room_code for room_code, _ in manager.rooms] == ["MINE"]
+        assert owners["MINE"] == "worker"
@@ -1,7 +1,10 @@
+import random
+
 import pytest
 
+from server import modifiers as modifiers_module
 from server.events import ReplaceData
-from server.modifiers import FOUR_SPACES, STATEMENTS, TYPES, Modifiers
+from server.modifiers import FOUR_SPACES, MUTATORS, STATEMENTS, TYPES, Modifiers, plan
 
 test_input = 'def say_hello() -> str:\n    return "Hello!"\nsay_hello()\n\n'
 
@@ -75,6 +78,15 @@ class TestModifiers:
         assert isinstance(value, Modifiers)
         assert any(stmt in modified for stmt in STATEMENTS for modified in value.modified_contents)
 
+    def test_changing_every_call_site(self):
+        code = 'def f():\n    pass\n\nf()\nprint("f()", f(), ff())\n'
+        value = Modifiers(code).change_function_call_name()
+
+        statement = value.modified_contents[3][:-3]
+        assert statement in STATEMENTS
+        assert value.modified_contents[0] == "def f():\n"
+        assert value.modified_contents[4] == f'print("f()", {statement}(), ff())\n'
+
     def test_inserting_an_empty_if_statement(self, create_instance: Modifiers):
         value = create_instance.insert_empty_statements()
 
@@ -120,3 +132,37 @@ class TestModifiers:
         assert create_instance.difficulty == difficulty
         assert isinstance(value, ReplaceData)
         assert difficulty <= create_instance.modified_count
+
+
+class TestMutators:
+    def test_every_modifier_registered(self):
+        methods = [name for name in vars(Modifiers) if not name.startswith("_") and name != "output"]
+
+        assert list(MUTATORS) == methods
+        assert all(mutator.weight == 1.0 for mutator in MUTATORS.values())
+
+    def test_plan_seeded(self):
+        plans = [[mutator.name for mutator in plan(3, random.Random(seed))] for seed in (1, 1, 2)]
+
+        assert plans[0] == plans[1]
+        assert len(set(plans[0])) == 3
+        assert [plan(3, random.Random(seed)) for seed in range(5)] != [plan(3, random.Random(1))] * 5
+
+    def test_plan_weighted(self, monkeypatch):
+        weights = {"comment": 1.0, "reverse_booleans": 0.0}
+        monkeypatch.setattr(
+            modifiers_module,
+            "MUTATORS",
+            {name: MUTATORS[name]._replace(weight=weight) for name, weight in weights.items()},
+        )
+
+        for seed in range(20):
+            assert [mutator.name for mutator in plan(1, random.Random(seed))] == ["comment"]
+        assert len(plan(5, random.Random(0))) == 1
+
+    @pytest.mark.parametrize("difficulty", (1, 2, 3))
+    def test_output_seeded(self, difficulty: int):
+        code = test_input * 3
+        outputs = [Modifiers(code, difficulty, rng=random.Random(seed)).output for seed in (7, 7)]
+
+        assert outputs[0] == outputs[1]
@@ -0,0 +1,55 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from server.operations import compact, diff
+
+replacements = st.lists(
+    st.fixed_dictionaries(
+        {"from": st.integers(0, 40), "to": st.integers(0, 40), "value": st.text("ab\n", max_size=4)}
+    ),
+    max_size=20,
+)
+
+
+def apply(text: str, replacements) -> str:
+    for replacement in replacements:
+        text = text[: replacement["from"]] + replacement["value"] + text[replacement["to"] :]
+    return text
+
+
+class TestCompaction:
+    def test_typing_merged(self):
+        typed = [{"from": 5 + num, "to": 5 + num, "value": char} for num, char in enumerate("hello")]
+
+        assert compact(typed, 10) == [{"from": 5, "to": 5, "value": "hello"}]
+
+    def test_deleting_merged(self):
+        deleted = [{"from": 9 - num, "to": 10 - num, "value": ""} for num in range(4)]
+
+        assert compact(deleted, 10) == [{"from": 6, "to": 10, "value": ""}]
+
+    def test_typo_cancelled(self):
+        assert compact([{"from": 3, "to": 3, "value": "x"}, {"from": 3, "to": 4, "value": ""}], 5) == []
+
+    def test_distant_changes_kept(self):
+        changes = [{"from": 0, "to": 0, "value": "a"}, {"from": 10, "to": 10, "value": "b"}]
+
+        assert compact(changes, 10) == changes
+
+    @settings(max_examples=500)
+    @given(st.text("xyz\n", max_size=40), replacements)
+    def test_same_result(self, text: str, changes):
+        assert apply(text, compact(changes, len(text))) == apply(text, changes)
+
+
+class TestDiff:
+    def test_equal_texts(self):
+        assert diff("abc", "abc") == []
+
+    def test_changed_range(self):
+        assert diff("def f():\n    pass\n", "def g():\n    pass\n") == [{"from": 4, "to": 5, "value": "g"}]
+
+    @settings(max_examples=500)
+    @given(st.text("xyz\n", max_size=40), st.text("xyz\n", max_size=40))
+    def test_changes_into_new_text(self, old: str, new: str):
+        assert apply(old, diff(old, new)) == new
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import random
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from server import client as client_module
+from server.client import Client
+from server.connection_manager import ConnectionManager
+from server.events import ReplaceData, SyncData
+from server.ot import ClientDocument, apply, normalize, transform, transform_pair
+from tests.test_broadcast import create_room, drain
+
+replacements = st.lists(
+    st.fixed_dictionaries(
+        {"from": st.integers(0, 20), "to": st.integers(0, 20), "value": st.text("ab\n", max_size=4)}
+    ),
+    max_size=5,
+)
+
+
+class TestTransform:
+    def test_separate_ranges_moved(self):
+        first = {"from": 5, "to": 6, "value": "xyz"}
+        applied = {"from": 0, "to": 2, "value": ""}
+
+        assert transform_pair(first, applied) == ({"from": 3, "to": 4, "value": "xyz"}, applied)
+
+    def test_insertions_at_same_place_ordered(self):
+        first, applied = transform_pair({"from": 2, "to": 2, "value": "b"}, {"from": 2, "to": 2, "value": "a"})
+
+        assert apply(apply("xxxx", [{"from": 2, "to": 2, "value": "a"}]), [first]) == "xxabxx"
+        assert apply(apply("xxxx", [{"from": 2, "to": 2, "value": "b"}]), [applied]) == "xxabxx"
+
+    def test_overlapping_deletions(self):
+        first, applied = transform_pair({"from": 1, "to": 4, "value": ""}, {"from": 2, "to": 6, "value": ""})
+
+        assert apply("abcdefg", [{"from": 2, "to": 6, "value": ""}, first]) == "ag"
+        assert apply("abcdefg", [{"from": 1, "to": 4, "value": ""}, applied]) == "ag"
+
+    @settings(max_examples=500)
+    @given(st.text("xyz\n", max_size=20), replacements, replacements)
+    def test_same_result(self, text: str, first, second):
+        first, second = normalize(first, len(text)), normalize(second, len(text))
+        transformed, transformed_applied = transform(first, second)
+
+        assert apply(apply(text, second), transformed) == apply(apply(text, first), transformed_applied)
+
+
+class TestBatches:
+    def test_transformed_against_broadcast_changes(self):
+        async def run():
+            manager, (first, second) = await create_room(0, 0)
+            room = manager.rooms["CODE"]
+            room.set_code("x")
+            # Compacted together into a replacement of "x" by "a"
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 1, "to": 1, "value": "a"}], version=1))
+            manager.replace(first, "CODE", ReplaceData(code=[{"from": 0, "to": 1, "value": ""}], version=2))
+            manager.replace(second, "CODE", ReplaceData(code=[{"from": 0, "to": 1, "value": "b"}], version=1))
+            await asyncio.sleep(manager.replace_batch_window * 2)
+            await drain([first, second])
+            for client in (first, second):
+                client.stop()
+            return room.code, second
+
+        code, second = asyncio.run(run())
+        document = ClientDocument("x", 1)
+        document.edit([{"from": 0, "to": 1, "value": "b"}])
+        for event in second._websocket.sent:
+            document.receive(ReplaceData(**event["data"]))
+
+        assert [event["data"]["code"] for event in second._websocket.sent] == [
+            [{"from": 0, "to": 1, "value": "a"}],
+            [],
+        ]
+        assert document.code == code
+        assert document.pending is None
+
+
+class Typist:
+    """A client typing in a room, whose changes reach the server late."""
+
+    def __init__(self, manager: ConnectionManager, delay: float, download_delay: float = 0.0) -> None:
+        self.manager = manager
+        self.delay = delay
+        self.download_delay = download_delay
+        self.document = ClientDocument()
+        self.client = Client(self)  # type: ignore[arg-type]
+        self.sent_at: list[float] = []
+        self.latencies: list[float] = []
+        self.syncs = 0
+        self._upstream: asyncio.Queue[tuple[float, ReplaceData]] = asyncio.Queue()
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        if self.download_delay:
+            await asyncio.sleep(self.download_delay)
+        event = json.loads(text)
+        if event["type"] == "sync":
+            self.syncs += 1
+            self.document.sync(SyncData(**event["data"]))
+        elif event["type"] == "replace":
+            if not event["data"]["code"]:
+                self.latencies.append(asyncio.get_running_loop().time() - self.sent_at.pop(0))
+            self._send(self.document.receive(ReplaceData(**event["data"])))
+
+    def edit(self, rng: random.Random) -> None:
+        position = rng.randint(0, len(self.document.code))
+        if self.document.code and rng.random() < 0.3:
+            replacement = {"from": max(0, position - 1), "to": position, "value": ""}
+        else:
+            replacement = {"from": position, "to": position, "value": rng.choice("ab\n")}
+        self.sent_at.append(asyncio.get_running_loop().time())
+        self._send(self.document.edit([replacement]))
+
+    def _send(self, replace_data: ReplaceData | None) -> None:
+        if replace_data is not None:
+            self._upstream.put_nowait((asyncio.get_running_loop().time() + self.delay, replace_data))
+
+    async def forward(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            arrival, replace_data = await self._upstream.get()
+            await asyncio.sleep(max(0.0, arrival - loop.time()))
+            self.manager.replace(self.client, "CODE", replace_data)
+
+
+async def simulate(
+    delays: list[float], edits: int, interval: float, seed: int = 0, download_delays: list[float] | None = None
+) -> tuple[str, list[Typist]]:
+    rng = random.Random(seed)
+    manager = ConnectionManager()
+    download_delays = download_delays or [0.0] * len(delays)
+    typists = [Typist(manager, delay, download_delay) for delay, download_delay in zip(delays, download_delays)]
+    for num, typist in enumerate(typists):
+        typist.client.username = f"user{num}"
+        await typist.client.accept()
+        if num == 0:
+            manager.create_room(typist.client, "CODE", 1)
+        else:
+            manager.join_room(typist.client, "CODE")
+    forwarders = [asyncio.create_task(typist.forward()) for typist in typists]
+
+    for _ in range(edits):
+        for typist in typists:
+            typist.edit(rng)
+        await asyncio.sleep(interval)
+    # A client whose changes are never acknowledged would wait forever
+    for _ in range(1000):
+        if all(typist.document.pending is None and not typist.client.lag for typist in typists):
+            break
+        await asyncio.sleep(max(delays + download_delays))
+    await asyncio.sleep(manager.replace_batch_window * 4 + max(download_delays))
+
+    for task in forwarders:
+        task.cancel()
+    for typist in typists:
+        typist.client.stop()
+    return manager.rooms["CODE"].code, typists
+
+
+class TestConcurrentTypists:
+    def test_documents_converge(self):
+        code, typists = asyncio.run(simulate([0.001, 0.005, 0.01, 0.02], edits=50, interval=0.004))
+
+        assert len(code) > 50
+        for typist in typists:
+            assert typist.document.code == code
+            assert typist.syncs == 0
+            assert typist.document.pending is None
+
+    def test_lagging_typist_resynced(self, monkeypatch):
+        monkeypatch.setattr(client_module, "MAX_PENDING_MESSAGES", 4)
+        code, typists = asyncio.run(
+            simulate([0.001, 0.005, 0.01], edits=50, interval=0.002, download_delays=[0.0, 0.0, 0.01])
+        )
+
+        assert typists[2].syncs > 0
+        for typist in typists:
+            assert typist.document.code == code
+            assert typist.document.pending is None
+
+    def test_acknowledgement_latency(self):
+        _, typists = asyncio.run(simulate([0.005] * 4, edits=40, interval=0.02, seed=1))
+
+        latencies = sorted(latency for typist in typists for latency in typist.latencies)
+        assert len(latencies) == 4 * 40
+        assert latencies[int(len(latencies) * 0.99)] < 0.1
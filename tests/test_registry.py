@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from server.client import Client
+from server.connection_manager import ConnectionManager
+from server.errors import RoomAlreadyExistsError, RoomNotFoundError
+from server.registry import RoomRegistry, ShardStats
+from server.room import Room
+from tests.test_broadcast import FakeWebSocket
+
+
+def create_client() -> Client:
+    return Client(FakeWebSocket())  # type: ignore[arg-type]
+
+
+def create(registry: RoomRegistry, room_code: str, client: Client) -> tuple[Room, bool]:
+    return registry.create(room_code, lambda: Room(client.id, {client}, 1))
+
+
+class TestRoomRegistry:
+    def test_create_or_get(self):
+        registry = RoomRegistry()
+        first, second = create_client(), create_client()
+        room, created = create(registry, "CODE", first)
+        existing, created_again = create(registry, "CODE", second)
+
+        assert created and not created_again
+        assert existing is room
+        assert room.clients == {first}
+        assert len(registry) == 1
+
+    def test_factory_only_called_when_needed(self):
+        registry = RoomRegistry()
+        create(registry, "CODE", create_client())
+
+        def factory() -> Room:
+            raise AssertionError
+
+        registry.create("CODE", factory)
+
+    def test_join(self):
+        registry = RoomRegistry()
+        owner, guest = create_client(), create_client()
+        room, _ = create(registry, "CODE", owner)
+
+        assert registry.join("CODE", guest) is room
+        assert registry.join("OTHER", guest) is None
+        assert room.clients == {owner, guest}
+
+    def test_last_client_deletes_room(self):
+        registry = RoomRegistry()
+        owner, guest = create_client(), create_client()
+        create(registry, "CODE", owner)
+        registry.join("CODE", guest)
+
+        assert not registry.leave("CODE", owner)
+        assert registry.leave("CODE", guest)
+        assert "CODE" not in registry
+        assert not registry.leave("CODE", guest)
+
+    def test_rooms_spread_over_shards(self):
+        registry = RoomRegistry(shard_count=8)
+        for num in range(200):
+            create(registry, f"ROOM{num}", create_client())
+
+        stats = registry.stats()
+        assert len(stats) == 8
+        assert sum(shard.rooms for shard in stats) == 200
+        assert all(shard.rooms > 0 for shard in stats)
+        assert registry.shard_of("ROOM0") == RoomRegistry(shard_count=8).shard_of("ROOM0")
+
+    def test_stats(self):
+        registry = RoomRegistry(shard_count=1)
+        client = create_client()
+        room, _ = create(registry, "CODE", client)
+        registry.join("CODE", create_client())
+        room.set_code("hello\n")
+
+        assert registry.stats() == [ShardStats(rooms=1, clients=2, memory=room.memory_usage)]
+        assert room.memory_usage >= len("hello\n")
+
+    def test_iteration_survives_changes(self):
+        registry = RoomRegistry(shard_count=4)
+        client = create_client()
+        for num in range(20):
+            create(registry, f"ROOM{num}", client)
+
+        seen = set()
+        for room_code, _ in registry:
+            if room_code.startswith("ROOM"):
+                registry.remove(room_code)
+                create(registry, f"NEW{room_code}", client)
+            seen.add(room_code)
+
+        assert {f"ROOM{num}" for num in range(20)} <= seen
+        assert len(registry) == 20
+
+    def test_walk_lets_other_tasks_run(self):
+        async def run():
+            registry = RoomRegistry(shard_count=4)
+            client = create_client()
+            for num in range(20):
+                create(registry, f"ROOM{num}", client)
+
+            steps = []
+
+            async def other_task():
+                for _ in range(4):
+                    steps.append("other")
+                    await asyncio.sleep(0)
+
+            task = asyncio.create_task(other_task())
+            async for index, _ in registry.walk():
+                steps.append(index)
+            await task
+            return steps
+
+        steps = asyncio.run(run())
+        assert [step for step in steps if step != "other"] == [0, 1, 2, 3]
+        assert steps.index("other") < steps.index(3)
+
+
+class TestManagerRooms:
+    def test_create_and_join(self):
+        async def run():
+            manager = ConnectionManager()
+            owner, guest = create_client(), create_client()
+            room = manager.create_room(owner, "CODE", 1)
+            with pytest.raises(RoomAlreadyExistsError):
+                manager.create_room(guest, "CODE", 1)
+            with pytest.raises(RoomNotFoundError):
+                manager.join_room(guest, "OTHER")
+            joined = manager.join_room(guest, "CODE")
+
+            manager.disconnect(owner, "CODE")
+            manager.disconnect(guest, "CODE")
+            return manager, room, joined
+
+        manager, room, joined = asyncio.run(run())
+        assert joined is room
+        assert "CODE" not in manager.rooms
+        assert len(manager.bug_scheduler) == 0
@@ -0,0 +1,84 @@
+import random
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from server.modifiers import MUTATORS, Modifiers
+
+lines = st.lists(st.text("ab :()\t", max_size=12).map(lambda line: f"{line}\n"), min_size=1, max_size=15)
+sources = st.lists(
+    st.sampled_from(
+        [
+            "def f(x: int) -> bool:\n",
+            "    if x == 1 and y == 2:\n",
+            "        return [x, (True)]\n",
+            '    print("if x == 1:")\n',
+            "    return f(x) == g(False, str(x))\n",
+            "\n",
+        ]
+    ),
+    min_size=1,
+    max_size=12,
+)
+
+
+def apply(code: str, replacements: list[dict]) -> str:
+    for replacement in replacements:
+        code = code[: replacement["from"]] + replacement["value"] + code[replacement["to"] :]
+    return code
+
+
+class TestReplacements:
+    @settings(max_examples=300)
+    @given(st.data(), lines)
+    def test_same_document_as_modified_lines(self, data, file_contents: list[str]):
+        code = "".join(file_contents) + "tail"
+        modifier = Modifiers(code)
+        recorded = 0
+        for _ in range(data.draw(st.integers(0, 10))):
+            num = data.draw(st.integers(0, len(file_contents) - 1))
+            start = data.draw(st.integers(0, len(file_contents[num])))
+            stop = data.draw(st.integers(start, len(file_contents[num])))
+            recorded += modifier._edit(num, start, stop, data.draw(st.text("ab :()\n", max_size=4)))
+
+        replacements = modifier._get_replacements().code
+
+        assert apply(code, replacements) == "".join(modifier.modified_contents) + "tail"
+        assert len(replacements) == recorded
+
+    @settings(max_examples=200)
+    @given(sources, st.sampled_from(list(MUTATORS)), st.integers(1, 3), st.integers(0, 100))
+    def test_modifiers_replace_exact_columns(self, file_contents: list[str], name: str, difficulty: int, seed: int):
+        code = "".join(file_contents)
+        modifier = Modifiers(code, difficulty, rng=random.Random(seed))
+        MUTATORS[name].apply(modifier)
+
+        replacements = modifier._get_replacements().code
+        assert apply(code, replacements) == "".join(modifier.modified_contents)
+        for num, line in enumerate(file_contents):
+            if line != modifier.modified_contents[num]:
+                assert num in modifier.edits
+
+    def test_unchanged_lines_skipped(self):
+        modifier = Modifiers("a = 1\nb = 2\nc = 3\n")
+        modifier._edit(1, 5, 5, "2")
+
+        assert modifier._get_replacements().code == [{"from": 11, "to": 11, "value": "2"}]
+
+    def test_overlapping_edits_dropped(self):
+        modifier = Modifiers("if x == True:\n")
+
+        assert modifier._edit(0, 8, 12, "False")
+        assert not modifier._edit(0, 10, 14, "")
+        assert not modifier._edit(0, 8, 8, "(")
+        assert modifier._edit(0, 12, 13, "")
+        assert modifier.modified_contents == ["if x == False\n"]
+
+    def test_only_tokens_replaced(self):
+        modifier = Modifiers('print("x == 1", x == 1, d[1:2]) or True\nfor x in y: pass\n')
+        modifier.difficulty = 2
+        modifier.break_equals_statement()
+        modifier.remove_end_colon()
+        modifier.reverse_booleans()
+
+        assert modifier.modified_contents == ['print("x == 1", x = 1, d[1:2]) or False\n', "for x in y: pass\n"]
@@ -0,0 +1,41 @@
+from hypothesis import given
+from hypothesis import strategies as st
+
+from server.rope import CHUNK_SIZE, Rope
+
+replacements = st.lists(
+    st.tuples(st.integers(-50, 3000), st.integers(-50, 3000), st.text(max_size=CHUNK_SIZE * 2)), max_size=30
+)
+
+
+class TestRope:
+    def test_empty(self):
+        rope = Rope()
+        assert str(rope) == ""
+        assert len(rope) == 0
+
+    def test_insert_delete(self):
+        rope = Rope("def f():\n    pass\n")
+        rope.replace(4, 5, "main")
+        rope.replace(16, 20, "return")
+
+        assert str(rope) == "def main():\n    return\n"
+
+    def test_large_document(self):
+        text = "x = 1\n" * 10_000
+        rope = Rope(text)
+        rope.replace(30_000, 30_000, "# middle\n")
+
+        assert len(rope) == len(text) + 9
+        assert str(rope) == text[:30_000] + "# middle\n" + text[30_000:]
+        assert rope[30_000:30_009] == "# middle\n"
+
+    @given(st.text(max_size=CHUNK_SIZE * 4), replacements)
+    def test_same_as_string_slicing(self, text: str, edits: list[tuple[int, int, str]]):
+        rope = Rope(text)
+        for start, stop, value in edits:
+            text = text[:start] + value + text[stop:]
+            rope.replace(start, stop, value)
+
+            assert len(rope) == len(text)
+        assert str(rope) == text
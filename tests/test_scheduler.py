@@ -0,0 +1,131 @@
+import asyncio
+from collections import Counter
+
+from server.scheduler import BUG_INTERVALS, BugScheduler
+from tests.test_broadcast import create_room
+
+
+def create_scheduler(jitter: float = 0.0) -> tuple[BugScheduler, list[tuple[int, str]]]:
+    calls: list[tuple[int, str]] = []
+    ticks = 0
+
+    async def callback(room_code: str) -> None:
+        calls.append((ticks, room_code))
+
+    scheduler = BugScheduler(callback, wheel_size=16, jitter=jitter)
+    original_advance = scheduler.advance
+
+    async def advance() -> None:
+        nonlocal ticks
+        ticks += 1
+        await original_advance()
+
+    scheduler.advance = advance  # type: ignore[method-assign]
+    return scheduler, calls
+
+
+async def advance(scheduler: BugScheduler, ticks: int) -> None:
+    for _ in range(ticks):
+        await scheduler.advance()
+
+
+class TestBugScheduler:
+    def test_interval_of_difficulty(self):
+        scheduler, calls = create_scheduler()
+        for difficulty in BUG_INTERVALS:
+            scheduler.add(f"ROOM{difficulty}", difficulty)
+
+        asyncio.run(advance(scheduler, 120))
+
+        assert calls == [
+            (30, "ROOM3"),
+            (45, "ROOM2"),
+            (60, "ROOM1"),
+            (60, "ROOM3"),
+            (90, "ROOM2"),
+            (90, "ROOM3"),
+            (120, "ROOM1"),
+            (120, "ROOM3"),
+        ]
+
+    def test_jitter_spreads_rooms(self):
+        scheduler, calls = create_scheduler(jitter=0.1)
+        for num in range(1000):
+            scheduler.add(f"ROOM{num}", 1)
+
+        asyncio.run(advance(scheduler, 66))
+
+        per_tick = Counter(tick for tick, _ in calls)
+        assert len(calls) == 1000
+        assert min(per_tick) >= 54 and max(per_tick) <= 66
+        assert max(per_tick.values()) < 200
+
+    def test_removed_room(self):
+        scheduler, calls = create_scheduler()
+        scheduler.add("ROOM", 3)
+        scheduler.add("ROOM", 3)
+        scheduler.add("OTHER", 3)
+        scheduler.remove("OTHER")
+
+        asyncio.run(advance(scheduler, 30))
+
+        assert calls == [(30, "ROOM")]
+        assert len(scheduler) == 1
+
+    def test_failing_callback(self):
+        async def callback(room_code: str) -> None:
+            raise RuntimeError(room_code)
+
+        scheduler = BugScheduler(callback, wheel_size=16, jitter=0)
+        scheduler.add("ROOM", 3)
+
+        asyncio.run(advance(scheduler, 60))
+
+        assert len(scheduler) == 1
+
+    def test_started_wheel(self):
+        async def run():
+            done = asyncio.Event()
+
+            async def callback(_: str) -> None:
+                done.set()
+
+            scheduler = BugScheduler(callback, {1: 0.05}, tick=0.01)
+            scheduler.add("ROOM", 1)
+            scheduler.start()
+            await asyncio.wait_for(done.wait(), 1)
+            await scheduler.stop()
+
+        asyncio.run(run())
+
+
+class TestRoomBugs:
+    def test_bugs_sent_once_to_every_client(self):
+        async def run():
+            manager, clients = await create_room(0, 0, 0)
+            # Some seeds don't introduce any bug in such a short code
+            manager.rooms["CODE"].rng.seed(0)
+            manager.rooms["CODE"].set_code("def f():\n    return 1 == 1\n")
+            await manager.send_bugs("CODE")
+            await asyncio.sleep(0.01)
+            for client in clients:
+                client.stop()
+            return manager, clients
+
+        manager, clients = asyncio.run(run())
+        room = manager.rooms["CODE"]
+        for client in clients:
+            assert [event["type"] for event in client._websocket.sent] == ["replace"]
+            assert client._websocket.sent[0]["data"]["version"] == room.version
+        assert len(manager.bug_scheduler) == 1
+
+    def test_room_unscheduled_when_empty(self):
+        async def run():
+            manager, clients = await create_room(0, 0)
+            for client in clients:
+                manager.disconnect(client, "CODE")
+                client.stop()
+            return manager
+
+        manager = asyncio.run(run())
+        assert len(manager.bug_scheduler) == 0
@@ -0,0 +1,166 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from server.codes import StatusCode
+from server.errors import (
+    EvaluationBusyError,
+    EvaluationFailedError,
+    EvaluationTimeoutError,
+)
+from server.event_handler import EventHandler
+from server.snekbox import SnekboxPool
+from tests.test_broadcast import create_room, drain
+
+
+def fake_snekbox(delay: float = 0.0) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        code = json.loads(request.content)["input"]
+        return httpx.Response(200, json={"stdout": f"ran {code}", "returncode": 0})
+
+    return httpx.MockTransport(handler)
+
+
+def failing_snekbox(down: bool = False) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if down:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(500, text="Internal Server Error")
+
+    return httpx.MockTransport(handler)
+
+
+class TestSnekboxPool:
+    def test_evaluate(self):
+        async def run():
+            pool = SnekboxPool(transport=fake_snekbox())
+            result = await pool.evaluate("print(1)")
+            await pool.aclose()
+            return result
+
+        assert asyncio.run(run()) == "ran print(1)"
+
+    def test_concurrency_limit(self):
+        async def run():
+            pool = SnekboxPool(max_concurrency=2, max_queue_size=10, transport=fake_snekbox(0.05))
+            tasks = [asyncio.create_task(pool.evaluate(str(i))) for i in range(4)]
+            await asyncio.sleep(0.01)
+            pending = pool.pending
+            results = await asyncio.gather(*tasks)
+            await pool.aclose()
+            return pending, results, pool.pending
+
+        pending, results, remaining = asyncio.run(run())
+        assert pending == 4
+        assert results == [f"ran {i}" for i in range(4)]
+        assert remaining == 0
+
+    def test_busy_when_queue_full(self):
+        async def run():
+            pool = SnekboxPool(max_concurrency=1, max_queue_size=1, transport=fake_snekbox(0.05))
+            tasks = [asyncio.create_task(pool.evaluate(str(i))) for i in range(2)]
+            await asyncio.sleep(0.01)
+            try:
+                with pytest.raises(EvaluationBusyError):
+                    await pool.evaluate("refused")
+            finally:
+                await asyncio.gather(*tasks)
+                await pool.aclose()
+
+        asyncio.run(run())
+
+    def test_timeout(self):
+        async def run():
+            pool = SnekboxPool(timeout=0.01, transport=fake_snekbox(1))
+            try:
+                with pytest.raises(EvaluationTimeoutError):
+                    await pool.evaluate("while True: pass")
+            finally:
+                await pool.aclose()
+            return pool.pending
+
+        assert asyncio.run(run()) == 0
+
+    def test_cancel_room(self):
+        async def run():
+            pool = SnekboxPool(transport=fake_snekbox(1))
+            results = []
+
+            async def evaluate():
+                results.append(await pool.evaluate("slow"))
+
+            task = pool.schedule("CODE", evaluate())
+            await asyncio.sleep(0.01)
+            pool.cancel("CODE")
+            await asyncio.gather(task, return_exceptions=True)
+            await pool.aclose()
+            return task, results, pool.pending
+
+        task, results, pending = asyncio.run(run())
+        assert task.cancelled()
+        assert results == []
+        assert pending == 0
+
+    def test_cached_result(self):
+        async def run():
+            pool = SnekboxPool(transport=fake_snekbox())
+            results = [await pool.evaluate("print(1)") for _ in range(3)]
+            await pool.aclose()
+            return pool, results
+
+        pool, results = asyncio.run(run())
+        assert results == ["ran print(1)"] * 3
+        assert (pool.cache.hits, pool.cache.misses) == (2, 1)
+
+    def test_coalesced_requests(self):
+        requests = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"stdout": "done"})
+
+        async def run():
+            pool = SnekboxPool(transport=httpx.MockTransport(handler))
+            results = await asyncio.gather(*(pool.evaluate("same") for _ in range(10)))
+            await pool.aclose()
+            return pool, results
+
+        pool, results = asyncio.run(run())
+        assert results == ["done"] * 10
+        assert len(requests) == 1
+        assert pool.coalesced == 9
+
+    def test_failures(self):
+        async def run(down: bool):
+            pool = SnekboxPool(transport=failing_snekbox(down))
+            try:
+                with pytest.raises(EvaluationFailedError):
+                    await pool.evaluate("print(1)")
+            finally:
+                await pool.aclose()
+            return pool
+
+        for down in (True, False):
+            pool = asyncio.run(run(down))
+            assert pool.pending == 0
+            assert len(pool.cache) == 0
+
+    def test_failure_sent_to_client(self):
+        async def run():
+            manager, clients = await create_room(0)
+            pool = SnekboxPool(transport=failing_snekbox(down=True))
+            handler = EventHandler(clients[0], manager, pool)
+            handler.room_code, handler.room = "CODE", manager.rooms["CODE"]
+            await pool.schedule("CODE", handler._evaluate("print(1)"))
+            await drain(clients)
+            clients[0].stop()
+            await pool.aclose()
+            return clients[0]._websocket.sent
+
+        (event,) = asyncio.run(run())
+        assert event["type"] == "evaluate"
+        assert event["status_code"] == StatusCode.EVALUATION_FAILED
@@ -0,0 +1,91 @@
+from uuid import uuid4
+
+from server.events import ReplaceData
+from server.modifiers import Modifiers
+from server.room import Room
+from server.token_index import TokenCache, TokenIndex
+
+
+def lines(code: str) -> list[str]:
+    return code.splitlines(keepends=True)
+
+
+class TestTokenIndex:
+    def test_no_match_inside_names_or_strings(self):
+        index = TokenIndex(lines('print("in", strip)\nfor x in range(3):\n'))
+
+        assert index.keywords == [(1, "for"), (1, "in")]
+        assert index.types == []
+        assert index.brackets == {0: [(5, "("), (17, ")")], 1: [(14, "("), (16, ")")]}
+
+    def test_index_candidates(self):
+        index = TokenIndex(lines("async def f(a: int) -> bool:\n    return a == 1 and True\n"))
+
+        assert index.defs == [(0, "f")]
+        assert index.types == [(0, "int"), (0, "bool")]
+        assert index.booleans == [(1, "True")]
+        assert index.equals_lines == [1]
+        assert index.colon_lines == [0]
+        assert index.indented_lines == [1]
+
+    def test_broken_code(self):
+        index = TokenIndex(lines("def f(:\n        x = (1\n    if y == 2\n  return False\n"))
+
+        assert index.keywords == [(0, "def"), (2, "if"), (3, "return"), (3, "False")]
+        assert index.equals_lines == [2]
+        assert index.defs == [(0, "f")]
+
+    def test_keyword_changed_as_a_whole_word(self):
+        modifier = Modifiers("print(1 in [1])\n")
+        modifier.change_keyword()
+
+        assert modifier.modified_contents[0].startswith("print(1 ")
+        assert " in " not in modifier.modified_contents[0]
+
+    def test_no_match_inside_multiline_strings(self):
+        index = TokenIndex(lines('def f():\n    """Return\n    True if x == 1 (or not)."""\n    return True\n'))
+
+        assert index.keywords == [(0, "def"), (3, "return"), (3, "True")]
+        assert index.equals_lines == []
+        assert index.brackets == {0: [(5, "("), (6, ")")]}
+
+    def test_call_sites(self):
+        code = 'def f(x):\n    return f(x) + self.f (x)\nprint("f(1)", g(f(2)))  # f(3)\nff(4)\n'
+        index = TokenIndex(lines(code))
+
+        assert index.calls == {"f": [(1, 11), (2, 16)], "print": [(2, 0)], "g": [(2, 14)], "ff": [(3, 0)]}
+        assert index.defs == [(0, "f")]
+
+
+class TestTokenCache:
+    def test_only_changed_lines_scanned(self):
+        cache = TokenCache()
+        code = ["def f():\n", "    return 1\n", "\n", "f()\n"]
+        cache.index(code)
+
+        code[1] = "    return 1 == 2\n"
+        index = cache.index(code)
+
+        assert (cache.hits, cache.misses) == (3, 5)
+        assert index.equals_lines == [1]
+        assert len(cache) == 4
+
+    def test_lines_after_opened_string_scanned(self):
+        cache = TokenCache()
+        cache.index(["x = 1\n", "if x == 1:\n"])
+
+        index = cache.index(["x = '''\n", "if x == 1:\n"])
+
+        assert cache.misses == 4
+        assert index.keywords == []
+
+    def test_room_index_rebuilt_after_changes(self):
+        room = Room(uuid4(), set(), 1)
+        room.set_code("x = 1\n")
+        index = room.token_index
+        assert room.token_index is index
+
+        room.update_code(ReplaceData(code=[{"from": 5, "to": 5, "value": " == True"}]))
+
+        assert room.token_index is not index
+        assert room.token_index.booleans == [(0, "True")]